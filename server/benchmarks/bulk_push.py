@@ -0,0 +1,69 @@
+"""N single pushes vs. one bulk push.
+
+Run from the project root, `python -m benchmarks.bulk_push`.
+"""
+from __future__ import annotations
+
+import asyncio as aio
+import time
+
+from server.services.channel import (
+    BaseUserConnection,
+    Channel,
+    ChannelController,
+    ChannelPolicy,
+    Object,
+    Position,
+    User,
+)
+
+USERS = 50
+OBJECTS = 200
+
+
+class NullConnection(BaseUserConnection):
+    async def send(self, data):
+        await aio.sleep(0)
+
+
+def make_channel() -> tuple[Channel, User]:
+    controller = ChannelController()
+    channel = controller.create_channel(
+        "bench", ChannelPolicy(max_objects=OBJECTS, max_batch=OBJECTS, max_ccu=USERS)
+    )
+    for n in range(USERS):
+        user = User(id=str(n), nickname=str(n), connection=NullConnection())
+        channel.users[user.id] = user
+    return channel, channel.users["0"]
+
+
+def make_objects() -> list[Object]:
+    return [
+        Object(
+            id=str(n), url="/decos/bauble.png", comment="", position=Position(x=n, y=n)
+        )
+        for n in range(OBJECTS)
+    ]
+
+
+async def single():
+    channel, user = make_channel()
+    for obj in make_objects():
+        await channel.push_object(obj, user)
+
+
+async def bulk():
+    channel, user = make_channel()
+    await channel.push_objects(make_objects(), user)
+
+
+def main():
+    for name, bench in (("single", single), ("bulk", bulk)):
+        started = time.perf_counter()
+        aio.run(bench())
+        elapsed = time.perf_counter() - started
+        print(f"{name:<8} {OBJECTS} objects to {USERS} users: {elapsed * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
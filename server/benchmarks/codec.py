@@ -0,0 +1,49 @@
+"""Pydantic vs. hand written event construction and encoding.
+
+Run from the project root, `python -m benchmarks.codec`.
+"""
+from __future__ import annotations
+
+import json
+import timeit
+
+from server.services.channel import (
+    BaseUserConnection,
+    Object,
+    Position,
+    PushObjectEvent,
+    User,
+)
+from server.services.codec import decode_event, parse_event
+
+NUMBER = 20_000
+
+user = User(id="1", nickname="활발한 INFP 고양이", connection=BaseUserConnection())
+obj = Object(
+    id="obj", url="/decos/bauble.png", comment="메리", position=Position(x=1, y=2)
+)
+event = PushObjectEvent(appender=user, object=obj, pop=None)
+data = json.loads(event.json())
+
+CASES = {
+    "construct": (
+        lambda: PushObjectEvent(appender=user, object=obj, pop=None),
+        lambda: PushObjectEvent.construct(appender=user.info(), object=obj, pop=None),
+    ),
+    "encode": (event.json, event.dumps),
+    "decode": (lambda: parse_event(data), lambda: decode_event(data)),
+}
+
+
+def main():
+    for name, (pydantic, fast) in CASES.items():
+        slow_time = timeit.timeit(pydantic, number=NUMBER)
+        fast_time = timeit.timeit(fast, number=NUMBER)
+        print(
+            f"{name:<10} pydantic {NUMBER / slow_time:>10,.0f}/s"
+            f"  fast {NUMBER / fast_time:>10,.0f}/s  x{slow_time / fast_time:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Cold start benchmark of the app module.
+
+Run from the project root, `python -m benchmarks.cold_start`.
+Compiling requires an initialized `.web` directory.
+"""
+from __future__ import annotations
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import reflex as rx
+
+RUNS = 5
+
+
+def measure(code: str, env: dict[str, str]) -> list[float]:
+    elapsed = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        elapsed.append(time.perf_counter() - started)
+    return elapsed
+
+
+def report(name: str, elapsed: list[float]):
+    print(
+        f"{name:<16} median {statistics.median(elapsed) * 1000:8.1f}ms"
+        f"  min {min(elapsed) * 1000:8.1f}ms"
+    )
+
+
+def main():
+    env = dict(os.environ)
+    report("import reflex", measure("import reflex", env))
+    report(
+        "backend only",
+        measure(
+            "import server.server",
+            {**env, rx.constants.SKIP_COMPILE_ENV_VAR: "yes"},
+        ),
+    )
+    if not os.path.exists(".web"):
+        print("Skipping compile benchmarks, run `reflex init` first.")
+        return
+
+    from server.common.frontend import SOURCE_HASH_FILE
+
+    def compile_from_scratch():
+        SOURCE_HASH_FILE.unlink(missing_ok=True)
+        subprocess.run([sys.executable, "-c", "import server.server"], check=True)
+
+    compile_from_scratch()
+    report("cached frontend", measure("import server.server", env))
+    elapsed = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        compile_from_scratch()
+        elapsed.append(time.perf_counter() - started)
+    report("full compile", elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Memory held per connected canvas session.
+
+Run from the project root, `python -m benchmarks.memory`.
+Compares sessions keeping their own copy of the objects and every event
+message with sessions sharing the channel's snapshot and capped events.
+"""
+from __future__ import annotations
+
+import gc
+import os
+import sys
+import tracemalloc
+
+import reflex as rx
+
+SESSIONS = 1000
+OBJECTS = 30
+EVENTS = 100
+
+
+def measure(name: str, connect):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [connect(n) for n in range(SESSIONS)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{name:<8} {used / SESSIONS:10,.0f} bytes/user")
+    return sessions
+
+
+def main():
+    os.environ.setdefault(rx.constants.SKIP_COMPILE_ENV_VAR, "yes")
+    import server.server  # noqa: F401
+
+    canvas = sys.modules["server.pages.canvas"]
+    from server.services.channel import Object, Position
+
+    channel = canvas.controller.create_channel("/benchmark")
+    for n in range(OBJECTS):
+        obj = Object(
+            id=str(n),
+            url="/decos/bauble.png",
+            comment="메리 크리스마스",
+            position=Position(x=n, y=n),
+        )
+        channel.objects[obj.id] = obj
+    channel.snapshot.invalidate()
+    messages = [f"user{n} 님이 새로 트리를 장식했어요!" for n in range(EVENTS)]
+
+    def copied(n: int):
+        state = canvas.CanvasState()
+        state._channel = channel
+        # Previous layout, a copy of objects and every event per session.
+        state.__dict__["copied_objects"] = canvas.to_rx_objects(channel.object_list())
+        state.events = list(messages)
+        return state
+
+    def shared(n: int):
+        state = canvas.CanvasState()
+        state._channel = channel
+        state.objects_version = channel.version
+        state.events = messages[-state.MAX_EVENTS :]
+        state.objects  # noqa: B018
+        return state
+
+    measure("copied", copied)
+    measure("shared", shared)
+
+
+if __name__ == "__main__":
+    main()
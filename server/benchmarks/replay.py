@@ -0,0 +1,70 @@
+"""Replay a channel trace as fast as possible.
+
+Run from the project root, `python -m benchmarks.replay [trace.jsonl]`.
+Without a trace, a synthetic one is generated: users join a tree, each
+pushes objects a few times, and leave.
+"""
+from __future__ import annotations
+
+import random
+import sys
+from datetime import datetime
+
+from server.services.channel import Object, Position, UserInfo
+from server.services.replay import Command, read_trace, run_replay
+
+TREES = 20
+USERS = 10
+PUSHES = 5
+
+
+def synthetic_trace() -> list[Command]:
+    rd = random.Random(1225)
+    commands = []
+    for tree in range(TREES):
+        for n in range(USERS):
+            user = UserInfo(id=f"{tree}-{n}", nickname=str(n))
+            at = rd.uniform(0, 60)
+            commands.append(Command(at=at, op="join", channel_id=f"/{tree}", user=user))
+            for push in range(PUSHES):
+                at += rd.uniform(1, 30)
+                obj = Object(
+                    id=f"{user.id}-{push}",
+                    url="/decos/bauble.png",
+                    comment="메리 크리스마스",
+                    created_at=datetime(2023, 12, 25),
+                    position=Position(x=rd.randrange(400), y=rd.randrange(800)),
+                )
+                commands.append(
+                    Command(
+                        at=at,
+                        op="push-object",
+                        channel_id=f"/{tree}",
+                        user=user,
+                        objects=[obj],
+                    )
+                )
+            at += rd.uniform(1, 30)
+            commands.append(
+                Command(at=at, op="leave", channel_id=f"/{tree}", user=user)
+            )
+    return sorted(commands, key=lambda command: command.at)
+
+
+def main():
+    commands = list(read_trace(sys.argv[1])) if len(sys.argv) > 1 else synthetic_trace()
+    stats = run_replay(commands)
+    total = sum(op.count for op in stats.ops.values())
+    print(
+        f"{total} commands, {stats.virtual_time:.1f}s virtual"
+        f" in {stats.wall_time * 1000:.1f}ms ({total / stats.wall_time:,.0f}/s)"
+    )
+    for name, op in stats.ops.items():
+        print(
+            f"{name:<14} {op.count:>6}  latency {op.latency / op.count * 1000:8.3f}ms"
+        )
+    print(f"{stats.received} events received")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,4 +2,18 @@ import reflex as rx
 
 config = rx.Config(
     app_name="server",
+    channel_policy_file="policies.toml",
+    history_db="history.db",
+    # Days of history kept for views of the past
+    history_retention_days=90,
+    # "atlas" draws decorations on one canvas, "dom" renders an image each.
+    deco_rendering="atlas",
+    # Fraction of pushes traced, see /traces
+    trace_sample_rate=0.01,
+    # Channel commands appended for replay, empty to not record
+    trace_record_file="",
+    # Unix socket for handing channels over to the next worker on deploy
+    handoff_socket="handoff.sock",
+    # Words masked in comments, one per line
+    profanity_file="profanity.txt",
 )
\ No newline at end of file
@@ -1,28 +1,299 @@
 """Channel API."""
 from __future__ import annotations
 
-from fastapi import APIRouter, WebSocket
+import asyncio as aio
+import json
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi import APIRouter, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from server.common.nickname import generate_random_nickname
+from server.pages.canvas import controller
+from server.services.channel import (
+    BaseEvent,
+    BaseUserConnection,
+    Channel,
+    CursorEvent,
+    DeleteObjectEvent,
+    EditCommentEvent,
+    ErrorEvent,
+    MoveObjectEvent,
+    PushObjectEvent,
+    PushObjectsEvent,
+    User,
+)
+from server.services.codec import (
+    SnapshotEncoder,
+    binary_snapshot,
+    deflated_binary_snapshot,
+    encode_binary,
+    parse_binary,
+    parse_event,
+)
+from server.services.directory import Ranking, TreeSummary
+from server.services.history import HistoryPage
+from server.services.multiplex import Multiplexer
+from server.services.tasks import TaskStats
 
 router = APIRouter(prefix="/channel")
 
 
-class WebsocketConnection:
+class WebsocketConnection(BaseUserConnection):
+    """Websocket user connection.
+
+    Client picks the protocol at handshake, `json` by default or compact
+    `binary` (see `server.services.codec`), and may ask for `deflate`
+    compression of snapshots. Clients offering the permessage-deflate
+    extension, which uvicorn accepts by default, get every message
+    compressed by the server instead, so snapshots aren't deflated twice.
+
+    The handshake reply has the user id, a secret `resume` token and the
+    channel version. When the server restarts, the connection is closed
+    with code 1012 and clients reconnect with `resume` set to the token and
+    `version` to the last version, which they count up on every object
+    event. Up to date clients don't get a snapshot again.
+    """
+
+    PROTOCOLS = ("json", "binary")
     ws: WebSocket
+    protocol: str = "json"
+    snapshots: SnapshotEncoder
 
-    async def handshake(self):
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+
+    async def handshake(self) -> dict:
         await self.ws.accept()
 
-        await self.ws.receive_json()
+        hello = await self.ws.receive_json()
+        if hello.get("protocol") in self.PROTOCOLS:
+            self.protocol = hello["protocol"]
+        self.snapshots = SnapshotEncoder(
+            compress=hello.get("compression") == "deflate"
+            and not self.per_message_deflate()
+        )
+        return hello
+
+    def per_message_deflate(self) -> bool:
+        """Whether the client offered the permessage-deflate extension."""
+        offers = self.ws.headers.get("sec-websocket-extensions", "")
+        return any(
+            offer.split(";")[0].strip() == "permessage-deflate"
+            for offer in offers.split(",")
+        )
+
+    async def welcome(self, user: User, channel: Channel, resumed: bool):
+        await self.ws.send_json(
+            {
+                "protocol": self.protocol,
+                "compression": "deflate" if self.snapshots.compress else None,
+                "user": user.id,
+                "resume": user.resume_token,
+                "version": channel.version,
+                "resumed": resumed,
+            }
+        )
+
+    async def receive(self) -> BaseEvent:
+        while True:
+            message = await self.ws.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message["code"])
+            try:
+                if message.get("bytes") is not None:
+                    return parse_binary(message["bytes"])
+                return parse_event(json.loads(message["text"]))
+            # Malformed events are refused, without dropping the connection.
+            # Bad JSON, UTF-8 and validation errors are all ValueError.
+            except (ValueError, IndexError, KeyError, OverflowError):
+                await self.send(ErrorEvent.construct(code="invalid", message="invalid"))
 
-        await self.ws.send_json()
+    async def send(self, event: BaseEvent):
+        if self.protocol == "binary":
+            await self.ws.send_bytes(encode_binary(event))
+        else:
+            await self.ws.send_text(event.dumps())
 
-    async def receive(self, event):
-        ...
+    async def send_snapshot(self, channel: Channel):
+        if self.protocol == "binary":
+            build = (
+                deflated_binary_snapshot if self.snapshots.compress else binary_snapshot
+            )
+            message = channel.view(build)
+        else:
+            message = self.snapshots.dumps_channel(channel)
 
-    async def send(self, event):
-        ...
+        if isinstance(message, bytes):
+            await self.ws.send_bytes(message)
+        else:
+            await self.ws.send_text(message)
 
+    async def close(self):
+        # Service restart, clients should reconnect.
+        await self.ws.close(code=1012)
 
-@router.get("/@{channel_name}")
+
+@router.websocket("/@{channel_name:path}")
 async def channel_api(channel_name: str, ws: WebSocket):
-    ...
+    conn = WebsocketConnection(ws)
+    hello = await conn.handshake()
+    tree_id = f"/{channel_name}"
+    resume = hello.get("resume")
+    if isinstance(resume, str):
+        channel = controller.resume_channel(tree_id, resume)
+    else:
+        channel = None
+    if channel is not None:
+        info = channel.resuming[resume]
+        user = User(id=info.id, nickname=info.nickname, connection=conn)
+        channel.resume(resume, user)
+        await conn.welcome(user, channel, resumed=True)
+        if hello.get("version") != channel.version:
+            await conn.send_snapshot(channel)
+    else:
+        channel = controller.assign_channel(tree_id)
+        user = User(
+            id=str(uuid4()),
+            nickname=hello.get("nickname") or generate_random_nickname(),
+            connection=conn,
+        )
+        await conn.welcome(user, channel, resumed=False)
+        await conn.send_snapshot(channel)
+        await channel.join(user)
+        if user.id not in channel.users and user.id not in channel.waiting:
+            # Refused with an error event, try again later.
+            await ws.close(code=1013)
+            return
+    try:
+        while True:
+            # Appender, editor, pops and stamps from clients are ignored, and
+            # objects are created now.
+            match await conn.receive():
+                case PushObjectEvent(object=obj):
+                    trace_id = controller.tracer.start()
+                    obj = obj.copy(update={"created_at": datetime.now()})
+                    await channel.push_object(obj, user, trace_id)
+                case PushObjectsEvent(objects=objs):
+                    trace_id = controller.tracer.start()
+                    now = datetime.now()
+                    objs = [obj.copy(update={"created_at": now}) for obj in objs]
+                    await channel.push_objects(objs, user, trace_id)
+                case CursorEvent(x=x, y=y):
+                    channel.report_cursor(user, x, y)
+                case (
+                    MoveObjectEvent() | EditCommentEvent() | DeleteObjectEvent()
+                ) as edit:
+                    edit = edit.copy(update={"stamp": None})
+                    await channel.edit_object(edit, user, controller.tracer.start())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await channel.leave(user)
+
+
+@router.websocket("/spectate/{channel_id:path}")
+async def spectate_api(channel_id: str, ws: WebSocket):
+    """Read-only stream of object updates, already encoded by channel."""
+    channel = controller.assign_channel(f"/{channel_id}")
+    await ws.accept()
+
+    async def forward():
+        async for message in channel.spectate():
+            await ws.send_text(message)
+        await ws.close()
+
+    forwarding = aio.create_task(forward())
+    try:
+        while True:
+            # Spectators send nothing, this only waits for disconnection.
+            await ws.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        forwarding.cancel()
+
+
+@router.websocket("/mux")
+async def multiplex_api(ws: WebSocket):
+    """Subscriptions to many channels over one socket, see `Multiplexer`."""
+    await ws.accept()
+    mux = Multiplexer(controller)
+
+    async def forward():
+        while True:
+            await ws.send_text(await mux.outbox.get())
+
+    forwarding = aio.create_task(forward())
+    try:
+        while True:
+            try:
+                data = json.loads(await ws.receive_text())
+            except json.JSONDecodeError:
+                data = None
+            mux.handle(data)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        forwarding.cancel()
+        mux.close()
+
+
+@router.get("/history/stream/{channel_id:path}")
+async def history_stream_api(channel_id: str):
+    """Whole history as newline delimited JSON, oldest first."""
+    objects = controller.history.iter_history(f"/{channel_id}")
+    # Sync iterators are consumed in threadpool.
+    return StreamingResponse(
+        (obj.json() + "\n" for obj in objects), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/history/{channel_id:path}", response_model=HistoryPage)
+async def history_api(
+    channel_id: str, at: datetime | None = None, before: int | None = None
+):
+    """Page through placed objects, or the objects shown at `at`."""
+    channel_id = f"/{channel_id}"
+    if at is not None:
+        limit = controller.get_policy(channel_id).max_objects
+        objects = await aio.to_thread(controller.history.as_of, channel_id, at, limit)
+        return HistoryPage(objects=objects, next=None)
+    return await aio.to_thread(controller.history.page, channel_id, before)
+
+
+@router.get("/preview/{channel_id:path}")
+async def preview_api(channel_id: str, request: Request):
+    """Tree with its current decorations as one SVG image, for browsers.
+
+    Link unfurls and `og:image` consumers mostly render raster images only,
+    so don't advertise this there until previews are rasterized.
+    """
+    preview = await controller.previews.render(f"/{channel_id}", controller)
+    headers = {"ETag": f'"{preview.etag}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(preview.svg, media_type="image/svg+xml", headers=headers)
+
+
+@router.get("/directory", response_model=list[TreeSummary])
+async def directory_api(by: Ranking = "trending", k: int = 20):
+    """Top trees by recent pushes or by users."""
+    return controller.directory.top(min(k, 100), by)
+
+
+@router.get("/directory/search", response_model=list[TreeSummary])
+async def directory_search_api(prefix: str, limit: int = 20):
+    return controller.directory.search(prefix, min(limit, 100))
+
+
+@router.get("/tasks", response_model=dict[str, TaskStats])
+async def task_stats():
+    return controller.tasks.stats
+
+
+@router.get("/traces")
+async def traces_api():
+    """Recently sampled spans as OTLP JSON, for offline analysis."""
+    return controller.tracer.encode()
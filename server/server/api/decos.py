@@ -0,0 +1,21 @@
+"""Decoration API."""
+from __future__ import annotations
+
+from fastapi import APIRouter, Request, Response
+
+from server.pages.canvas import get_atlas
+
+router = APIRouter(prefix="/decos")
+
+
+@router.get("/atlas.svg")
+async def atlas_api(request: Request):
+    """Sprite atlas of preset decorations, versioned by its hash."""
+    atlas = get_atlas()
+    headers = {
+        "ETag": f'"{atlas.hash}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(atlas.svg, media_type="image/svg+xml", headers=headers)
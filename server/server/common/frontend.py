@@ -0,0 +1,65 @@
+"""Reuse compiled frontend while the sources are unchanged."""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+
+import reflex as rx
+from reflex.page import DECORATED_PAGES
+from reflex.route import get_route_args
+from reflex.utils import format
+
+SOURCE_HASH_FILE = Path(".web") / "source-hash"
+SOURCES = ("rxconfig.py", "server", "assets")
+
+
+def source_hash(sources: tuple[str, ...] = SOURCES) -> str:
+    digest = hashlib.sha256(rx.constants.Reflex.VERSION.encode())
+    for source in map(Path, sources):
+        paths = [source] if source.is_file() else sorted(source.rglob("*"))
+        for path in paths:
+            if path.is_file() and "__pycache__" not in path.parts:
+                digest.update(str(path).encode())
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def add_load_events(app: rx.App):
+    """Register load events of decorated pages without rendering them.
+
+    This is the part of `App.compile` the backend needs, page components are
+    only built when the frontend is compiled.
+    """
+    for render, kwargs in DECORATED_PAGES:
+        route = kwargs.get("route")
+        if route is None:
+            route = format.format_route(render.__name__)
+        else:
+            route = format.format_route(route, format_case=False)
+        app.state.setup_dynamic_args(get_route_args(route))
+        if on_load := kwargs.get("on_load"):
+            app.load_events[route] = on_load if isinstance(on_load, list) else [on_load]
+
+
+def compile_app(app: rx.App) -> bool:
+    """Compile the app unless compiled frontend is built from same sources.
+
+    Returns whether the app was compiled.
+    """
+    if os.environ.get(rx.constants.SKIP_COMPILE_ENV_VAR) == "yes":
+        # Production backend, frontend is exported separately.
+        add_load_events(app)
+        return False
+
+    current = source_hash()
+    if SOURCE_HASH_FILE.exists() and SOURCE_HASH_FILE.read_text() == current:
+        add_load_events(app)
+        return False
+
+    # Reflex skips compiling once when the nocompile file exists.
+    compiles = not os.path.exists(rx.constants.NOCOMPILE_FILE)
+    app.compile()
+    if compiles and SOURCE_HASH_FILE.parent.exists():
+        SOURCE_HASH_FILE.write_text(current)
+    return compiles
@@ -1,9 +1,12 @@
 # ruff: noqa: I002
 # Relfex conflicts with annotations
 
-from typing import Any
+from typing import Any, Dict, List, Optional
 
 import reflex as rx
+from reflex.components.component import Component
+from reflex.utils import imports
+from reflex.vars import Var
 
 
 class NativeEvent(rx.Base):
@@ -25,3 +28,122 @@ class Canvas(rx.Box):
             **super().get_event_triggers(),
             rx.constants.EventTriggers.ON_CLICK: click_coordinate_signature,
         }
+
+
+SPRITE_CODE = """
+const spriteImages = {};
+
+function loadSprite(url, onload) {
+  let image = spriteImages[url];
+  if (image === undefined) {
+    image = spriteImages[url] = new Image();
+    image.src = url;
+  }
+  if (!image.complete) {
+    image.addEventListener("load", onload, { once: true });
+  }
+  return image;
+}
+
+function drawSprites(canvas, atlas, objects, height) {
+  if (!canvas) {
+    return;
+  }
+  const ratio = window.devicePixelRatio || 1;
+  canvas.width = canvas.clientWidth * ratio;
+  canvas.height = canvas.clientHeight * ratio;
+  const context = canvas.getContext("2d");
+  context.setTransform(ratio, 0, 0, ratio, 0, 0);
+
+  const redraw = () => drawSprites(canvas, atlas, objects, height);
+  const sheet = loadSprite(atlas.url, redraw);
+  const boxes = [];
+  for (const o of objects) {
+    const frame = atlas.frames[o.url];
+    // Uploaded images aren't in the atlas.
+    const image = frame ? sheet : loadSprite(o.url, redraw);
+    if (!image.complete || !image.naturalHeight) {
+      continue;
+    }
+    const [sx, sy, sw, sh] = frame || [0, 0, image.naturalWidth, image.naturalHeight];
+    const width = (sw * height) / sh;
+    context.drawImage(image, sx, sy, sw, sh, o.position.x, o.position.y, width, height);
+    boxes.push([o.position.x, o.position.y, width, height, o.comment]);
+  }
+  canvas.spriteBoxes = boxes;
+}
+
+function spriteComment(canvas, x, y) {
+  const boxes = canvas.spriteBoxes || [];
+  // Later sprites are drawn on top.
+  for (let i = boxes.length - 1; i >= 0; i--) {
+    const [left, top, width, height, comment] = boxes[i];
+    if (x >= left && x < left + width && y >= top && y < top + height) {
+      return comment;
+    }
+  }
+  return "";
+}
+
+const SpriteCanvas = forwardRef(function SpriteCanvas(
+  { sprites, atlas, spriteHeight, ...props },
+  ref
+) {
+  const canvasRef = useRef(null);
+  useImperativeHandle(ref, () => canvasRef.current);
+  useEffect(() => {
+    const frame = requestAnimationFrame(() =>
+      drawSprites(canvasRef.current, atlas, sprites, spriteHeight)
+    );
+    return () => cancelAnimationFrame(frame);
+    // The atlas url changes with its content.
+  }, [sprites, atlas.url, spriteHeight]);
+  useEffect(() => {
+    const canvas = canvasRef.current;
+    const showComment = (e) => {
+      canvas.title = spriteComment(canvas, e.offsetX, e.offsetY);
+    };
+    canvas.addEventListener("mousemove", showComment);
+    return () => canvas.removeEventListener("mousemove", showComment);
+  }, []);
+  return <Box as="canvas" ref={canvasRef} {...props} />;
+});
+"""
+
+
+class SpriteCanvas(Canvas):
+    """Canvas drawing decorations on one `<canvas>` from a sprite atlas.
+
+    Comment of the decoration under the pointer is shown as the title.
+    Drawing runs in the effect of a React component of its own, fed by
+    props, so page hooks never read state before it is declared.
+    """
+
+    library: Optional[str] = None
+    tag = "SpriteCanvas"
+
+    sprites: Var[List[Any]]
+    atlas: Var[Dict[str, Any]]
+    sprite_height: Var[int]
+
+    @classmethod
+    def create(cls, *children, **props) -> Component:
+        props.setdefault("sprite_height", 50)
+        return super().create(*children, **props)
+
+    def _get_imports(self) -> imports.ImportDict:
+        return imports.merge_imports(
+            super()._get_imports(),
+            {
+                "react": {
+                    imports.ImportVar(tag="forwardRef"),
+                    imports.ImportVar(tag="useEffect"),
+                    imports.ImportVar(tag="useImperativeHandle"),
+                    imports.ImportVar(tag="useRef"),
+                },
+                Canvas.__fields__["library"].default: {imports.ImportVar(tag="Box")},
+            },
+        )
+
+    def _get_custom_code(self) -> str | None:
+        return SPRITE_CODE
@@ -2,42 +2,41 @@ from __future__ import annotations
 
 import asyncio as aio
 from datetime import datetime
+from functools import cache
+from pathlib import Path
 from typing import ClassVar
-from urllib.parse import urlparse
 from uuid import uuid4
 
 import reflex as rx
 
 from server.common.nickname import generate_random_nickname
-from server.components.canvas import Canvas
-from server.components.image import ImageSrcOnClick
+from server.components.canvas import Canvas, SpriteCanvas
+from server.services.atlas import SpriteAtlas
+from server.services.catalog import Deco, DecoCatalog
 from server.services.channel import (
     BaseUserConnection,
     Channel,
     ChannelController,
+    Cursor,
     Event,
     Object,
     Position,
     User,
 )
+from server.services.comments import CommentSanitizer, load_words
+from server.services.history import HistoryStore
+from server.services.policy import PolicyRegistry
+from server.services.preview import PreviewRenderer
+from server.services.replay import TraceRecorder
+from server.services.tracing import Tracer
 
-IMAGES = [
-    "/decos/bauble.png",
-    "/decos/bauble3.png",
-    "/decos/bauble4.png",
-    "/decos/buable2.png",
-    "/decos/candy-cane.svg",
-    "/decos/candy-cane2.svg",
-    "/decos/christmas-bell.svg",
-    "/decos/christmas-bell2.svg",
-    "/decos/christmas-candle-clipart.svg",
-    "/decos/christmas-candle.svg",
-    "/decos/christmas-stocking2.svg",
-    "/decos/christmas-stocking3.svg",
-    "/decos/christmas-wreath.svg",
-    "/decos/Picture1.png",
-    "/decos/red-stocking.png",
-]
+DECOS_DIR = Path(rx.constants.Dirs.APP_ASSETS) / "decos"
+catalog = DecoCatalog.load(DECOS_DIR)
+
+
+@cache
+def get_atlas() -> SpriteAtlas:
+    return SpriteAtlas.build(catalog, DECOS_DIR)
 
 
 class RxObject(rx.Base, Object):
@@ -48,70 +47,107 @@ class RxEvent(rx.Base, Event):
     ...
 
 
-class RxUser(rx.Base, User):
+class RxDeco(rx.Base, Deco):
+    ...
+
+
+class RxCursor(rx.Base, Cursor):
     ...
 
 
-controller = ChannelController()
+def to_rx_objects(objects: tuple[Object, ...]) -> list[RxObject]:
+    return [RxObject(**o.dict()) for o in objects]
+
+
+config = rx.config.get_config()
+controller = ChannelController(
+    policies=PolicyRegistry.from_file(config.channel_policy_file),
+    history=HistoryStore(config.history_db),
+    previews=PreviewRenderer(
+        Path(rx.constants.Dirs.APP_ASSETS) / "harmonic_Tree.svg", catalog, DECOS_DIR
+    ),
+    tracer=Tracer(sample_rate=config.trace_sample_rate),
+    comments=CommentSanitizer(load_words(config.profanity_file)),
+    recorder=(
+        TraceRecorder(config.trace_record_file) if config.trace_record_file else None
+    ),
+)
 
 
 class CanvasState(rx.State, BaseUserConnection):
     # Channel
-    _channel: Channel
-    _user: RxUser | None
+    _channel: Channel | None = None
+    _user: User | None = None
     nickname: str
 
-    # For rendering canvas
-    objects: list[RxObject]
+    # For rendering canvas, objects are shared by every session in a channel
+    # and only the version is kept per session.
+    objects_version: int = -1
     events: list[str]
+    MAX_EVENTS: ClassVar[int] = 30
+    # Pointers of websocket users, updated per presence tick. Page sessions
+    # don't report theirs, Reflex can't throttle mouse moves on the client.
+    cursors: list[RxCursor] = []
 
     # for batch image
     SELECTED_BORDER: ClassVar[str] = "1px solid purple"
     comment: str = ""
-    selected_image_uri: str = ""
+    selected_deco_id: str = ""
     batch_mode: bool = False
 
-    def set_selected_image_uri(self, s: str):
-        self.selected_image_uri = urlparse(s).path
+    def select_deco(self, deco_id: str):
+        self.selected_deco_id = deco_id
 
     def go_batch_mode(self):
         self.batch_mode = True
 
     async def batch_object(self, x, y):
-        if not self.batch_mode:
+        if not self.batch_mode or (deco := catalog.get(self.selected_deco_id)) is None:
             return
 
-        self.new_object = RxObject(
-            id=str(uuid4()),
-            url=self.selected_image_uri,
-            comment=self.comment,
-            created_at=datetime.now(),
-            position=Position(x=x, y=y),
-        )
-        await self._channel.push_object(
-            Object(**self.new_object.dict()),
-            appender=User(
-                id=self._user.id,
-                nickname=self._user.nickname,
-                session=self._user.id,
-                connection=self._user.connection,
-            ),
-        )
-        self.objects.append(self.new_object)
+        trace_id = controller.tracer.start()
+        with controller.tracer.span(trace_id, "batch_object", user=self._user.id):
+            await self._channel.push_object(
+                Object(
+                    id=str(uuid4()),
+                    url=deco.url,
+                    comment=self.comment,
+                    created_at=datetime.now(),
+                    position=Position(x=x, y=y),
+                ),
+                appender=self._user,
+                trace_id=trace_id,
+            )
+        self.objects_version = self._channel.version
         self.last_push = datetime.now()
         self.batch_mode = False
 
     async def send(self, event: Event):
-        async with self:
-            self.events = self.events + [event.as_message()]
-            self.last_event = datetime.now()
-            self.notice(self.events[-1])
-            if event.type == "push-object":
-                self.objects = [
-                    RxObject(**o.dict()) for o in self._channel.objects.values()
+        if event.type == "presence":
+            async with self:
+                self.cursors = [
+                    RxCursor(**cursor.dict())
+                    for cursor in event.cursors
+                    if cursor.id != self._user.id
                 ]
-            elif event.type == "error":
-                rx.window_alert("Error!")
+            return
+
+        tracer = controller.tracer
+        with tracer.span(event.trace_id, "state-lock", user=self._user.id):
+            async with self:
+                self.events = self.events[1 - self.MAX_EVENTS :] + [event.as_message()]
+                self.last_event = datetime.now()
+                self.notice(self.events[-1])
+                if event.type in (
+                    "push-object",
+                    "push-objects",
+                    "move-object",
+                    "edit-comment",
+                    "delete-object",
+                ):
+                    self.objects_version = self._channel.version
+                elif event.type == "error":
+                    rx.window_alert("Error!")
 
     async def recieve(self) -> Event:
         ...
@@ -124,15 +160,23 @@ class CanvasState(rx.State, BaseUserConnection):
         self.show_event_history = not self.show_event_history
 
     def notice(self, message: str):
-        # Picking 불가능해서 꼼수로 router_data를 사용함
-        prev_task: aio.Task | None = self.router_data.get("task", None)
-
-        if prev_task is not None and not prev_task.done():
-            prev_task.cancel()
-        self.router_data["task"] = aio.create_task(self.hide_notice(), name="notice")
+        # Replaces the previous notice hiding task of the session.
+        controller.tasks.spawn(
+            self.hide_notice(),
+            name="notice",
+            owner=self.router.session.session_id,
+            key="notice",
+            replace=True,
+        )
         self.notice_message = message
         self.has_notice = True
 
+    @rx.cached_var
+    def objects(self) -> list[RxObject]:
+        if self._channel is None or self.objects_version < 0:
+            return []
+        return self._channel.view(to_rx_objects)
+
     @rx.var
     def show_notice(self) -> bool:
         return self.has_notice and not self.show_event_history
@@ -145,33 +189,40 @@ class CanvasState(rx.State, BaseUserConnection):
     @rx.background
     async def enter_page(self):
         channel_id = self.router.page.path
+        controller.tasks.adopt("enter_page", owner=self.router.session.session_id)
         async with self:
-            # get channel
-            self._channel = controller.get_channel(channel_id)
-            if self._channel is None:
-                self._channel = controller.create_channel(channel_id)
-
-            # Load already pushed objects
-            self.objects = [
-                RxObject(**o.dict()) for o in self._channel.objects.values()
-            ]
-
-            # Join channel
-            self._user = RxUser(
+            self._user = User(
                 id=self.router.session.client_token,
                 nickname=generate_random_nickname(),
-                session=self.router.session.client_token,
                 connection=self,
             )
             self.nickname = self._user.nickname
-            await self._channel.join(
-                User(
-                    id=self._user.id,
-                    nickname=self._user.nickname,
-                    session=self._user.id,
-                    connection=self._user.connection,
-                )
-            )
+
+            # get channel, popular trees spill over to sub-channels. Sessions
+            # handed over from the previous worker get their held seat back.
+            self._channel = controller.assign_channel(channel_id, self._user.id)
+
+            # Load already pushed objects
+            self.objects_version = self._channel.version
+
+            # Join channel
+            members[self.router.session.session_id] = self._channel, self._user
+            await self._channel.join(self._user)
+
+
+# Channel membership of sessions, by socket session id.
+members: dict[str, tuple[Channel, User]] = {}
+
+
+async def disconnect(session_id: str):
+    """Cancel background work of the session and leave its channel."""
+    controller.tasks.cancel_owner(session_id)
+    if (member := members.pop(session_id, None)) is None:
+        return
+    channel, user = member
+    # The session may have rejoined with the same token already.
+    if channel.users.get(user.id) is user or channel.waiting.get(user.id) is user:
+        await channel.leave(user)
 
 
 def render_object(o: RxObject):
@@ -188,6 +239,19 @@ def render_object(o: RxObject):
     )
 
 
+def render_cursor(c: RxCursor):
+    return rx.text(
+        "▲ " + c.nickname,
+        top=c.y,
+        left=c.x,
+        position="absolute",
+        font_size="0.8em",
+        color="purple",
+        pointer_events="none",
+        z_index=2,
+    )
+
+
 def render_event(e: str):
     return rx.fragment(rx.box(rx.text(e)), rx.divider())
 
@@ -247,10 +311,11 @@ def events_list():
 
 class AddingDecoModal(CanvasState):
     SELECTED_BORDER: ClassVar[str] = "1px solid purple"
+    UNSELECTED_BORDER: ClassVar[str] = "1px solid rgba(0,0,0,0)"
+    PAGE_SIZE: ClassVar[int] = 24
     show_modal: bool = False
     prompt: str = ""
-    images: list[str] = IMAGES
-    borders: dict[str, str] = {k: "1px solid rgba(0,0,0,0)" for k in IMAGES}
+    deco_page: int = 0
 
     def toggle_modal(self):
         self.show_modal = not self.show_modal
@@ -259,10 +324,21 @@ class AddingDecoModal(CanvasState):
         self.show_modal = False
         return CanvasState.go_batch_mode
 
-    def select_image(self, s: str):
-        self.borders = {k: "1px solid rgba(0,0,0,0)" for k in IMAGES}
-        self.borders[urlparse(s).path] = self.SELECTED_BORDER
-        return super().set_selected_image_uri(s)
+    def next_deco_page(self):
+        self.deco_page = catalog.page(self.deco_page + 1, self.PAGE_SIZE).page
+
+    def prev_deco_page(self):
+        self.deco_page = catalog.page(self.deco_page - 1, self.PAGE_SIZE).page
+
+    @rx.cached_var
+    def decos(self) -> list[RxDeco]:
+        # Catalog is shared, only the page number is stored per session.
+        page = catalog.page(self.deco_page, self.PAGE_SIZE)
+        return [RxDeco(**deco.dict()) for deco in page.items]
+
+    @rx.cached_var
+    def deco_pages(self) -> int:
+        return catalog.page(self.deco_page, self.PAGE_SIZE).pages
 
 
 def deco_adding_modal():
@@ -280,16 +356,20 @@ def deco_adding_modal():
             rx.input(value=CanvasState.comment, on_change=CanvasState.set_comment),
         )
 
-    def render_image(o):
+    def render_image(deco: RxDeco):
         return rx.box(
             rx.center(
-                ImageSrcOnClick.create(
-                    src=o[0],
+                rx.image(
+                    src=deco.url,
                     width=50,
                     object_fit="contain",
-                    on_click=AddingDecoModal.select_image,
+                    on_click=CanvasState.select_deco(deco.id),
+                ),
+                border=rx.cond(
+                    CanvasState.selected_deco_id == deco.id,
+                    AddingDecoModal.SELECTED_BORDER,
+                    AddingDecoModal.UNSELECTED_BORDER,
                 ),
-                border=o[1],
                 padding="5px",
                 border_radius="3px",
             )
@@ -298,7 +378,7 @@ def deco_adding_modal():
     prepared_tab_panel = rx.tab_panel(
         rx.responsive_grid(
             rx.foreach(
-                AddingDecoModal.borders,
+                AddingDecoModal.decos,
                 render_image,  # 원래 비율에 맞추게
             ),
             columns=[3, 4, 5, 6],
@@ -307,6 +387,13 @@ def deco_adding_modal():
             max_height="20em",
             overflow="auto",
         ),
+        rx.hstack(
+            rx.button("<", on_click=AddingDecoModal.prev_deco_page),
+            rx.text(AddingDecoModal.deco_page + 1, " / ", AddingDecoModal.deco_pages),
+            rx.button(">", on_click=AddingDecoModal.next_deco_page),
+            justify_content="center",
+            padding_y="0.5em",
+        ),
         comment_input(),
     )
 
@@ -348,20 +435,42 @@ def deco_adding_modal():
     )
 
 
-def tree_canvas():
-    return rx.fragment(
-        rx.container(
-            rx.image(
-                src="/harmonic_Tree.svg", width=400, height=800, position="absolute"
-            ),
-            Canvas.create(
+def decorations():
+    if config.deco_rendering == "atlas":
+        # One canvas drawing every decoration, instead of an image each.
+        atlas = get_atlas()
+        url = f"{config.api_url}/decos/atlas.svg?v={atlas.hash}"
+        return [
+            SpriteCanvas.create(
+                sprites=CanvasState.objects,
+                atlas=atlas.encode(url),
                 width=400,
                 height=800,
                 z_index=1,
                 position="relative",
                 on_click=CanvasState.batch_object,
+            )
+        ]
+    return [
+        Canvas.create(
+            width=400,
+            height=800,
+            z_index=1,
+            position="relative",
+            on_click=CanvasState.batch_object,
+        ),
+        rx.foreach(CanvasState.objects, render_object),
+    ]
+
+
+def tree_canvas():
+    return rx.fragment(
+        rx.container(
+            rx.image(
+                src="/harmonic_Tree.svg", width=400, height=800, position="absolute"
             ),
-            rx.foreach(CanvasState.objects, render_object),
+            *decorations(),
+            rx.foreach(CanvasState.cursors, render_cursor),
             position="relative",
         ),
         deco_adding_modal(),
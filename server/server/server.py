@@ -1,12 +1,84 @@
 """Welcome to Reflex!."""
 
+import asyncio as aio
+import signal
+from datetime import timedelta
+
 from server import styles
+from server.api.channel import router as channel_router
+from server.api.decos import router as decos_router
+from server.common.frontend import compile_app
 
 # Import all the pages.
 from server.pages import *
+from server.pages.canvas import config, controller, disconnect
+from server.services.migration import drain, serve_handoff
 
 import reflex as rx
 
-# Create the app and compile it.
+# Create the app and compile it, unless compiled frontend is up to date.
 app = rx.App(style=styles.base_style)
-app.compile()
+app.api.include_router(channel_router)
+app.api.include_router(decos_router)
+compile_app(app)
+
+# Reflex has no disconnect hook, the namespace handler is a no-op.
+app.event_namespace.on_disconnect = disconnect
+
+
+@app.api.on_event("startup")
+async def watch_channel_policies():
+    # Keep reference, or the task may be garbage collected.
+    app.api.state.policy_watcher = aio.create_task(controller.watch_policies())
+
+
+@app.api.on_event("startup")
+async def flush_history():
+    app.api.state.history_flusher = aio.create_task(controller.history.run_flusher())
+    app.api.state.history_compactor = aio.create_task(
+        controller.history.run_compactor(timedelta(days=config.history_retention_days))
+    )
+
+
+@app.api.on_event("shutdown")
+async def close_history():
+    # Stop writers first, or they may use the closed connection.
+    tasks = (app.api.state.history_flusher, app.api.state.history_compactor)
+    for task in tasks:
+        task.cancel()
+    await aio.gather(*tasks, return_exceptions=True)
+    controller.history.close()
+
+
+@app.api.on_event("shutdown")
+async def close_comment_pool():
+    controller.comments.close()
+
+
+@app.api.on_event("shutdown")
+async def close_trace_recorder():
+    if controller.recorder is not None:
+        controller.recorder.close()
+
+
+@app.api.on_event("startup")
+async def accept_handoff():
+    """Take over channels of the previous worker, which drains on SIGUSR2.
+
+    Deploy by starting the new worker, then signal the old one and stop it
+    once it has drained.
+    """
+    if not config.handoff_socket:
+        return
+    app.api.state.handoff = server = await serve_handoff(
+        controller, config.handoff_socket
+    )
+
+    def start_drain():
+        # Stop accepting, so draining doesn't hand channels over to itself.
+        server.close()
+        app.api.state.drainer = aio.create_task(
+            drain(controller, config.handoff_socket)
+        )
+
+    aio.get_running_loop().add_signal_handler(signal.SIGUSR2, start_drain)
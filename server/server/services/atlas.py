@@ -0,0 +1,93 @@
+"""Sprite atlas of preset decorations."""
+from __future__ import annotations
+
+import base64
+import hashlib
+from pathlib import Path
+
+from server.base import BaseModel, Field
+from server.services.catalog import DecoCatalog
+
+MEDIA_TYPES = {".png": "image/png", ".svg": "image/svg+xml"}
+
+
+class Frame(BaseModel):
+    """Region of a decoration in the atlas."""
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+    def encode(self) -> list[int]:
+        return [self.x, self.y, self.width, self.height]
+
+
+class SpriteAtlas(BaseModel):
+    """Every preset decoration laid out in one SVG image.
+
+    Browsers fetch and decode the atlas once, and draw decorations from its
+    frames. Decorations are scaled to `sprite_height`, twice the rendered
+    height so they stay sharp on high density screens.
+    """
+
+    frames: dict[str, Frame] = Field(default_factory=dict)
+    width: int = 0
+    height: int = 0
+    svg: str = Field("", repr=False)
+    hash: str = ""
+
+    @classmethod
+    def build(
+        cls,
+        catalog: DecoCatalog,
+        root: str | Path,
+        sprite_height: int = 100,
+        max_width: int = 1024,
+    ) -> SpriteAtlas:
+        frames = {}
+        images = []
+        x = y = width = 0
+        # Shelf packing, sprites have the same height.
+        for deco in catalog.decos.values():
+            path = Path(root) / Path(deco.url).name
+            media_type = MEDIA_TYPES.get(path.suffix.lower())
+            if media_type is None or not path.exists():
+                continue
+            ratio = deco.width / deco.height if deco.width and deco.height else 1
+            sprite_width = max(round(sprite_height * ratio), 1)
+            if x and x + sprite_width > max_width:
+                x, y = 0, y + sprite_height
+            frames[deco.url] = frame = Frame(
+                x=x, y=y, width=sprite_width, height=sprite_height
+            )
+            data = base64.b64encode(path.read_bytes()).decode()
+            images.append(
+                f'<image x="{frame.x}" y="{frame.y}"'
+                f' width="{frame.width}" height="{frame.height}"'
+                f' preserveAspectRatio="none" href="data:{media_type};base64,{data}"/>'
+            )
+            x += sprite_width
+            width = max(width, x)
+        height = y + sprite_height if frames else 0
+
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg"'
+            f' width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            + "".join(images)
+            + "</svg>"
+        )
+        return cls(
+            frames=frames,
+            width=width,
+            height=height,
+            svg=svg,
+            hash=hashlib.sha256(svg.encode()).hexdigest()[:16],
+        )
+
+    def encode(self, url: str) -> dict:
+        """Atlas for the frontend, with the url the atlas is served at."""
+        return {
+            "url": url,
+            "frames": {deco: frame.encode() for deco, frame in self.frames.items()},
+        }
@@ -0,0 +1,108 @@
+"""Decoration catalog."""
+from __future__ import annotations
+
+import hashlib
+import re
+import struct
+from math import ceil
+from pathlib import Path
+
+from server.base import BaseModel, Field
+
+SUFFIXES = (".png", ".svg")
+CATEGORIES = {
+    "bauble": "bauble",
+    "buable": "bauble",
+    "candy-cane": "candy-cane",
+    "bell": "bell",
+    "candle": "candle",
+    "stocking": "stocking",
+    "wreath": "wreath",
+}
+SVG_TAG = re.compile(rb"<svg\b[^>]*>", re.S)
+SVG_VIEWBOX = re.compile(rb'viewBox="[\d.\-]+[ ,]+[\d.\-]+[ ,]+([\d.]+)[ ,]+([\d.]+)"')
+
+
+class Deco(BaseModel):
+    """Preset decoration image."""
+
+    id: str
+    url: str
+    category: str
+    width: int
+    height: int
+    hash: str
+
+
+class DecoPage(BaseModel):
+    items: list[Deco]
+    page: int
+    pages: int
+    total: int
+
+
+def get_category(name: str) -> str:
+    for keyword, category in CATEGORIES.items():
+        if keyword in name:
+            return category
+    return "etc"
+
+
+def get_dimensions(data: bytes, suffix: str) -> tuple[int, int]:
+    if suffix == ".png":
+        # IHDR is always the first chunk.
+        return struct.unpack(">II", data[16:24])
+
+    tag = SVG_TAG.search(data)
+    viewbox = SVG_VIEWBOX.search(tag.group()) if tag else None
+    if viewbox is None:
+        return 0, 0
+    width, height = viewbox.groups()
+    return round(float(width)), round(float(height))
+
+
+class DecoCatalog(BaseModel):
+    """Preset decorations, loaded once and shared by every session."""
+
+    decos: dict[str, Deco] = Field(default_factory=dict)
+
+    @classmethod
+    def load(cls, root: str | Path, prefix: str = "/decos") -> DecoCatalog:
+        decos = {}
+        for path in sorted(Path(root).iterdir(), key=lambda p: p.name.lower()):
+            if path.suffix.lower() not in SUFFIXES:
+                continue
+            data = path.read_bytes()
+            width, height = get_dimensions(data, path.suffix.lower())
+            deco_id = path.stem.lower()
+            decos[deco_id] = Deco(
+                id=deco_id,
+                url=f"{prefix}/{path.name}",
+                category=get_category(deco_id),
+                width=width,
+                height=height,
+                hash=hashlib.sha256(data).hexdigest()[:16],
+            )
+        return cls(decos=decos)
+
+    @property
+    def categories(self) -> list[str]:
+        return sorted({deco.category for deco in self.decos.values()})
+
+    def get(self, deco_id: str) -> Deco | None:
+        return self.decos.get(deco_id, None)
+
+    def page(self, page: int, size: int = 24, category: str | None = None) -> DecoPage:
+        decos = [
+            deco
+            for deco in self.decos.values()
+            if category is None or deco.category == category
+        ]
+        pages = max(ceil(len(decos) / size), 1)
+        page = min(max(page, 0), pages - 1)
+        return DecoPage(
+            items=decos[page * size : (page + 1) * size],
+            page=page,
+            pages=pages,
+            total=len(decos),
+        )
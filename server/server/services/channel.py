@@ -1,12 +1,47 @@
 """Channel."""
 from __future__ import annotations
 
-from asyncio import Lock, TaskGroup, wait_for
+import json
+import logging
+import secrets
+from asyncio import (
+    Future,
+    Lock,
+    Task,
+    gather,
+    get_running_loop,
+    shield,
+    sleep,
+    wait_for,
+)
+from collections.abc import AsyncIterator, Callable, Iterable
 from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Annotated, Literal
+from itertools import islice
+from typing import TYPE_CHECKING, Annotated, Any, Literal, TypeVar
+
+from pydantic import validator
 
 from server.base import BaseModel, Field
+from server.services.clock import HybridClock, Stamp
+from server.services.directory import ChannelDirectory
+from server.services.policy import ChannelPolicy, PolicyRegistry
+from server.services.tasks import TaskSupervisor
+from server.services.tracing import Tracer
+
+if TYPE_CHECKING:
+    from server.services.comments import CommentSanitizer
+    from server.services.history import HistoryStore
+    from server.services.preview import PreviewRenderer
+    from server.services.replay import TraceRecorder
+else:
+    # These import channel, so fields holding them aren't validated.
+    CommentSanitizer = HistoryStore = PreviewRenderer = TraceRecorder = Any
+
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+# Weight of the latest wait in the moving average of lock waits
+LOCK_WAIT_ALPHA = 0.2
 
 
 class Position(BaseModel):
@@ -15,6 +50,13 @@ class Position(BaseModel):
     x: int
     y: int
 
+    def encode(self) -> dict:
+        return {"x": self.x, "y": self.y}
+
+    @classmethod
+    def decode(cls, data: dict) -> Position:
+        return cls.construct(x=data["x"], y=data["y"])
+
 
 class Object(BaseModel):
     """Tree decoration object."""
@@ -24,6 +66,34 @@ class Object(BaseModel):
     comment: str
     created_at: datetime = Field(default_factory=datetime.now)
     position: Position
+    # Clock stamp of the last write to each editable field
+    stamps: dict[str, Stamp] = Field(default_factory=dict, exclude=True)
+
+    @validator("created_at")
+    def naive_created_at(cls, value: datetime) -> datetime:
+        # Naive local time like `datetime.now()`, which history relies on.
+        if value.tzinfo is not None:
+            value = value.astimezone().replace(tzinfo=None)
+        return value
+
+    def encode(self) -> dict:
+        return {
+            "id": self.id,
+            "url": self.url,
+            "comment": self.comment,
+            "created_at": self.created_at.isoformat(),
+            "position": self.position.encode(),
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> Object:
+        return cls.construct(
+            id=data["id"],
+            url=data["url"],
+            comment=data["comment"],
+            created_at=datetime.fromisoformat(data["created_at"]),
+            position=Position.decode(data["position"]),
+        )
 
 
 class BaseUserConnection:
@@ -33,30 +103,63 @@ class BaseUserConnection:
     async def send(self, data: Event):
         ...
 
+    async def close(self):
+        ...
+
 
 class UserInfo(BaseModel):
     id: str
     nickname: str
 
+    def encode(self) -> dict:
+        return {"id": self.id, "nickname": self.nickname}
+
+    @classmethod
+    def decode(cls, data: dict) -> UserInfo:
+        return cls.construct(id=data["id"], nickname=data["nickname"])
+
 
 class User(UserInfo):
     """User."""
 
     id: str
-    connection: BaseUserConnection
+    connection: BaseUserConnection = Field(exclude=True)
+    # Secret to take the seat back on the next worker, unlike the public id
+    resume_token: str = Field(
+        default_factory=lambda: secrets.token_urlsafe(16), exclude=True, repr=False
+    )
 
     class Config:
         arbitrary_types_allowed = True
 
+    def info(self) -> UserInfo:
+        return UserInfo.construct(id=self.id, nickname=self.nickname)
+
 
 class BaseEvent(BaseModel):
-    """Event base classs"""
+    """Event base classs
+
+    Events built by channel are made with `construct` from trusted data,
+    and encoded by hand instead of pydantic's validation and `json`.
+    """
 
     type: str
+    # Set on sampled events, not sent to clients
+    trace_id: str | None = Field(None, exclude=True)
 
     def as_message(self) -> str:
         ...
 
+    def encode(self) -> dict:
+        ...
+
+    @classmethod
+    def decode(cls, data: dict) -> BaseEvent:
+        ...
+
+    def dumps(self) -> str:
+        return json.dumps(self.encode(), ensure_ascii=False, separators=(",", ":"))
+
 
 class JoinEvent(BaseEvent):
     """Event data for user join."""
@@ -67,6 +170,13 @@ class JoinEvent(BaseEvent):
     def as_message(self) -> str:
         return f"{self.user.nickname} 님이 채널에 참여했어요!"
 
+    def encode(self) -> dict:
+        return {"type": self.type, "user": self.user.encode()}
+
+    @classmethod
+    def decode(cls, data: dict) -> JoinEvent:
+        return cls.construct(user=UserInfo.decode(data["user"]))
+
 
 class PushObjectEvent(BaseEvent):
     """Event data for pushing new object."""
@@ -79,6 +189,146 @@ class PushObjectEvent(BaseEvent):
     def as_message(self) -> str:
         return f"{self.appender.nickname} 님이 새로 트리를 장식했어요!"
 
+    def encode(self) -> dict:
+        return {
+            "type": self.type,
+            "object": self.object.encode(),
+            "appender": self.appender.encode(),
+            "pop": self.pop,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> PushObjectEvent:
+        return cls.construct(
+            object=Object.decode(data["object"]),
+            appender=UserInfo.decode(data["appender"]),
+            pop=data["pop"],
+        )
+
+
+class PushObjectsEvent(BaseEvent):
+    """Event data for pushing many objects at once."""
+
+    type: Literal["push-objects"] = "push-objects"
+    objects: list[Object]
+    appender: UserInfo
+    pops: list[str]
+
+    def as_message(self) -> str:
+        return f"{self.appender.nickname} 님이 장식 {len(self.objects)}개를 달았어요!"
+
+    def encode(self) -> dict:
+        return {
+            "type": self.type,
+            "objects": [obj.encode() for obj in self.objects],
+            "appender": self.appender.encode(),
+            "pops": self.pops,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> PushObjectsEvent:
+        return cls.construct(
+            objects=[Object.decode(obj) for obj in data["objects"]],
+            appender=UserInfo.decode(data["appender"]),
+            pops=data["pops"],
+        )
+
+
+class MoveObjectEvent(BaseEvent):
+    """Event data for moving an object."""
+
+    type: Literal["move-object"] = "move-object"
+    id: str
+    position: Position
+    editor: UserInfo
+    # Assigned by server when missing
+    stamp: Stamp | None = None
+
+    def as_message(self) -> str:
+        return f"{self.editor.nickname} 님이 장식을 옮겼어요!"
+
+    def encode(self) -> dict:
+        return {
+            "type": self.type,
+            "id": self.id,
+            "position": self.position.encode(),
+            "editor": self.editor.encode(),
+            "stamp": self.stamp.encode() if self.stamp else None,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> MoveObjectEvent:
+        return cls.construct(
+            id=data["id"],
+            position=Position.decode(data["position"]),
+            editor=UserInfo.decode(data["editor"]),
+            stamp=Stamp.decode(data["stamp"]) if data["stamp"] else None,
+        )
+
+
+class EditCommentEvent(BaseEvent):
+    """Event data for editing comment of an object."""
+
+    type: Literal["edit-comment"] = "edit-comment"
+    id: str
+    comment: str
+    editor: UserInfo
+    stamp: Stamp | None = None
+
+    def as_message(self) -> str:
+        return f"{self.editor.nickname} 님이 장식의 글을 고쳤어요!"
+
+    def encode(self) -> dict:
+        return {
+            "type": self.type,
+            "id": self.id,
+            "comment": self.comment,
+            "editor": self.editor.encode(),
+            "stamp": self.stamp.encode() if self.stamp else None,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> EditCommentEvent:
+        return cls.construct(
+            id=data["id"],
+            comment=data["comment"],
+            editor=UserInfo.decode(data["editor"]),
+            stamp=Stamp.decode(data["stamp"]) if data["stamp"] else None,
+        )
+
+
+class DeleteObjectEvent(BaseEvent):
+    """Event data for deleting an object."""
+
+    type: Literal["delete-object"] = "delete-object"
+    id: str
+    editor: UserInfo
+    stamp: Stamp | None = None
+
+    def as_message(self) -> str:
+        return f"{self.editor.nickname} 님이 장식을 뗐어요!"
+
+    def encode(self) -> dict:
+        return {
+            "type": self.type,
+            "id": self.id,
+            "editor": self.editor.encode(),
+            "stamp": self.stamp.encode() if self.stamp else None,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> DeleteObjectEvent:
+        return cls.construct(
+            id=data["id"],
+            editor=UserInfo.decode(data["editor"]),
+            stamp=Stamp.decode(data["stamp"]) if data["stamp"] else None,
+        )
+
+
+EditEvent = MoveObjectEvent | EditCommentEvent | DeleteObjectEvent
+# Field of object written by each edit
+EDIT_FIELDS = {"move-object": "position", "edit-comment": "comment"}
+
 
 class LeaveEvent(BaseEvent):
     """Event data for user leaving."""
@@ -89,6 +339,100 @@ class LeaveEvent(BaseEvent):
     def as_message(self) -> str:
         return f"{self.user.nickname} 님이 채널을 나갔어요!"
 
+    def encode(self) -> dict:
+        return {"type": self.type, "user": self.user.encode()}
+
+    @classmethod
+    def decode(cls, data: dict) -> LeaveEvent:
+        return cls.construct(user=UserInfo.decode(data["user"]))
+
+
+class Cursor(BaseModel):
+    """Pointer position of a user."""
+
+    id: str
+    nickname: str
+    x: int
+    y: int
+
+    def encode(self) -> dict:
+        return {"id": self.id, "nickname": self.nickname, "x": self.x, "y": self.y}
+
+    @classmethod
+    def decode(cls, data: dict) -> Cursor:
+        return cls.construct(
+            id=data["id"], nickname=data["nickname"], x=data["x"], y=data["y"]
+        )
+
+
+class CursorEvent(BaseEvent):
+    """Event data for reporting pointer position."""
+
+    type: Literal["cursor"] = "cursor"
+    x: int
+    y: int
+
+    def as_message(self) -> str:
+        return ""
+
+    def encode(self) -> dict:
+        return {"type": self.type, "x": self.x, "y": self.y}
+
+    @classmethod
+    def decode(cls, data: dict) -> CursorEvent:
+        return cls.construct(x=data["x"], y=data["y"])
+
+
+class PresenceEvent(BaseEvent):
+    """Event data for pointers of every user in channel, sent per tick."""
+
+    type: Literal["presence"] = "presence"
+    cursors: list[Cursor]
+
+    def as_message(self) -> str:
+        return f"{len(self.cursors)}명이 트리를 꾸미고 있어요."
+
+    def encode(self) -> dict:
+        return {"type": self.type, "cursors": [c.encode() for c in self.cursors]}
+
+    @classmethod
+    def decode(cls, data: dict) -> PresenceEvent:
+        return cls.construct(cursors=[Cursor.decode(c) for c in data["cursors"]])
+
+
+class WaitEvent(BaseEvent):
+    """Event data for user waiting for a seat."""
+
+    type: Literal["wait"] = "wait"
+    position: int
+
+    def as_message(self) -> str:
+        return f"채널이 가득 찼어요. {self.position}번째로 기다리고 있어요."
+
+    def encode(self) -> dict:
+        return {"type": self.type, "position": self.position}
+
+    @classmethod
+    def decode(cls, data: dict) -> WaitEvent:
+        return cls.construct(position=data["position"])
+
+
+class SnapshotEvent(BaseEvent):
+    """Event data for current objects of channel."""
+
+    type: Literal["snapshot"] = "snapshot"
+    objects: list[Object]
+
+    def as_message(self) -> str:
+        return "트리를 불러왔어요!"
+
+    def encode(self) -> dict:
+        return {"type": self.type, "objects": [obj.encode() for obj in self.objects]}
+
+    @classmethod
+    def decode(cls, data: dict) -> SnapshotEvent:
+        return cls.construct(objects=[Object.decode(obj) for obj in data["objects"]])
+
 
 class ErrorEvent(BaseEvent):
     """Event data for error."""
@@ -103,16 +447,168 @@ class ErrorEvent(BaseEvent):
             f"(code: {self.code}, message: {self.message})"
         )
 
+    def encode(self) -> dict:
+        return {"type": self.type, "code": self.code, "message": self.message}
+
+    @classmethod
+    def decode(cls, data: dict) -> ErrorEvent:
+        return cls.construct(code=data["code"], message=data["message"])
+
 
 class Event(BaseModel):
     """Event data."""
 
     __root__: Annotated[
-        JoinEvent | PushObjectEvent | LeaveEvent | ErrorEvent,
+        JoinEvent
+        | PushObjectEvent
+        | PushObjectsEvent
+        | MoveObjectEvent
+        | EditCommentEvent
+        | DeleteObjectEvent
+        | LeaveEvent
+        | CursorEvent
+        | PresenceEvent
+        | WaitEvent
+        | SnapshotEvent
+        | ErrorEvent,
         Field(discriminator="type"),
     ]
 
 
+class Broadcast:
+    """Shared stream of encoded messages.
+
+    Every subscriber awaits the same future chain, so publishing costs the
+    same regardless of the number of subscribers.
+    """
+
+    def __init__(self):
+        self.subscribers = 0
+        self._next: Future | None = None
+
+    def subscribe(self) -> Future:
+        """Subscribe, returns future of `(message, next future)`."""
+        self.subscribers += 1
+        if self._next is None:
+            self._next = get_running_loop().create_future()
+        return self._next
+
+    def unsubscribe(self):
+        self.subscribers -= 1
+
+    def publish(self, message: str | None):
+        """Publish message, `None` closes the stream."""
+        if not self.subscribers:
+            self._next = None
+            return
+        current, self._next = self._next, get_running_loop().create_future()
+        current.set_result((message, self._next))
+
+
+class Presence:
+    """Latest cursors of users, published as one frame per tick.
+
+    Reports between ticks overwrite each other, so presence costs a frame
+    per tick however often pointers move.
+    """
+
+    def __init__(self):
+        self.cursors: dict[str, Cursor] = {}
+        self.changed = False
+        self.ticking = False
+
+    def report(self, cursor: Cursor):
+        self.cursors[cursor.id] = cursor
+        self.changed = True
+
+    def remove(self, user_id: str) -> bool:
+        if self.cursors.pop(user_id, None) is None:
+            return False
+        self.changed = True
+        return True
+
+    def frame(self) -> PresenceEvent | None:
+        """Frame of every cursor, `None` if nothing changed since the last."""
+        if not self.changed:
+            return None
+        self.changed = False
+        return PresenceEvent.construct(cursors=list(self.cursors.values()))
+
+
+class Snapshot:
+    """Immutable snapshot of objects and views built from it.
+
+    Readers share one snapshot until the objects change, instead of keeping
+    their own copies.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._objects: tuple[Object, ...] | None = None
+        self._views: dict[Callable, Any] = {}
+
+    def invalidate(self):
+        self.version += 1
+        self._objects = None
+        self._views = {}
+
+    def objects(self, store: dict[str, Object]) -> tuple[Object, ...]:
+        if self._objects is None:
+            self._objects = tuple(store.values())
+        return self._objects
+
+    def view(
+        self, store: dict[str, Object], build: Callable[[tuple[Object, ...]], T]
+    ) -> T:
+        if build in self._views:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._views[build] = build(self.objects(store))
+        return self._views[build]
+
+
+def dumps_snapshot(objects: tuple[Object, ...]) -> str:
+    return SnapshotEvent.construct(objects=list(objects)).dumps()
+
+
+class Deadline:
+    """Time budget of an operation, shared by all of its steps."""
+
+    def __init__(self, budget: float):
+        self.loop = get_running_loop()
+        self.at = self.loop.time() + budget
+
+    def remaining(self, cap: float | None = None) -> float:
+        remaining = max(self.at - self.loop.time(), 0)
+        return remaining if cap is None else min(remaining, cap)
+
+
+class PublishResult(BaseModel):
+    sent: int = 0
+    # Missed the event because the operation ran out of budget.
+    dropped: list[str] = Field(default_factory=list)
+    # Failed or exceeded `send_timeout`, these are detached.
+    failed: list[str] = Field(default_factory=list)
+
+    def update(self, other: PublishResult):
+        self.sent += other.sent
+        self.dropped += other.dropped
+        self.failed += other.failed
+
+
+class ChannelStats(BaseModel):
+    users: int = 0
+    spectators: int = 0
+    objects: int = 0
+    dropped_sends: int = 0
+    failed_sends: int = 0
+    snapshot_hits: int = 0
+    snapshot_misses: int = 0
+
+
 class Channel(BaseModel):
     """Represent group tree channel."""
 
@@ -120,24 +616,112 @@ class Channel(BaseModel):
     users: dict[str, User] = Field(default_factory=dict)
     # events: deque[str] = Field(default_factory=lambda: deque(maxlen=30))
     objects: dict[str, Object] = Field(default_factory=dict)
+    # Clock stamps of deleted objects, so late edits don't bring them back
+    tombstones: dict[str, Stamp] = Field(default_factory=dict)
+    snapshot: Snapshot = Field(default_factory=Snapshot, exclude=True)
     channel_controller: ChannelController | None = Field(None, exclude=True, repr=False)
+    group: ChannelGroup | None = Field(None, exclude=True, repr=False)
     policy: ChannelPolicy | None = None
 
     event_lock: Lock = Field(Lock(), const=True)
 
+    # Admission control
+    waiting: dict[str, User] = Field(default_factory=dict)
+    # Users handed over from the previous worker by resume token, holding seats
+    resuming: dict[str, UserInfo] = Field(default_factory=dict)
+    reserved_seats: int = 0
+    pending: int = 0
+    lock_wait: float = 0
+
+    # Partial failures of publishing
+    dropped_sends: int = 0
+    failed_sends: int = 0
+
+    # Read-only spectators
+    broadcast: Broadcast = Field(default_factory=Broadcast, exclude=True)
+    presence: Presence = Field(default_factory=Presence, exclude=True)
+
     class Config:
         arbitrary_types_allowed = True
 
-    def get_event_lock(self, publisher: User | None):
+    @property
+    def tree_id(self) -> str:
+        return self.group.id if self.group else self.id
+
+    @property
+    def stats(self) -> ChannelStats:
+        return ChannelStats(
+            users=len(self.users),
+            spectators=self.broadcast.subscribers,
+            objects=len(self.objects),
+            dropped_sends=self.dropped_sends,
+            failed_sends=self.failed_sends,
+            snapshot_hits=self.snapshot.hits,
+            snapshot_misses=self.snapshot.misses,
+        )
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    def object_list(self) -> tuple[Object, ...]:
+        """Current objects, shared by every reader until they change."""
+        return self.snapshot.objects(self.objects)
+
+    def view(self, build: Callable[[tuple[Object, ...]], T]) -> T:
+        """Build from current objects once, and share it until they change.
+
+        `build` is the cache key, so pass the same function every time.
+        """
+        return self.snapshot.view(self.objects, build)
+
+    def deadline(self) -> Deadline:
+        return Deadline(self.policy.budget)
+
+    def get_event_lock(
+        self,
+        publisher: User | None,
+        deadline: Deadline | None = None,
+        trace_id: str | None = None,
+    ):
+        tracer = self.channel_controller.tracer
+        timeout = self.policy.timeout
+        if deadline is not None:
+            timeout = deadline.remaining(timeout)
+
+        async def refuse_draining() -> bool:
+            # State changed now would be lost in handoff.
+            if not self.channel_controller.draining:
+                return False
+            if publisher:
+                await publisher.connection.send(
+                    ErrorEvent.construct(code="draining", message="Draining")
+                )
+            return True
+
         @asynccontextmanager
         async def inner():
+            if await refuse_draining():
+                yield False
+                return
             try:
-                await wait_for(self.event_lock.acquire(), timeout=self.policy.timeout)
-                yield True
+                self.pending += 1
+                loop = get_running_loop()
+                started = loop.time()
+                try:
+                    with tracer.span(trace_id, "lock-wait", channel=self.id):
+                        await wait_for(self.event_lock.acquire(), timeout=timeout)
+                finally:
+                    self.pending -= 1
+                    # Moving average of lock wait, used to shed joins.
+                    waited = loop.time() - started
+                    self.lock_wait += LOCK_WAIT_ALPHA * (waited - self.lock_wait)
+                # Draining may have started while waiting.
+                yield not await refuse_draining()
             except TimeoutError:
                 if publisher:
                     await publisher.connection.send(
-                        ErrorEvent(code="timeout", message="Timeout")
+                        ErrorEvent.construct(code="timeout", message="Timeout")
                     )
                 yield False
             finally:
@@ -152,42 +736,231 @@ class Channel(BaseModel):
         self.channel_controller = channel_controller
         self.policy = policy
 
-    async def _publish_event(self, event: Event, publisher_id: str | None):
+    async def _send(self, user: User, event: Event, deadline: Deadline) -> str:
+        tracer = self.channel_controller.tracer
+        start = tracer.clock()
+        timeout = deadline.remaining(self.policy.send_timeout)
         try:
-            async with TaskGroup() as tg:
-                for user in self.users.values():
-                    if user.id != publisher_id:
-                        tg.create_task(user.connection.send(event))
-        except ExceptionGroup:
-            await self.users[publisher_id].connection.send(
-                ErrorEvent(code="unknown", message="Failed with unknown reason")
+            await wait_for(user.connection.send(event), timeout)
+            outcome = "sent"
+        except TimeoutError:
+            outcome = "failed" if timeout >= self.policy.send_timeout else "dropped"
+        except Exception:
+            outcome = "failed"
+        tracer.add(event.trace_id, "send", start, user=user.id, outcome=outcome)
+        return outcome
+
+    async def _publish_event(
+        self,
+        event: Event,
+        publisher_id: str | None,
+        deadline: Deadline | None = None,
+    ) -> PublishResult:
+        """Send event to users but the publisher, within the deadline.
+
+        A failing recipient doesn't fail the others, it is detached instead.
+        Presence frames are lossy, so failing them only counts as a drop.
+        """
+        deadline = deadline or self.deadline()
+        recipients = [user for user in self.users.values() if user.id != publisher_id]
+        with self.channel_controller.tracer.span(
+            event.trace_id, "fan-out", channel=self.id, recipients=len(recipients)
+        ):
+            outcomes = await gather(
+                *(self._send(user, event, deadline) for user in recipients)
+            )
+        result = PublishResult()
+        for user, outcome in zip(recipients, outcomes):
+            match outcome:
+                case "sent":
+                    result.sent += 1
+                case "dropped":
+                    result.dropped.append(user.id)
+                case "failed" if event.type == "presence":
+                    result.dropped.append(user.id)
+                case "failed":
+                    result.failed.append(user.id)
+                    self.detach(user)
+        self.dropped_sends += len(result.dropped)
+        self.failed_sends += len(result.failed)
+        return result
+
+    def detach(self, user: User):
+        """Make a failing user leave in background, not blocking publisher."""
+        if self.users.get(user.id) is user:
+            self.channel_controller.tasks.spawn(
+                self.leave(user), name="detach", owner=self.id, key=user.id
             )
 
+    async def _broadcast_event(
+        self, event: Event, publisher_id: str | None, deadline: Deadline
+    ) -> PublishResult:
+        """Publish event to every channel sharing the object store.
+
+        Spectators get the event encoded once through the broadcast stream.
+        """
+        channels = [self] if self.group is None else list(self.group.channels.values())
+        message = event.dumps()
+        for channel in channels:
+            channel.broadcast.publish(message)
+        results = await gather(
+            *(
+                channel._publish_event(event, publisher_id, deadline)
+                for channel in channels
+            )
+        )
+        result = PublishResult()
+        for channel_result in results:
+            result.update(channel_result)
+        return result
+
+    async def spectate(self) -> AsyncIterator[str]:
+        """Watch object updates as encoded events.
+
+        Spectators aren't capped by `max_ccu` and get neither join/leave
+        events nor notices. The first message is the current snapshot.
+        """
+        next_ = self.broadcast.subscribe()
+        try:
+            yield self.view(dumps_snapshot)
+            while True:
+                # Shield, cancelling a spectator must not cancel the others.
+                message, next_ = await shield(next_)
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe()
+
+    def unsubscribe(self):
+        """Unsubscribe from broadcast, closing the channel if nobody is left."""
+        self.broadcast.unsubscribe()
+        if self.idle():
+            self.close()
+
+    def idle(self) -> bool:
+        return not self.users and not self.resuming and not self.broadcast.subscribers
+
+    def close(self):
+        if self.channel_controller.get_channel(self.id) is self:
+            self.channel_controller.close_channel(self.id)
+        self.broadcast.publish(None)
+
+    def has_seat(self) -> bool:
+        seats = len(self.users) + len(self.resuming) + self.reserved_seats
+        return seats < self.policy.max_ccu
+
+    def reserve_seat(self, queued: bool = False) -> str | None:
+        """Reserve a seat without taking the event lock.
+
+        Nothing here awaits, so check-and-reserve is atomic on the event loop.
+        Seats go to `queued` users first. Returns error code if the join must
+        be rejected.
+        """
+        if self.pending >= self.policy.max_pending or (
+            self.pending and self.lock_wait > self.policy.max_lock_wait
+        ):
+            return "overloaded"
+        if not self.has_seat() or (self.waiting and not queued):
+            return "full"
+        self.reserved_seats += 1
+        return None
+
     async def join(self, user: User) -> None:
-        async with self.get_event_lock(user) as can_go:
-            if not can_go:
-                return
+        self.channel_controller.record("join", self, user)
+        # Page sessions rejoin without resume token, their seat is freed.
+        self.release_seat(user.id)
+        await self._join(user)
 
-            if user.id in self.users.keys():
-                return
+    async def _join(self, user: User, queued: bool = False) -> None:
+        if user.id in self.users.keys() or user.id in self.waiting.keys():
+            return
 
-            if len(self.users) >= self.policy.max_ccu:
+        match self.reserve_seat(queued):
+            case None:
+                pass
+            case _ if queued:
+                # Back to the head of the queue, its position is sent after.
+                self.waiting = {user.id: user, **self.waiting}
+                return
+            case "full" if len(self.waiting) < self.policy.waiting_room:
+                self.waiting[user.id] = user
                 await user.connection.send(
-                    ErrorEvent(code="full", message="Full users")
+                    WaitEvent.construct(position=len(self.waiting))
                 )
-            else:
+                if self.has_seat():
+                    # A seat freed while others waited, admit them in order.
+                    await self._admit_waiting()
+                return
+            case "full":
+                await user.connection.send(
+                    ErrorEvent.construct(code="full", message="Full users")
+                )
+                return
+            case code:
+                await user.connection.send(
+                    ErrorEvent.construct(code=code, message="Overloaded")
+                )
+                return
+
+        try:
+            deadline = self.deadline()
+            async with self.get_event_lock(user, deadline) as can_go:
+                if not can_go:
+                    return
+
+                if user.id in self.users.keys():
+                    return
+
                 self.users[user.id] = user
-                await self._publish_event(JoinEvent(user=user), user.id)
+                self.channel_controller.directory.joined(self.tree_id)
+                await self._publish_event(
+                    JoinEvent.construct(user=user.info()), user.id, deadline
+                )
+        finally:
+            self.reserved_seats -= 1
+
+    async def _admit_waiting(self):
+        while self.waiting and self.has_seat():
+            user_id = next(iter(self.waiting))
+            await self._join(self.waiting.pop(user_id), queued=True)
+            if user_id in self.waiting:
+                # Seat was taken meanwhile, and the user is waiting again.
+                break
 
-    async def push_object(self, obj: Object, appender: User):
-        async with self.get_event_lock(appender) as can_go:
+        # A failing or stuck send must not fail or hold up the leave.
+        await gather(
+            *(
+                wait_for(
+                    user.connection.send(WaitEvent.construct(position=position)),
+                    self.policy.send_timeout,
+                )
+                for position, user in enumerate(self.waiting.values(), start=1)
+            ),
+            return_exceptions=True,
+        )
+
+    async def push_object(
+        self, obj: Object, appender: User, trace_id: str | None = None
+    ):
+        if (comments := self.channel_controller.comments) is not None:
+            obj = await comments.sanitize_object(obj)
+        self.channel_controller.record("push-object", self, appender, [obj])
+        deadline = self.deadline()
+        async with self.get_event_lock(appender, deadline, trace_id) as can_go:
             if not can_go:
                 return
 
-            if appender.id not in self.users.keys():
+            # Existing objects change only through edits, and deletes win.
+            if (
+                appender.id not in self.users.keys()
+                or obj.id in self.objects
+                or obj.id in self.tombstones
+            ):
                 await appender.connection.send(
-                    ErrorEvent(code="invalid", message="invalid")
+                    ErrorEvent.construct(code="invalid", message="invalid")
                 )
+                return
 
             if len(self.objects) >= self.policy.max_objects:
                 firstkey, _ = next(iter(self.objects.items()))
@@ -195,44 +968,436 @@ class Channel(BaseModel):
             else:
                 firstkey = None
             self.objects[obj.id] = obj
-            await self._publish_event(
-                PushObjectEvent(appender=appender, object=obj, pop=firstkey),
+            self.snapshot.invalidate()
+            self.channel_controller.directory.pushed(self.tree_id)
+            if self.channel_controller.history is not None:
+                self.channel_controller.history.append(self.tree_id, obj)
+            if self.channel_controller.previews is not None:
+                self.channel_controller.previews.invalidate(self)
+            await self._broadcast_event(
+                PushObjectEvent.construct(
+                    appender=appender.info(),
+                    object=obj,
+                    pop=firstkey,
+                    trace_id=trace_id,
+                ),
                 appender.id,
+                deadline,
+            )
+
+    async def push_objects(
+        self, objs: list[Object], appender: User, trace_id: str | None = None
+    ):
+        """Push objects under one lock acquisition and publish one event."""
+        if len(objs) > self.policy.max_batch:
+            # Refused before sanitizing, which costs per object.
+            await appender.connection.send(
+                ErrorEvent.construct(code="too-large", message="Too many objects")
             )
+            return
+        if (comments := self.channel_controller.comments) is not None:
+            objs = list(await gather(*map(comments.sanitize_object, objs)))
+        self.channel_controller.record("push-objects", self, appender, objs)
+        deadline = self.deadline()
+        async with self.get_event_lock(appender, deadline, trace_id) as can_go:
+            if not can_go:
+                return
+
+            if appender.id not in self.users.keys():
+                await appender.connection.send(
+                    ErrorEvent.construct(code="invalid", message="invalid")
+                )
+                return
+
+            # Later duplicates win, and only the last max_objects can stay.
+            batch = {
+                obj.id: obj
+                for obj in objs
+                if obj.id not in self.objects and obj.id not in self.tombstones
+            }
+            if not batch:
+                return
+            if self.channel_controller.history is not None:
+                for obj in batch.values():
+                    self.channel_controller.history.append(self.tree_id, obj)
+            objs = list(batch.values())[-self.policy.max_objects :]
+
+            overflow = len(self.objects) + len(objs) - self.policy.max_objects
+            pops = list(islice(self.objects, max(overflow, 0)))
+            for key in pops:
+                del self.objects[key]
+            self.objects.update((obj.id, obj) for obj in objs)
+            self.snapshot.invalidate()
+            self.channel_controller.directory.pushed(self.tree_id, len(objs))
+            if self.channel_controller.previews is not None:
+                self.channel_controller.previews.invalidate(self)
+
+            await self._broadcast_event(
+                PushObjectsEvent.construct(
+                    appender=appender.info(),
+                    objects=objs,
+                    pops=pops,
+                    trace_id=trace_id,
+                ),
+                appender.id,
+                deadline,
+            )
+
+    def trim_objects(self):
+        """Evict the oldest objects over `max_objects`, once it was lowered."""
+        overflow = len(self.objects) - self.policy.max_objects
+        if overflow <= 0:
+            return
+        for key in list(islice(self.objects, overflow)):
+            del self.objects[key]
+        self.snapshot.invalidate()
+        if self.channel_controller.previews is not None:
+            self.channel_controller.previews.invalidate(self)
+
+    def merge(self, edit: EditEvent) -> bool:
+        """Apply stamped edit if it is the last write, returns if it was.
+
+        Each field of an object is a last-writer-wins register and deletes
+        win over any edit, so edits merge the same in any order. Objects are
+        replaced instead of updated in place, snapshots may still share them.
+        """
+        tombstone = self.tombstones.get(edit.id)
+        if tombstone is not None:
+            if edit.stamp > tombstone and isinstance(edit, DeleteObjectEvent):
+                self.tombstones[edit.id] = edit.stamp
+            return False
+        obj = self.objects.get(edit.id)
+        if isinstance(edit, DeleteObjectEvent):
+            # Tombstoned even if unknown, the push may not have arrived yet.
+            # Bounded by max_objects, so unknown ids can't flood them.
+            self.tombstones[edit.id] = edit.stamp
+            if len(self.tombstones) > self.policy.max_objects:
+                del self.tombstones[next(iter(self.tombstones))]
+            if obj is None:
+                return False
+            del self.objects[edit.id]
+        elif obj is None:
+            return False
+        else:
+            field = EDIT_FIELDS[edit.type]
+            if (current := obj.stamps.get(field)) is not None and current >= edit.stamp:
+                return False
+            self.objects[edit.id] = obj.copy(
+                update={
+                    field: getattr(edit, field),
+                    "stamps": {**obj.stamps, field: edit.stamp},
+                }
+            )
+        self.snapshot.invalidate()
+        if self.channel_controller.previews is not None:
+            self.channel_controller.previews.invalidate(self)
+        return True
+
+    async def edit_object(
+        self, edit: EditEvent, editor: User, trace_id: str | None = None
+    ):
+        """Move, edit comment of or delete an object, without the event lock.
+
+        Edits without stamp are stamped here. Stamped ones come from other
+        workers, and move the clock forward.
+        """
+        if editor.id not in self.users.keys():
+            await editor.connection.send(
+                ErrorEvent.construct(code="invalid", message="invalid")
+            )
+            return
+        comments = self.channel_controller.comments
+        if isinstance(edit, EditCommentEvent) and comments is not None:
+            edit = edit.copy(update={"comment": await comments.sanitize(edit.comment)})
+        # Checked after sanitizing, draining may have started meanwhile.
+        if self.channel_controller.draining:
+            await editor.connection.send(
+                ErrorEvent.construct(code="draining", message="Draining")
+            )
+            return
+
+        clock = self.channel_controller.clock
+        stamp = clock.now() if edit.stamp is None else clock.update(edit.stamp)
+        edit = edit.copy(
+            update={
+                "editor": editor.info(),
+                "stamp": edit.stamp or stamp,
+                "trace_id": trace_id,
+            }
+        )
+        self.channel_controller.record(edit.type, self, editor, edit=edit)
+        if self.merge(edit):
+            if self.channel_controller.history is not None:
+                self.channel_controller.history.append_edit(self.tree_id, edit)
+            await self._broadcast_event(edit, editor.id, self.deadline())
+
+    def report_cursor(self, user: User, x: int, y: int):
+        """Keep the latest cursor of user, published on the next tick."""
+        if user.id not in self.users.keys() or not self.policy.presence_rate:
+            return
+        self.presence.report(
+            Cursor.construct(id=user.id, nickname=user.nickname, x=x, y=y)
+        )
+        self._start_presence()
+
+    def _start_presence(self):
+        if not self.presence.ticking:
+            self.presence.ticking = True
+            task = self.channel_controller.tasks.spawn(
+                self._tick_presence(), name="presence", owner=self.id, key="presence"
+            )
+            # Not in the coroutine, it never runs if cancelled before starting.
+            task.add_done_callback(self._presence_done)
+
+    def _presence_done(self, task: Task):
+        self.presence.ticking = False
+
+    async def _tick_presence(self):
+        """Publish cursors at `presence_rate` while they change."""
+        while self.policy.presence_rate:
+            await sleep(1 / self.policy.presence_rate)
+            if (frame := self.presence.frame()) is None:
+                return
+            await self._publish_event(frame, None)
+
+    def resume(self, token: str, user: User) -> bool:
+        """Seat user handed over from the previous worker, without join event."""
+        if self.resuming.pop(token, None) is None:
+            return False
+        self.users[user.id] = user
+        self.channel_controller.directory.joined(self.tree_id)
+        return True
+
+    def holds_seat(self, user_id: str) -> bool:
+        """Whether a seat is held for handed over user."""
+        return any(info.id == user_id for info in self.resuming.values())
+
+    def release_seat(self, user_id: str):
+        """Free seat held for handed over user, who joins again instead."""
+        for token in [t for t, info in self.resuming.items() if info.id == user_id]:
+            del self.resuming[token]
+
+    async def expire_resuming(self, timeout: float):
+        """Free seats of handed over users who didn't come back."""
+        await sleep(timeout)
+        self.resuming.clear()
+        if self.idle():
+            self.close()
 
     async def leave(self, user: User):
         # This method is executed when disconnected.
         # If leave event must be pulbished.
-        self.users.pop(user.id, None)
+        self.channel_controller.record("leave", self, user)
+        if self.waiting.pop(user.id, None) is not None:
+            await self._admit_waiting()
+            return
+
+        if self.users.pop(user.id, None) is not None:
+            self.channel_controller.directory.left(self.tree_id)
+        if self.presence.remove(user.id) and self.users:
+            self._start_presence()
         if len(self.users) > 0:
-            await self._publish_event(LeaveEvent(user=user), user.id)
-        else:
-            self.channel_controller.close_channel(self.id)
+            await self._publish_event(LeaveEvent.construct(user=user.info()), user.id)
+        if self.waiting:
+            await self._admit_waiting()
+        elif self.idle():
+            self.close()
+
+
+class ChannelGroup(BaseModel):
+    """Group of sub-channels sharing one tree.
 
+    Sub-channels hold up to `max_ccu` users each and share the object store,
+    so pushes are fanned out across the group.
+    """
 
-class ChannelPolicy(BaseModel):
-    max_objects: int = 30
-    max_ccu: int = 10
-    timeout: float | int = 1
-    cooltime: int = 10
+    id: str
+    channels: dict[str, Channel] = Field(default_factory=dict)
+    objects: dict[str, Object] = Field(default_factory=dict)
+    tombstones: dict[str, Stamp] = Field(default_factory=dict)
+    snapshot: Snapshot = Field(default_factory=Snapshot, exclude=True)
+    next_index: int = 1
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def user_count(self) -> int:
+        return sum(len(channel.users) for channel in self.channels.values())
+
+    @property
+    def users(self) -> dict[str, User]:
+        return {
+            user.id: user
+            for channel in self.channels.values()
+            for user in channel.users.values()
+        }
+
+    def add(self, channel: Channel):
+        assert channel.group is None
+        if not self.channels:
+            self.objects, self.snapshot = channel.objects, channel.snapshot
+            self.tombstones = channel.tombstones
+        # Share the store by reference, not a validated copy.
+        channel.objects, channel.snapshot = self.objects, self.snapshot
+        channel.tombstones = self.tombstones
+        channel.group = self
+        self.channels[channel.id] = channel
+
+    def remove(self, channel: Channel):
+        del self.channels[channel.id]
+        channel.group = None
+
+    def new_channel_id(self) -> str:
+        if self.id not in self.channels:
+            return self.id
+        channel_id = f"{self.id}#{self.next_index}"
+        self.next_index += 1
+        return channel_id
 
 
 class ChannelController(BaseModel):
     channels: dict[str, Channel] = Field(default_factory=dict)
+    groups: dict[str, ChannelGroup] = Field(default_factory=dict)
+    policies: PolicyRegistry = Field(default_factory=PolicyRegistry)
+    history: HistoryStore | None = Field(None, exclude=True)
+    previews: PreviewRenderer | None = Field(None, exclude=True)
+    comments: CommentSanitizer | None = Field(None, exclude=True)
+    recorder: TraceRecorder | None = Field(None, exclude=True)
+    tasks: TaskSupervisor = Field(default_factory=TaskSupervisor, exclude=True)
+    directory: ChannelDirectory = Field(default_factory=ChannelDirectory, exclude=True)
+    clock: HybridClock = Field(default_factory=HybridClock, exclude=True)
+    tracer: Tracer = Field(default_factory=Tracer, exclude=True)
+    # Set while handing channels over to the next worker
+    draining: bool = False
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def stats(self) -> ChannelStats:
+        stats = ChannelStats()
+        for channel in self.channels.values():
+            stats.users += len(channel.users)
+            stats.spectators += channel.broadcast.subscribers
+            stats.dropped_sends += channel.dropped_sends
+            stats.failed_sends += channel.failed_sends
+        # Sub-channels share the objects and snapshot of their group.
+        owners = [channel for channel in self.channels.values() if not channel.group]
+        for owner in [*owners, *self.groups.values()]:
+            stats.objects += len(owner.objects)
+            stats.snapshot_hits += owner.snapshot.hits
+            stats.snapshot_misses += owner.snapshot.misses
+        return stats
+
+    def record(
+        self,
+        op: str,
+        channel: Channel,
+        user: User,
+        objects: Iterable[Object] = (),
+        edit: EditEvent | None = None,
+    ):
+        if self.recorder is not None:
+            self.recorder.record(op, channel, user, objects, edit)
+
+    def tree_objects(self, tree_id: str) -> tuple[Object, ...] | None:
+        """Current objects of the tree, `None` if no channel is open."""
+        if (group := self.groups.get(tree_id)) is not None:
+            return group.snapshot.objects(group.objects)
+        if (channel := self.channels.get(tree_id)) is not None:
+            return channel.object_list()
+        return None
 
     def get_channel(self, channel_id: str) -> Channel | None:
         return self.channels.get(channel_id, None)
 
-    def create_channel(self, channel_id: str) -> Channel | None:
+    def create_channel(
+        self, channel_id: str, policy: ChannelPolicy | None = None
+    ) -> Channel | None:
         if channel_id in self.channels:
             return self.channels.get(channel_id)
         else:
             channel = Channel(id=channel_id)
             self.channels[channel_id] = channel
-            # TODO: Remove policy hard coding
-            channel.initialize(self, ChannelPolicy(max_objects=30, max_ccu=10))
+            channel.initialize(self, policy or self.get_policy(channel_id))
             return channel
 
+    def get_policy(self, channel_id: str) -> ChannelPolicy:
+        return self.policies.get(channel_id)
+
+    def reload_policies(self) -> bool:
+        """Reload policies and apply them to live channels."""
+        if not self.policies.reload():
+            return False
+
+        for channel in self.channels.values():
+            # Update in place, channels read policy on every operation.
+            for name, value in self.get_policy(channel.tree_id):
+                setattr(channel.policy, name, value)
+            channel.trim_objects()
+        return True
+
+    async def watch_policies(self, interval: float = 5):
+        failed_error = None
+        while True:
+            await sleep(interval)
+            try:
+                self.reload_policies()
+            except Exception as error:
+                # Keep current policies until the file is fixed.
+                if repr(error) != failed_error:
+                    failed_error = repr(error)
+                    logger.exception("Keeping current policies, file is broken")
+                continue
+            failed_error = None
+
+    def assign_channel(self, tree_id: str, user_id: str | None = None) -> Channel:
+        """Get channel to join for the tree, spilling over to sub-channels.
+
+        Handed over users joining again by `user_id` get the sub-channel
+        holding their seat.
+        """
+        group = self.groups.get(tree_id)
+        if group is None:
+            channel = self.create_channel(tree_id)
+            if not channel.policy.overflow:
+                return channel
+            group = self.groups[tree_id] = ChannelGroup(id=tree_id)
+            group.add(channel)
+
+        if user_id is not None:
+            for channel in group.channels.values():
+                if channel.holds_seat(user_id):
+                    return channel
+        for channel in group.channels.values():
+            if channel.has_seat():
+                return channel
+
+        policy = self.get_policy(tree_id)
+        if group.channels and len(group.channels) >= policy.max_subchannels:
+            # Let the sub-channel reject or queue the user.
+            return next(iter(group.channels.values()))
+
+        channel = self.create_channel(group.new_channel_id(), policy)
+        group.add(channel)
+        return channel
+
+    def resume_channel(self, tree_id: str, token: str) -> Channel | None:
+        """Channel of the tree the user with resume token was handed over to."""
+        if (group := self.groups.get(tree_id)) is not None:
+            channels = list(group.channels.values())
+        else:
+            channels = [self.channels[tree_id]] if tree_id in self.channels else []
+        return next((c for c in channels if token in c.resuming), None)
+
     def close_channel(self, channel_id: str) -> None:
         assert channel_id in self.channels
-        del self.channels[channel_id]
+        channel = self.channels.pop(channel_id)
+        if (group := channel.group) is not None:
+            group.remove(channel)
+            if not group.channels:
+                del self.groups[group.id]
+                self.directory.remove(group.id)
+        else:
+            self.directory.remove(channel_id)
@@ -0,0 +1,58 @@
+"""Hybrid logical clock."""
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+from uuid import uuid4
+
+
+class Stamp(NamedTuple):
+    """Hybrid logical clock timestamp, totally ordered across nodes."""
+
+    # Milliseconds since epoch
+    wall: int
+    counter: int
+    node: str
+
+    def encode(self) -> list:
+        return [self.wall, self.counter, self.node]
+
+    @classmethod
+    def decode(cls, data: list) -> Stamp:
+        return cls(*data)
+
+
+class HybridClock:
+    """Clock whose stamps follow wall time but never go backwards.
+
+    Stamps received from other nodes move the clock forward, so a write
+    made after seeing another one always has a greater stamp.
+    """
+
+    def __init__(self, node: str | None = None, clock: Callable[[], float] = time.time):
+        self.node = node or uuid4().hex[:8]
+        self.clock = clock
+        self.last = Stamp(0, 0, self.node)
+
+    def now(self) -> Stamp:
+        wall = int(self.clock() * 1000)
+        if wall > self.last.wall:
+            self.last = Stamp(wall, 0, self.node)
+        else:
+            self.last = Stamp(self.last.wall, self.last.counter + 1, self.node)
+        return self.last
+
+    def update(self, remote: Stamp) -> Stamp:
+        wall = int(self.clock() * 1000)
+        latest = max(wall, self.last.wall, remote.wall)
+        if latest == self.last.wall == remote.wall:
+            counter = max(self.last.counter, remote.counter) + 1
+        elif latest == self.last.wall:
+            counter = self.last.counter + 1
+        elif latest == remote.wall:
+            counter = remote.counter + 1
+        else:
+            counter = 0
+        self.last = Stamp(latest, counter, self.node)
+        return self.last
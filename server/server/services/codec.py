@@ -0,0 +1,425 @@
+"""Event codec."""
+from __future__ import annotations
+
+import json
+import zlib
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+from server.services.channel import (
+    BaseEvent,
+    Channel,
+    Cursor,
+    CursorEvent,
+    DeleteObjectEvent,
+    EditCommentEvent,
+    ErrorEvent,
+    Event,
+    JoinEvent,
+    LeaveEvent,
+    MoveObjectEvent,
+    Object,
+    Position,
+    PresenceEvent,
+    PushObjectEvent,
+    PushObjectsEvent,
+    SnapshotEvent,
+    UserInfo,
+    WaitEvent,
+)
+from server.services.clock import Stamp
+
+EVENT_TYPES: dict[str, type[BaseEvent]] = {
+    cls.__fields__["type"].default: cls
+    for cls in (
+        JoinEvent,
+        PushObjectEvent,
+        PushObjectsEvent,
+        MoveObjectEvent,
+        EditCommentEvent,
+        DeleteObjectEvent,
+        LeaveEvent,
+        CursorEvent,
+        PresenceEvent,
+        WaitEvent,
+        SnapshotEvent,
+        ErrorEvent,
+    )
+}
+
+
+def decode_event(data: dict) -> BaseEvent:
+    """Decode trusted event data, skipping validation."""
+    return EVENT_TYPES[data["type"]].decode(data)
+
+
+def loads_event(message: str | bytes) -> BaseEvent:
+    return decode_event(json.loads(message))
+
+
+def parse_event(data: dict) -> BaseEvent:
+    """Decode untrusted event data with validation."""
+    return Event.parse_obj(data).__root__
+
+
+def parse_binary(data: bytes) -> BaseEvent:
+    """Decode untrusted binary event with validation."""
+    return parse_event(decode_binary(data).dict())
+
+
+# Binary protocol
+#
+# Event is a type tag byte followed by its fields. Integers are zigzag
+# varints, strings are length prefixed UTF-8, optional strings store
+# length + 1 with 0 for `None`, and `created_at` is microseconds since
+# epoch of the naive datetime. Clock stamps of edits are wall time,
+# counter and node.
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Never reuse or renumber tags, clients depend on them.
+BINARY_TAGS: dict[str, int] = {
+    "join": 1,
+    "push-object": 2,
+    "push-objects": 3,
+    "leave": 4,
+    "wait": 5,
+    "snapshot": 6,
+    "error": 7,
+    "move-object": 8,
+    "edit-comment": 9,
+    "delete-object": 10,
+    "cursor": 11,
+    "presence": 12,
+}
+BINARY_EVENT_TYPES = {tag: event_type for event_type, tag in BINARY_TAGS.items()}
+
+
+class BinaryWriter:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def uint(self, value: int):
+        while value > 0x7F:
+            self.buffer.append(value & 0x7F | 0x80)
+            value >>= 7
+        self.buffer.append(value)
+
+    def int(self, value: int):
+        self.uint(value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def str(self, value: str):
+        data = value.encode()
+        self.uint(len(data))
+        self.buffer += data
+
+    def optional_str(self, value: str | None):
+        if value is None:
+            self.uint(0)
+        else:
+            data = value.encode()
+            self.uint(len(data) + 1)
+            self.buffer += data
+
+    def user(self, user: UserInfo):
+        self.str(user.id)
+        self.str(user.nickname)
+
+    def object(self, obj: Object):
+        self.str(obj.id)
+        self.str(obj.url)
+        self.str(obj.comment)
+        self.int((obj.created_at - EPOCH) // MICROSECOND)
+        self.int(obj.position.x)
+        self.int(obj.position.y)
+
+    def objects(self, objs: list[Object]):
+        self.uint(len(objs))
+        for obj in objs:
+            self.object(obj)
+
+    def cursor(self, cursor: Cursor):
+        self.str(cursor.id)
+        self.str(cursor.nickname)
+        self.int(cursor.x)
+        self.int(cursor.y)
+
+    def stamp(self, stamp: Stamp):
+        self.uint(stamp.wall)
+        self.uint(stamp.counter)
+        self.str(stamp.node)
+
+
+class BinaryReader:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def uint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def int(self) -> int:
+        value = self.uint()
+        return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+    def str(self) -> str:
+        size = self.uint()
+        value = str(self.data[self.offset : self.offset + size], "utf-8")
+        self.offset += size
+        return value
+
+    def optional_str(self) -> str | None:
+        size = self.uint()
+        if size == 0:
+            return None
+        value = str(self.data[self.offset : self.offset + size - 1], "utf-8")
+        self.offset += size - 1
+        return value
+
+    def user(self) -> UserInfo:
+        return UserInfo.construct(id=self.str(), nickname=self.str())
+
+    def object(self) -> Object:
+        return Object.construct(
+            id=self.str(),
+            url=self.str(),
+            comment=self.str(),
+            created_at=EPOCH + self.int() * MICROSECOND,
+            position=Position.construct(x=self.int(), y=self.int()),
+        )
+
+    def objects(self) -> list[Object]:
+        return [self.object() for _ in range(self.uint())]
+
+    def cursor(self) -> Cursor:
+        return Cursor.construct(
+            id=self.str(), nickname=self.str(), x=self.int(), y=self.int()
+        )
+
+    def stamp(self) -> Stamp:
+        return Stamp(self.uint(), self.uint(), self.str())
+
+
+def encode_binary(event: BaseEvent) -> bytes:
+    writer = BinaryWriter()
+    writer.buffer.append(BINARY_TAGS[event.type])
+    match event:
+        case JoinEvent() | LeaveEvent():
+            writer.user(event.user)
+        case PushObjectEvent():
+            writer.object(event.object)
+            writer.user(event.appender)
+            writer.optional_str(event.pop)
+        case PushObjectsEvent():
+            writer.objects(event.objects)
+            writer.user(event.appender)
+            writer.uint(len(event.pops))
+            for pop in event.pops:
+                writer.str(pop)
+        case MoveObjectEvent():
+            writer.str(event.id)
+            writer.int(event.position.x)
+            writer.int(event.position.y)
+            writer.user(event.editor)
+            writer.stamp(event.stamp)
+        case EditCommentEvent():
+            writer.str(event.id)
+            writer.str(event.comment)
+            writer.user(event.editor)
+            writer.stamp(event.stamp)
+        case DeleteObjectEvent():
+            writer.str(event.id)
+            writer.user(event.editor)
+            writer.stamp(event.stamp)
+        case CursorEvent():
+            writer.int(event.x)
+            writer.int(event.y)
+        case PresenceEvent():
+            writer.uint(len(event.cursors))
+            for cursor in event.cursors:
+                writer.cursor(cursor)
+        case WaitEvent():
+            writer.uint(event.position)
+        case SnapshotEvent():
+            writer.objects(event.objects)
+        case ErrorEvent():
+            writer.str(event.code)
+            writer.str(event.message)
+    return bytes(writer.buffer)
+
+
+def decode_binary(data: bytes) -> BaseEvent:
+    reader = BinaryReader(data)
+    reader.offset = 1
+    match BINARY_EVENT_TYPES[data[0]]:
+        case "join":
+            return JoinEvent.construct(user=reader.user())
+        case "leave":
+            return LeaveEvent.construct(user=reader.user())
+        case "push-object":
+            return PushObjectEvent.construct(
+                object=reader.object(),
+                appender=reader.user(),
+                pop=reader.optional_str(),
+            )
+        case "push-objects":
+            return PushObjectsEvent.construct(
+                objects=reader.objects(),
+                appender=reader.user(),
+                pops=[reader.str() for _ in range(reader.uint())],
+            )
+        case "move-object":
+            return MoveObjectEvent.construct(
+                id=reader.str(),
+                position=Position.construct(x=reader.int(), y=reader.int()),
+                editor=reader.user(),
+                stamp=reader.stamp(),
+            )
+        case "edit-comment":
+            return EditCommentEvent.construct(
+                id=reader.str(),
+                comment=reader.str(),
+                editor=reader.user(),
+                stamp=reader.stamp(),
+            )
+        case "delete-object":
+            return DeleteObjectEvent.construct(
+                id=reader.str(), editor=reader.user(), stamp=reader.stamp()
+            )
+        case "cursor":
+            return CursorEvent.construct(x=reader.int(), y=reader.int())
+        case "presence":
+            return PresenceEvent.construct(
+                cursors=[reader.cursor() for _ in range(reader.uint())]
+            )
+        case "wait":
+            return WaitEvent.construct(position=reader.uint())
+        case "snapshot":
+            return SnapshotEvent.construct(objects=reader.objects())
+        case "error":
+            return ErrorEvent.construct(code=reader.str(), message=reader.str())
+
+
+# Compact snapshot
+#
+# Objects are `[id, url index, comment, created_at delta, x, y]` rows. URLs
+# are interned in a per-connection string table, only new entries are sent,
+# and created_at is microseconds from the previous row (or `base`).
+
+
+def deflate(data: bytes) -> bytes:
+    # Raw deflate stream, as permessage-deflate does.
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def inflate(data: bytes) -> bytes:
+    return zlib.decompress(data, wbits=-zlib.MAX_WBITS)
+
+
+class SnapshotEncoder:
+    """Snapshot encoder of a connection."""
+
+    def __init__(self, compress: bool = False):
+        self.compress = compress
+        self.urls: dict[str, int] = {}
+
+    def encode(self, objects: list[Object]) -> dict:
+        new_urls = []
+        rows = []
+        base = previous = (
+            (objects[0].created_at - EPOCH) // MICROSECOND if objects else 0
+        )
+        for obj in objects:
+            if (index := self.urls.get(obj.url)) is None:
+                index = self.urls[obj.url] = len(self.urls)
+                new_urls.append(obj.url)
+            created_at = (obj.created_at - EPOCH) // MICROSECOND
+            rows.append(
+                [
+                    obj.id,
+                    index,
+                    obj.comment,
+                    created_at - previous,
+                    obj.position.x,
+                    obj.position.y,
+                ]
+            )
+            previous = created_at
+        return {"type": "snapshot", "urls": new_urls, "base": base, "objects": rows}
+
+    def dumps(self, objects: list[Object]) -> str | bytes:
+        message = json.dumps(
+            self.encode(objects), ensure_ascii=False, separators=(",", ":")
+        )
+        return deflate(message.encode()) if self.compress else message
+
+    def dumps_channel(self, channel: Channel) -> str | bytes:
+        """Dump current objects of the channel.
+
+        Every fresh connection gets the same message, so it is encoded once
+        per channel version and shared.
+        """
+        if self.urls:
+            return self.dumps(list(channel.object_list()))
+        build = deflated_json_snapshot if self.compress else json_snapshot
+        message, urls = channel.view(build)
+        self.urls = dict(urls)
+        return message
+
+
+# Snapshots for fresh connections, built by `Channel.view`
+
+
+def json_snapshot(objects: Sequence[Object]) -> tuple[str, dict[str, int]]:
+    encoder = SnapshotEncoder()
+    return encoder.dumps(list(objects)), encoder.urls
+
+
+def deflated_json_snapshot(objects: Sequence[Object]) -> tuple[bytes, dict[str, int]]:
+    encoder = SnapshotEncoder(compress=True)
+    return encoder.dumps(list(objects)), encoder.urls
+
+
+def binary_snapshot(objects: Sequence[Object]) -> bytes:
+    return encode_binary(SnapshotEvent.construct(objects=list(objects)))
+
+
+def deflated_binary_snapshot(objects: Sequence[Object]) -> bytes:
+    return deflate(binary_snapshot(objects))
+
+
+class SnapshotDecoder:
+    """Counterpart of `SnapshotEncoder`, keeping the string table."""
+
+    def __init__(self):
+        self.urls: list[str] = []
+
+    def decode(self, data: dict) -> SnapshotEvent:
+        self.urls += data["urls"]
+        objects = []
+        created_at = data["base"]
+        for id, index, comment, delta, x, y in data["objects"]:
+            created_at += delta
+            objects.append(
+                Object.construct(
+                    id=id,
+                    url=self.urls[index],
+                    comment=comment,
+                    created_at=EPOCH + created_at * MICROSECOND,
+                    position=Position.construct(x=x, y=y),
+                )
+            )
+        return SnapshotEvent.construct(objects=objects)
+
+    def loads(self, message: str | bytes) -> SnapshotEvent:
+        if isinstance(message, bytes):
+            message = inflate(message)
+        return self.decode(json.loads(message))
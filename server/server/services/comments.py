@@ -0,0 +1,233 @@
+"""Comment sanitization.
+
+Pool workers import this module, so it must not import channel at runtime.
+"""
+from __future__ import annotations
+
+import html
+import logging
+import re
+import unicodedata
+from asyncio import Future, get_running_loop, shield, wait_for
+from collections import OrderedDict, deque
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from server.services.channel import Object
+
+TAG = re.compile(r"<[^>]*>")
+logger = logging.getLogger(__name__)
+
+
+class ProfanityMatcher:
+    """Aho–Corasick automaton masking every listed word in one pass."""
+
+    def __init__(self, words: Iterable[str]):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail = [0]
+        # Length of the longest word ending at each state
+        self.match = [0]
+        for word in words:
+            word = unicodedata.normalize("NFC", word.strip()).lower()
+            if word:
+                self._add(word)
+        self._link()
+
+    def _add(self, word: str):
+        state = 0
+        for char in word:
+            if (next_ := self.goto[state].get(char)) is None:
+                next_ = self.goto[state][char] = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.match.append(0)
+            state = next_
+        self.match[state] = max(self.match[state], len(word))
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_ in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_] = self.goto[fail].get(char, 0)
+                self.match[next_] = max(self.match[next_], self.match[self.fail[next_]])
+                queue.append(next_)
+
+    def mask(self, text: str) -> str:
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = text
+        masked = bytearray(len(text))
+        state = 0
+        for index, char in enumerate(lowered):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if length := self.match[state]:
+                masked[index - length + 1 : index + 1] = b"\x01" * length
+        if not any(masked):
+            return text
+        return "".join("*" if m else char for char, m in zip(text, masked))
+
+
+def load_words(path: str | Path) -> list[str]:
+    path = Path(path)
+    if not path.exists():
+        return []
+    return [line for line in path.read_text(encoding="utf-8").splitlines() if line]
+
+
+def sanitize(comment: str, max_length: int, matcher: ProfanityMatcher) -> str:
+    """Normalized plain text comment, cut to `max_length`, profanity masked."""
+    text = unicodedata.normalize("NFC", comment)
+    # Strip again, tags may be hidden in entities.
+    text = TAG.sub("", html.unescape(TAG.sub("", text)))
+    text = " ".join(text.split())
+    text = "".join(c for c in text if unicodedata.category(c) != "Cc")[:max_length]
+    return matcher.mask(text)
+
+
+# Matcher of pool workers, compiled once per process
+_matcher: ProfanityMatcher | None = None
+
+
+def _init_worker(words: list[str]):
+    global _matcher
+    _matcher = ProfanityMatcher(words)
+
+
+def _sanitize_batch(comments: list[str], max_length: int) -> list[str]:
+    return [sanitize(comment, max_length, _matcher) for comment in comments]
+
+
+class CommentSanitizer:
+    """Sanitizes comments in a process pool, in batches.
+
+    Comments arriving within `delay` of each other are sent to the pool in
+    one batch of up to `batch_size`, and results are cached. A comment not
+    done within `timeout` is sanitized inline instead, so push latency
+    stays bounded when the pool is backed up.
+    """
+
+    def __init__(
+        self,
+        words: Iterable[str] = (),
+        max_length: int = 100,
+        workers: int = 1,
+        batch_size: int = 64,
+        delay: float = 0.005,
+        timeout: float = 0.2,
+        cache_size: int = 4096,
+    ):
+        self.words = list(words)
+        self.matcher = ProfanityMatcher(self.words)
+        self.max_length = max_length
+        self.workers = workers
+        self.batch_size = batch_size
+        self.delay = delay
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache: OrderedDict[str, str] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.batch: list[str] = []
+        self._pool: ProcessPoolExecutor | None = None
+        self._flush_handle = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                # Fork isn't safe with threads of the server running.
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.words,),
+            )
+        return self._pool
+
+    async def sanitize(self, comment: str) -> str:
+        if (cached := self.cache.get(comment)) is not None:
+            self.cache.move_to_end(comment)
+            return cached
+
+        if (future := self.pending.get(comment)) is None:
+            future = self.pending[comment] = get_running_loop().create_future()
+            self.batch.append(comment)
+            if len(self.batch) >= self.batch_size:
+                self.flush()
+            elif self._flush_handle is None:
+                self._flush_handle = get_running_loop().call_later(
+                    self.delay, self.flush
+                )
+        try:
+            # Shield, the batch is shared with other pushes.
+            return await wait_for(shield(future), self.timeout)
+        except TimeoutError:
+            return sanitize(comment, self.max_length, self.matcher)
+
+    async def sanitize_object(self, obj: Object) -> Object:
+        comment = await self.sanitize(obj.comment)
+        if comment == obj.comment:
+            return obj
+        return obj.copy(update={"comment": comment, "stamps": obj.stamps})
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        loop = get_running_loop()
+        try:
+            result = loop.run_in_executor(
+                self.pool, _sanitize_batch, batch, self.max_length
+            )
+        except Exception:
+            # Broken or shut down pool, sanitize inline and start a new one.
+            logger.exception("Failed to submit comments to the pool")
+            self._close_pool()
+            self._resolve(batch, None)
+            return
+        result.add_done_callback(lambda done: self._done(batch, done))
+
+    def _done(self, batch: list[str], done: Future):
+        if done.cancelled() or done.exception() is not None:
+            if not done.cancelled() and isinstance(done.exception(), BrokenProcessPool):
+                self._close_pool()
+            self._resolve(batch, None)
+        else:
+            self._resolve(batch, done.result())
+
+    def _resolve(self, batch: list[str], results: list[str] | None):
+        """Settle pending comments, sanitized inline without `results`."""
+        for index, comment in enumerate(batch):
+            future = self.pending.pop(comment)
+            if results is None:
+                result = sanitize(comment, self.max_length, self.matcher)
+            else:
+                result = results[index]
+            self.cache[comment] = result
+            if not future.done():
+                future.set_result(result)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._close_pool()
@@ -0,0 +1,146 @@
+"""Directory of active trees."""
+from __future__ import annotations
+
+import heapq
+import math
+import time
+from bisect import bisect_left, insort
+from collections.abc import Callable
+from datetime import datetime
+from typing import Literal
+
+from server.base import BaseModel
+
+Ranking = Literal["trending", "users"]
+
+
+class TreeSummary(BaseModel):
+    id: str
+    users: int
+    # Decayed pushes per minute
+    push_rate: float
+    last_active: datetime
+
+
+class DirectoryEntry:
+    __slots__ = ("id", "users", "weight", "last_active", "version")
+
+    def __init__(self, id: str, now: float):
+        self.id = id
+        self.users = 0
+        self.weight = 0.0
+        self.last_active = now
+        self.version = 0
+
+
+class ChannelDirectory:
+    """Active trees ranked by users and recent pushes, updated incrementally.
+
+    Push rates decay exponentially with `half_life`. They are kept forward
+    decayed, as weights relative to a fixed landmark time, so an update
+    changes only the ranking of the updated tree. Rankings are heaps with
+    lazy invalidation by version. Versions count across the directory, so
+    heap entries of a removed tree stay invalid if it comes back.
+
+    Ids are kept in a sorted list for prefix search. Adding or removing a
+    tree shifts the list, which is O(n) but cheap next to joins and pushes.
+    """
+
+    def __init__(self, half_life: float = 600, clock: Callable[[], float] = time.time):
+        self.decay = math.log(2) / half_life
+        self.clock = clock
+        self.landmark = clock()
+        self.entries: dict[str, DirectoryEntry] = {}
+        self.ids: list[str] = []
+        self.version = 0
+        self.heaps: dict[Ranking, list[tuple[float, int, str]]] = {
+            "trending": [],
+            "users": [],
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def joined(self, tree_id: str):
+        self._update(self._entry(tree_id), users=1)
+
+    def left(self, tree_id: str):
+        if (entry := self.entries.get(tree_id)) is not None:
+            self._update(entry, users=-1)
+
+    def pushed(self, tree_id: str, count: int = 1):
+        self._update(self._entry(tree_id), pushes=count)
+
+    def remove(self, tree_id: str):
+        if self.entries.pop(tree_id, None) is not None:
+            del self.ids[bisect_left(self.ids, tree_id)]
+
+    def top(self, k: int, by: Ranking = "trending") -> list[TreeSummary]:
+        """Top trees, popping `k` valid heap entries and pushing them back."""
+        heap = self.heaps[by]
+        found = []
+        while heap and len(found) < k:
+            item = heapq.heappop(heap)
+            entry = self.entries.get(item[2])
+            if entry is not None and entry.version == item[1]:
+                found.append(item)
+        for item in found:
+            heapq.heappush(heap, item)
+        return [self.summary(self.entries[tree_id]) for _, _, tree_id in found]
+
+    def search(self, prefix: str, limit: int = 20) -> list[TreeSummary]:
+        start = bisect_left(self.ids, prefix)
+        summaries = []
+        for tree_id in self.ids[start : start + limit]:
+            if not tree_id.startswith(prefix):
+                break
+            summaries.append(self.summary(self.entries[tree_id]))
+        return summaries
+
+    def summary(self, entry: DirectoryEntry) -> TreeSummary:
+        now = self.clock()
+        rate = entry.weight * math.exp(-self.decay * (now - self.landmark))
+        return TreeSummary(
+            id=entry.id,
+            users=entry.users,
+            push_rate=rate * self.decay * 60,
+            last_active=datetime.fromtimestamp(entry.last_active),
+        )
+
+    def _entry(self, tree_id: str) -> DirectoryEntry:
+        if (entry := self.entries.get(tree_id)) is None:
+            entry = self.entries[tree_id] = DirectoryEntry(tree_id, self.clock())
+            insort(self.ids, tree_id)
+        return entry
+
+    def _update(self, entry: DirectoryEntry, users: int = 0, pushes: int = 0):
+        now = self.clock()
+        if self.decay * (now - self.landmark) > 500:
+            self._rescale(now)
+        entry.users = max(entry.users + users, 0)
+        entry.weight += pushes * math.exp(self.decay * (now - self.landmark))
+        entry.last_active = now
+        self.version += 1
+        entry.version = self.version
+        heapq.heappush(self.heaps["trending"], (-entry.weight, entry.version, entry.id))
+        heapq.heappush(self.heaps["users"], (-entry.users, entry.version, entry.id))
+        if len(self.heaps["users"]) > 2 * len(self.entries) + 64:
+            self._rebuild()
+
+    def _rescale(self, now: float):
+        # Keep weights from overflowing, the ranking is unchanged.
+        factor = math.exp(-self.decay * (now - self.landmark))
+        for entry in self.entries.values():
+            entry.weight *= factor
+        self.landmark = now
+        self._rebuild()
+
+    def _rebuild(self):
+        """Drop invalidated heap entries."""
+        for by, key in (("trending", "weight"), ("users", "users")):
+            heap = [
+                (-getattr(entry, key), entry.version, entry.id)
+                for entry in self.entries.values()
+            ]
+            heapq.heapify(heap)
+            self.heaps[by] = heap
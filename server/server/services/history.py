@@ -0,0 +1,229 @@
+"""Object history."""
+from __future__ import annotations
+
+import sqlite3
+from asyncio import sleep, to_thread
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+
+from server.base import BaseModel
+from server.services.channel import (
+    EditCommentEvent,
+    EditEvent,
+    MoveObjectEvent,
+    Object,
+    Position,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_channel_seq ON objects (channel_id, seq);
+CREATE INDEX IF NOT EXISTS objects_channel_created_at
+    ON objects (channel_id, created_at);
+CREATE INDEX IF NOT EXISTS objects_channel_id ON objects (channel_id, id);
+CREATE TABLE IF NOT EXISTS edits (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    comment TEXT,
+    x INTEGER,
+    y INTEGER,
+    edited_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edits_channel_edited_at
+    ON edits (channel_id, edited_at);
+CREATE INDEX IF NOT EXISTS edits_channel_id ON edits (channel_id, id);
+"""
+COLUMNS = "seq, id, url, comment, created_at, x, y"
+
+Row = tuple[int, str, str, str, float, int, int]
+
+
+class HistoryPage(BaseModel):
+    objects: list[Object]
+    # Pass as `before` to get the next page.
+    next: int | None
+
+
+def to_object(row: Row) -> Object:
+    _, id, url, comment, created_at, x, y = row
+    return Object(
+        id=id,
+        url=url,
+        comment=comment,
+        created_at=datetime.fromtimestamp(created_at),
+        position=Position(x=x, y=y),
+    )
+
+
+class HistoryStore:
+    """Append-only log of objects pushed to channels and their edits, in SQLite.
+
+    Appends are buffered in memory and written in batches by `flush`, so
+    pushing never waits on disk. Flushes may run in threads, so the buffer
+    is swapped under its own lock, held only briefly by appends.
+    """
+
+    def __init__(self, path: str | Path = ":memory:"):
+        self.path = path
+        self.buffer: list[tuple[str, str, str, str, float, int, int]] = []
+        self.edit_buffer: list[
+            tuple[str, str, str, str | None, int | None, int | None, float]
+        ] = []
+        self.buffer_lock = Lock()
+        self.lock = Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def append(self, channel_id: str, obj: Object):
+        row = (
+            channel_id,
+            obj.id,
+            obj.url,
+            obj.comment,
+            obj.created_at.timestamp(),
+            obj.position.x,
+            obj.position.y,
+        )
+        with self.buffer_lock:
+            self.buffer.append(row)
+
+    def append_edit(self, channel_id: str, edit: EditEvent):
+        """Log merged edit, at the wall time of its stamp."""
+        comment = x = y = None
+        match edit:
+            case MoveObjectEvent(position=position):
+                x, y = position.x, position.y
+            case EditCommentEvent(comment=comment):
+                pass
+        row = (channel_id, edit.id, edit.type, comment, x, y, edit.stamp.wall / 1000)
+        with self.buffer_lock:
+            self.edit_buffer.append(row)
+
+    def flush(self):
+        with self.buffer_lock:
+            rows, self.buffer = self.buffer, []
+            edits, self.edit_buffer = self.edit_buffer, []
+        if not rows and not edits:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO objects (channel_id, id, url, comment, created_at, x, y)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.executemany(
+                "INSERT INTO edits (channel_id, id, type, comment, x, y, edited_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                edits,
+            )
+
+    async def run_flusher(self, interval: float = 1):
+        while True:
+            await sleep(interval)
+            await to_thread(self.flush)
+
+    async def run_compactor(self, retention: timedelta, interval: float = 86400):
+        """Drop history older than `retention` every `interval` seconds."""
+        while True:
+            await sleep(interval)
+            await to_thread(self.compact, datetime.now() - retention)
+
+    def _query(self, sql: str, params: tuple) -> list[Row]:
+        self.flush()
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def as_of(self, channel_id: str, at: datetime, limit: int) -> list[Object]:
+        """Objects of the tree at the time, oldest first, with edits until then.
+
+        Channels keep the last `limit` objects, so those are what was shown.
+        """
+        timestamp = at.timestamp()
+        rows = self._query(
+            f"SELECT {COLUMNS} FROM objects"
+            " WHERE channel_id = ? AND created_at <= ? AND NOT EXISTS ("
+            "  SELECT 1 FROM edits WHERE edits.channel_id = objects.channel_id"
+            "  AND edits.id = objects.id AND type = 'delete-object'"
+            "  AND edited_at <= ?"
+            " ) ORDER BY created_at DESC, seq DESC LIMIT ?",
+            (channel_id, timestamp, timestamp, limit),
+        )
+        objects = [to_object(row) for row in reversed(rows)]
+        by_id = {obj.id: obj for obj in objects}
+        edits = self._query(
+            "SELECT id, type, comment, x, y FROM edits"
+            " WHERE channel_id = ? AND edited_at <= ? AND type != 'delete-object'"
+            " ORDER BY seq",
+            (channel_id, timestamp),
+        )
+        # Only merged edits are logged, so the last one of a field wins.
+        for id, type, comment, x, y in edits:
+            if (obj := by_id.get(id)) is None:
+                continue
+            if type == "move-object":
+                obj.position = Position(x=x, y=y)
+            else:
+                obj.comment = comment
+        return objects
+
+    def page(
+        self, channel_id: str, before: int | None = None, limit: int = 50
+    ) -> HistoryPage:
+        """Page through history, newest first."""
+        rows = self._query(
+            f"SELECT {COLUMNS} FROM objects"
+            " WHERE channel_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?",
+            (channel_id, before if before is not None else 2**63 - 1, limit),
+        )
+        return HistoryPage(
+            objects=[to_object(row) for row in rows],
+            next=rows[-1][0] if len(rows) == limit else None,
+        )
+
+    def iter_history(self, channel_id: str, batch: int = 100) -> Iterator[Object]:
+        """Stream whole history, oldest first, without loading it at once."""
+        after = 0
+        while True:
+            rows = self._query(
+                f"SELECT {COLUMNS} FROM objects"
+                " WHERE channel_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (channel_id, after, batch),
+            )
+            yield from map(to_object, rows)
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    def compact(self, before: datetime):
+        """Drop history older than the time and reclaim disk space."""
+        self.flush()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM objects WHERE created_at < ?", (before.timestamp(),)
+                )
+                self.conn.execute(
+                    "DELETE FROM edits WHERE NOT EXISTS ("
+                    " SELECT 1 FROM objects WHERE objects.channel_id = edits.channel_id"
+                    " AND objects.id = edits.id"
+                    ")"
+                )
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        self.flush()
+        self.conn.close()
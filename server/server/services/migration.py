@@ -0,0 +1,234 @@
+"""Live channel migration between workers."""
+from __future__ import annotations
+
+import json
+from asyncio import (
+    Server,
+    StreamReader,
+    StreamWriter,
+    gather,
+    open_unix_connection,
+    start_unix_server,
+)
+from pathlib import Path
+
+from server.base import BaseModel, Field
+from server.services.channel import (
+    Channel,
+    ChannelController,
+    ChannelGroup,
+    ChannelPolicy,
+    Object,
+    UserInfo,
+)
+from server.services.clock import Stamp
+
+# Channels are sent one per line, and may be large.
+LINE_LIMIT = 2**24
+
+
+class HandoffError(Exception):
+    """The next worker didn't receive every channel handed over."""
+
+
+class ChannelState(BaseModel):
+    """Channel as handed over to the next worker."""
+
+    id: str
+    group: str | None = None
+    # Snapshot version, so resuming clients up to date skip the snapshot
+    version: int
+    policy: ChannelPolicy
+    objects: list[Object] = Field(default_factory=list)
+    tombstones: dict[str, Stamp] = Field(default_factory=dict)
+    # Users by resume token
+    users: dict[str, UserInfo] = Field(default_factory=dict)
+
+    @classmethod
+    def dump(cls, channel: Channel) -> ChannelState:
+        return cls.construct(
+            id=channel.id,
+            group=channel.group.id if channel.group else None,
+            version=channel.version,
+            policy=channel.policy,
+            objects=list(channel.objects.values()),
+            tombstones=dict(channel.tombstones),
+            users={
+                **{user.resume_token: user.info() for user in channel.users.values()},
+                **channel.resuming,
+            },
+        )
+
+    def encode(self) -> dict:
+        return {
+            "id": self.id,
+            "group": self.group,
+            "version": self.version,
+            "policy": self.policy.dict(),
+            "objects": [
+                {
+                    **obj.encode(),
+                    "stamps": {k: v.encode() for k, v in obj.stamps.items()},
+                }
+                for obj in self.objects
+            ],
+            "tombstones": {k: v.encode() for k, v in self.tombstones.items()},
+            "users": {token: user.encode() for token, user in self.users.items()},
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> ChannelState:
+        objects = []
+        for item in data["objects"]:
+            obj = Object.decode(item)
+            obj.stamps = {k: Stamp.decode(v) for k, v in item["stamps"].items()}
+            objects.append(obj)
+        return cls.construct(
+            id=data["id"],
+            group=data["group"],
+            version=data["version"],
+            policy=ChannelPolicy(**data["policy"]),
+            objects=objects,
+            tombstones={k: Stamp.decode(v) for k, v in data["tombstones"].items()},
+            users={
+                token: UserInfo.decode(user) for token, user in data["users"].items()
+            },
+        )
+
+    def restore(self, controller: ChannelController, resume_timeout: float) -> Channel:
+        """Open the channel, holding seats of its users until `resume_timeout`.
+
+        If a channel with the same id was opened here meanwhile, the state is
+        merged into it instead.
+        """
+        channel = controller.get_channel(self.id)
+        if channel is None:
+            channel = controller.create_channel(self.id, self.policy)
+            if self.group is not None:
+                group = controller.groups.get(self.group)
+                if group is None:
+                    group = controller.groups[self.group] = ChannelGroup(id=self.group)
+                group.add(channel)
+                _, _, index = self.id.partition("#")
+                if index.isdigit():
+                    group.next_index = max(group.next_index, int(index) + 1)
+
+        objects, tombstones = channel.objects, channel.tombstones
+        # Pushed or deleted objects here meanwhile
+        opened = bool(objects or tombstones)
+        current = list(objects.values()), dict(tombstones)
+        for key, stamp in self.tombstones.items():
+            if key not in tombstones or tombstones[key] < stamp:
+                tombstones[key] = stamp
+        # Objects pushed here are the newest, so they are evicted last.
+        merged = {obj.id: obj for obj in self.objects}
+        merged.update(objects)
+        kept = [obj for key, obj in merged.items() if key not in tombstones]
+        objects.clear()
+        objects.update((obj.id, obj) for obj in kept[-channel.policy.max_objects :])
+        if not opened:
+            channel.snapshot.invalidate()
+            channel.snapshot.version = self.version
+        elif current != (list(objects.values()), tombstones):
+            # Clients handed over must not skip the merged snapshot.
+            channel.snapshot.invalidate()
+            channel.snapshot.version = max(channel.version, self.version + 1)
+
+        channel.resuming.update(self.users)
+        controller.tasks.spawn(
+            channel.expire_resuming(resume_timeout),
+            name="resume",
+            owner=channel.id,
+            key="resume",
+            replace=True,
+        )
+        return channel
+
+
+async def hand_off(controller: ChannelController, path: str | Path) -> int:
+    """Send every channel to the worker serving handoff at `path`.
+
+    The next worker restores channels only once this one commits, after it
+    received all of them. Returns the number of channels handed over, and
+    raises `HandoffError` if the next worker didn't receive all of them.
+    """
+    reader, writer = await open_unix_connection(path, limit=LINE_LIMIT)
+    # Dumped without awaiting in between, so channels are consistent.
+    states = [ChannelState.dump(c) for c in controller.channels.values()]
+    header = {"clock": controller.clock.now().encode(), "channels": len(states)}
+    try:
+        writer.write(json.dumps(header).encode())
+        writer.write(b"\n")
+        for state in states:
+            writer.write(json.dumps(state.encode(), ensure_ascii=False).encode())
+            writer.write(b"\n")
+        await writer.drain()
+        received = int(await reader.readline() or 0)
+        if received != len(states):
+            raise HandoffError(f"{received} of {len(states)} channels received")
+        writer.write(b"commit\n")
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return received
+
+
+async def serve_handoff(
+    controller: ChannelController, path: str | Path, resume_timeout: float = 30
+) -> Server:
+    """Accept channels handed over by the previous worker at unix socket `path`.
+
+    Nothing is restored unless the previous worker commits, so it never
+    keeps serving channels restored here.
+    """
+
+    async def receive(reader: StreamReader, writer: StreamWriter):
+        try:
+            header = json.loads(await reader.readline())
+            states = []
+            for _ in range(header["channels"]):
+                if not (line := await reader.readline()):
+                    # Cut off midway.
+                    return
+                states.append(ChannelState.decode(json.loads(line)))
+            writer.write(f"{len(states)}\n".encode())
+            await writer.drain()
+            if await reader.readline() != b"commit\n":
+                return
+            # Stamps of this worker must follow the previous one's.
+            controller.clock.update(Stamp.decode(header["clock"]))
+            for state in states:
+                state.restore(controller, resume_timeout)
+        finally:
+            writer.close()
+
+    Path(path).unlink(missing_ok=True)
+    return await start_unix_server(receive, path, limit=LINE_LIMIT)
+
+
+async def drain(controller: ChannelController, path: str | Path) -> int:
+    """Hand channels over to the next worker and disconnect their users.
+
+    Pushes are refused from here on. Clients reconnect to the next worker
+    with `resume` to take their seats back. If the handoff fails, this
+    worker keeps serving.
+    """
+    controller.draining = True
+    try:
+        restored = await hand_off(controller, path)
+    except (OSError, ValueError, HandoffError):
+        # No next worker is listening or it didn't take every channel.
+        controller.draining = False
+        raise
+    users = []
+    for channel in list(controller.channels.values()):
+        users.extend(channel.users.values())
+        users.extend(channel.waiting.values())
+        # Leaving now must not publish leave events.
+        channel.users.clear()
+        channel.waiting.clear()
+        channel.resuming.clear()
+        channel.close()
+    await gather(*(user.connection.close() for user in users), return_exceptions=True)
+    return restored
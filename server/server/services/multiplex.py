@@ -0,0 +1,195 @@
+"""Many channel subscriptions over one connection."""
+from __future__ import annotations
+
+import json
+from asyncio import Future, Queue
+from collections import deque
+from typing import Annotated, Literal
+
+from pydantic import ValidationError
+
+from server.base import BaseModel, Field
+from server.services.channel import Channel, ChannelController, dumps_snapshot
+
+
+class Subscription:
+    """Subscription to a channel's broadcast with credit based flow control.
+
+    Every message costs a credit, which clients grant by acking. Messages
+    beyond credit are buffered up to `max_pending`, past that they are
+    dropped and the client gets a fresh snapshot once credit is back.
+
+    Messages arrive through callbacks on the broadcast future chain, so a
+    subscription costs no task.
+    """
+
+    def __init__(
+        self,
+        mux: Multiplexer,
+        id: int,
+        channel: Channel,
+        window: int,
+        max_pending: int,
+    ):
+        self.mux = mux
+        self.id = id
+        self.channel = channel
+        self.credit = window
+        self.max_pending = max_pending
+        self.pending: deque[str] = deque()
+        self.seq = 0
+        self.stale = True
+        self._next: Future | None = None
+
+    def start(self):
+        self._wait(self.channel.broadcast.subscribe())
+        # The first message is the snapshot.
+        self.flush()
+
+    def stop(self):
+        if self._next is not None:
+            self._next.remove_done_callback(self._on_message)
+            self._next = None
+            self.channel.unsubscribe()
+
+    def ack(self, credit: int):
+        self.credit += credit
+        self.flush()
+
+    def flush(self):
+        if self.stale and self.credit > 0:
+            self.stale = False
+            self.pending.clear()
+            self._send(self.channel.view(dumps_snapshot))
+        while self.pending and self.credit > 0:
+            self._send(self.pending.popleft())
+
+    def _wait(self, next_: Future):
+        self._next = next_
+        next_.add_done_callback(self._on_message)
+
+    def _on_message(self, future: Future):
+        message, next_ = future.result()
+        if message is None:
+            # Channel closed, client may subscribe again.
+            self._next = None
+            self.mux.closed(self)
+            return
+        self._wait(next_)
+        if self.stale:
+            return
+        if self.credit > 0 and not self.pending:
+            self._send(message)
+        elif len(self.pending) < self.max_pending:
+            self.pending.append(message)
+        else:
+            self.pending.clear()
+            self.stale = True
+
+    def _send(self, message: str):
+        self.credit -= 1
+        self.seq += 1
+        # Messages are encoded by channel already, only the frame is added.
+        self.mux.outbox.put_nowait(f"[{self.id},{self.seq},{message}]")
+
+
+class SubscribeMessage(BaseModel):
+    op: Literal["subscribe"]
+    channel: str
+    window: int | None = Field(None, ge=1)
+
+
+class AckMessage(BaseModel):
+    op: Literal["ack"]
+    sub: int
+    credit: int = Field(ge=1)
+
+
+class UnsubscribeMessage(BaseModel):
+    op: Literal["unsubscribe"]
+    sub: int
+
+
+class ControlMessage(BaseModel):
+    __root__: Annotated[
+        SubscribeMessage | AckMessage | UnsubscribeMessage,
+        Field(discriminator="op"),
+    ]
+
+
+class Multiplexer:
+    """Channel subscriptions of one connection.
+
+    Clients send JSON control messages:
+
+    - `{"op": "subscribe", "channel": "/tree", "window": 32}`
+    - `{"op": "ack", "sub": 1, "credit": 32}`
+    - `{"op": "unsubscribe", "sub": 1}`
+
+    Channel messages are framed as `[sub, seq, message]`, and control
+    replies are objects with `op`. Everything to send is put to `outbox`.
+    """
+
+    def __init__(
+        self,
+        controller: ChannelController,
+        max_subscriptions: int = 32,
+        window: int = 32,
+        max_pending: int = 64,
+    ):
+        self.controller = controller
+        self.max_subscriptions = max_subscriptions
+        self.window = window
+        self.max_pending = max_pending
+        self.subscriptions: dict[int, Subscription] = {}
+        self.next_id = 1
+        self.outbox: Queue[str] = Queue()
+
+    def handle(self, data: dict):
+        try:
+            message = ControlMessage.parse_obj(data).__root__
+        except ValidationError:
+            self.reply(op="error", code="invalid", message="invalid")
+            return
+        match message:
+            case SubscribeMessage(channel=channel_id, window=window):
+                self.subscribe(channel_id, window or self.window)
+            case AckMessage(sub=sub, credit=credit):
+                if (subscription := self.subscriptions.get(sub)) is not None:
+                    subscription.ack(credit)
+            case UnsubscribeMessage(sub=sub):
+                self.unsubscribe(sub)
+
+    def subscribe(self, channel_id: str, window: int) -> Subscription | None:
+        if len(self.subscriptions) >= self.max_subscriptions:
+            self.reply(op="error", code="full", message="Too many subscriptions")
+            return None
+        subscription = Subscription(
+            self,
+            self.next_id,
+            self.controller.assign_channel(channel_id),
+            max(window, 1),
+            self.max_pending,
+        )
+        self.next_id += 1
+        self.subscriptions[subscription.id] = subscription
+        self.reply(op="subscribed", sub=subscription.id, channel=channel_id)
+        subscription.start()
+        return subscription
+
+    def unsubscribe(self, sub: int):
+        if (subscription := self.subscriptions.pop(sub, None)) is not None:
+            subscription.stop()
+            self.reply(op="unsubscribed", sub=sub)
+
+    def closed(self, subscription: Subscription):
+        self.subscriptions.pop(subscription.id, None)
+        self.reply(op="unsubscribed", sub=subscription.id)
+
+    def close(self):
+        for subscription in self.subscriptions.values():
+            subscription.stop()
+        self.subscriptions.clear()
+
+    def reply(self, **data):
+        self.outbox.put_nowait(json.dumps(data, ensure_ascii=False))
@@ -0,0 +1,105 @@
+"""Channel policy."""
+from __future__ import annotations
+
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Any
+
+import tomllib
+from pydantic import Extra
+
+from server.base import BaseModel, Field
+
+
+class ChannelPolicy(BaseModel):
+    max_objects: int = 30
+    # Objects in one push, larger batches are refused
+    max_batch: int = 30
+    max_ccu: int = 10
+    timeout: float | int = 1
+    cooltime: int = 10
+    # Deadline of a whole operation, lock wait and fan-out included
+    budget: float = 2
+    send_timeout: float = 0.5
+    # Admission control
+    max_pending: int = 50
+    max_lock_wait: float = 0.5
+    waiting_room: int = 0
+    # Overflow
+    overflow: bool = False
+    max_subchannels: int = 100
+    # Cursor frames per second, 0 disables presence
+    presence_rate: float = 10
+
+    class Config:
+        # Typos in the policy file fail reload instead of being ignored.
+        extra = Extra.forbid
+
+
+class PolicyOverride(BaseModel):
+    """Policy values for channel ids matching the glob pattern."""
+
+    pattern: str
+    values: dict[str, Any] = Field(default_factory=dict)
+
+
+class PolicyRegistry(BaseModel):
+    """Default policy and per-channel-id-pattern overrides.
+
+    Overrides are applied in order, so later patterns win.
+    """
+
+    default: ChannelPolicy = Field(default_factory=ChannelPolicy)
+    overrides: list[PolicyOverride] = Field(default_factory=list)
+    path: Path | None = None
+    mtime: int | None = None
+
+    @classmethod
+    def from_file(cls, path: str | Path) -> PolicyRegistry:
+        registry = cls(path=path)
+        registry.reload()
+        return registry
+
+    def get(self, channel_id: str) -> ChannelPolicy:
+        values = self.default.dict()
+        for override in self.overrides:
+            if fnmatchcase(channel_id, override.pattern):
+                values.update(override.values)
+        return ChannelPolicy(**values)
+
+    def reload(self) -> bool:
+        """Reload the policy file if it was modified.
+
+        Raises on broken file without touching current policies.
+        Returns whether policies were reloaded.
+        """
+        if self.path is None:
+            return False
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+
+        with self.path.open("rb") as f:
+            data = tomllib.load(f)
+        default = ChannelPolicy.parse_obj(data.get("default", {}))
+        overrides = []
+        for override in data.get("overrides", []):
+            if not isinstance(override, dict):
+                raise ValueError("Override must be a table")
+            overrides.append(
+                PolicyOverride.parse_obj(
+                    {
+                        "pattern": override.get("pattern"),
+                        "values": {k: v for k, v in override.items() if k != "pattern"},
+                    }
+                )
+            )
+        for override in overrides:
+            # Validate before applying anything.
+            ChannelPolicy(**{**default.dict(), **override.values})
+
+        self.default, self.overrides, self.mtime = default, overrides, mtime
+        return True
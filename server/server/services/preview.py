@@ -0,0 +1,148 @@
+"""Tree preview images."""
+from __future__ import annotations
+
+import base64
+import hashlib
+from asyncio import get_running_loop, sleep
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from server.base import BaseModel
+from server.services.atlas import MEDIA_TYPES
+from server.services.catalog import Deco, DecoCatalog
+
+if TYPE_CHECKING:
+    from server.services.channel import Channel, ChannelController, Object
+
+
+class Preview(BaseModel):
+    svg: bytes
+    etag: str
+    version: int
+
+
+class PreviewRenderer:
+    """Composites tree and its decorations into one SVG, cached per tree.
+
+    Pushes mark the preview stale and re-render it after `delay`, so a burst
+    of pushes costs one render. Rendering runs in a worker pool.
+
+    SVG is shown by browsers, e.g. in tree lists, but not by most link
+    unfurlers, so these aren't meant as `og:image`.
+    """
+
+    def __init__(
+        self,
+        tree: str | Path,
+        catalog: DecoCatalog,
+        decos_root: str | Path,
+        width: int = 400,
+        height: int = 800,
+        sprite_height: int = 50,
+        delay: float = 2,
+        workers: int = 2,
+        cache_size: int = 256,
+    ):
+        self.tree = self.data_uri(Path(tree))
+        self.decos: dict[str, Deco] = {d.url: d for d in catalog.decos.values()}
+        self.decos_root = Path(decos_root)
+        self.width, self.height = width, height
+        self.sprite_height = sprite_height
+        self.delay = delay
+        self.cache_size = cache_size
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="preview")
+        self.previews: OrderedDict[str, Preview] = OrderedDict()
+        self.versions: dict[str, int] = {}
+        self.sprites: dict[str, str | None] = {}
+
+    @staticmethod
+    def data_uri(path: Path) -> str | None:
+        media_type = MEDIA_TYPES.get(path.suffix.lower())
+        if media_type is None or not path.exists():
+            return None
+        data = base64.b64encode(path.read_bytes()).decode()
+        return f"data:{media_type};base64,{data}"
+
+    def sprite(self, url: str) -> str | None:
+        if url not in self.sprites:
+            deco = self.decos.get(url)
+            path = self.decos_root / Path(url).name
+            self.sprites[url] = self.data_uri(path) if deco else None
+        return self.sprites[url]
+
+    def compose(self, objects: Sequence[Object]) -> bytes:
+        """Tree with decorations, each distinct image embedded once."""
+        defs: dict[str, int] = {}
+        images = []
+        uses = []
+        for obj in objects:
+            if (uri := self.sprite(obj.url)) is None:
+                # Uploaded images aren't embedded.
+                continue
+            if obj.url not in defs:
+                deco = self.decos[obj.url]
+                ratio = deco.width / deco.height if deco.width and deco.height else 1
+                defs[obj.url] = len(defs)
+                images.append(
+                    f'<image id="d{defs[obj.url]}"'
+                    f' width="{round(self.sprite_height * ratio)}"'
+                    f' height="{self.sprite_height}" href="{uri}"/>'
+                )
+            uses.append(
+                f'<use href="#d{defs[obj.url]}"'
+                f' x="{obj.position.x}" y="{obj.position.y}"/>'
+            )
+        svg = (
+            '<svg xmlns="http://www.w3.org/2000/svg"'
+            f' width="{self.width}" height="{self.height}">'
+            f'<defs>{"".join(images)}</defs>'
+            f'<image width="{self.width}" height="{self.height}" href="{self.tree}"/>'
+            f'{"".join(uses)}</svg>'
+        )
+        return svg.encode()
+
+    def invalidate(self, channel: Channel):
+        """Mark the preview of the channel's tree stale and re-render later."""
+        tree_id = channel.tree_id
+        self.versions[tree_id] = self.versions.get(tree_id, 0) + 1
+        if tree_id in self.previews:
+            # Only re-render previews someone asked for.
+            channel.channel_controller.tasks.spawn(
+                self.refresh(tree_id, channel.channel_controller),
+                name="preview",
+                owner="previews",
+                key=tree_id,
+            )
+
+    async def refresh(self, tree_id: str, controller: ChannelController):
+        await sleep(self.delay)
+        await self.render(tree_id, controller)
+
+    async def render(self, tree_id: str, controller: ChannelController) -> Preview:
+        """Current preview of the tree, rendered if stale."""
+        version = self.versions.get(tree_id, 0)
+        preview = self.previews.get(tree_id)
+        if preview is not None and preview.version == version:
+            self.previews.move_to_end(tree_id)
+            return preview
+
+        loop = get_running_loop()
+        objects = controller.tree_objects(tree_id)
+        if objects is None and controller.history is not None:
+            limit = controller.get_policy(tree_id).max_objects
+            objects = await loop.run_in_executor(
+                self.pool, controller.history.as_of, tree_id, datetime.now(), limit
+            )
+        svg = await loop.run_in_executor(self.pool, self.compose, objects or ())
+        preview = Preview(
+            svg=svg, etag=hashlib.sha256(svg).hexdigest()[:16], version=version
+        )
+        self.previews[tree_id] = preview
+        self.previews.move_to_end(tree_id)
+        while len(self.previews) > self.cache_size:
+            self.previews.popitem(last=False)
+        return preview
@@ -0,0 +1,224 @@
+"""Trace record and deterministic replay of channel commands."""
+from __future__ import annotations
+
+import json
+import selectors
+import time
+from asyncio import Runner, SelectorEventLoop, TaskGroup, get_running_loop, sleep
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Literal
+
+from server.base import BaseModel, Field
+from server.services.channel import (
+    BaseUserConnection,
+    Channel,
+    ChannelController,
+    EditEvent,
+    Event,
+    Object,
+    User,
+    UserInfo,
+)
+from server.services.codec import decode_event
+
+Op = Literal[
+    "join",
+    "push-object",
+    "push-objects",
+    "move-object",
+    "edit-comment",
+    "delete-object",
+    "leave",
+]
+
+
+class Command(BaseModel):
+    """Command applied to a channel, `at` seconds after the trace started."""
+
+    at: float
+    op: Op
+    channel_id: str
+    user: UserInfo
+    objects: list[Object] = Field(default_factory=list)
+    edit: EditEvent | None = None
+
+    def encode(self) -> dict:
+        return {
+            "at": self.at,
+            "op": self.op,
+            "channel_id": self.channel_id,
+            "user": self.user.encode(),
+            "objects": [obj.encode() for obj in self.objects],
+            "edit": self.edit.encode() if self.edit else None,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> Command:
+        return cls.construct(
+            at=data["at"],
+            op=data["op"],
+            channel_id=data["channel_id"],
+            user=UserInfo.decode(data["user"]),
+            objects=[Object.decode(obj) for obj in data["objects"]],
+            # Missing in traces recorded before edits
+            edit=decode_event(data["edit"]) if data.get("edit") else None,
+        )
+
+
+class TraceRecorder:
+    """Appends commands applied to channels to a JSON lines trace file."""
+
+    def __init__(self, path: str | Path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.started: float | None = None
+
+    def record(
+        self,
+        op: Op,
+        channel: Channel,
+        user: User,
+        objects: Iterable[Object] = (),
+        edit: EditEvent | None = None,
+    ):
+        now = get_running_loop().time()
+        if self.started is None:
+            self.started = now
+        command = Command.construct(
+            at=now - self.started,
+            op=op,
+            channel_id=channel.tree_id,
+            user=user.info(),
+            objects=list(objects),
+            edit=edit,
+        )
+        self.file.write(json.dumps(command.encode(), ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path: str | Path) -> Iterator[Command]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield Command.decode(json.loads(line))
+
+
+class VirtualSelector(selectors.BaseSelector):
+    """Selector which never waits, but moves the loop's clock instead."""
+
+    def __init__(self, loop: VirtualClockLoop):
+        self.loop = loop
+        self.keys: dict[int, selectors.SelectorKey] = {}
+
+    def register(self, fileobj, events, data=None) -> selectors.SelectorKey:
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = self.keys[fd] = selectors.SelectorKey(fileobj, fd, events, data)
+        return key
+
+    def unregister(self, fileobj) -> selectors.SelectorKey:
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return self.keys.pop(fd)
+
+    def select(self, timeout: float | None = None) -> list:
+        if timeout is None:
+            raise RuntimeError("Nothing is scheduled, replay would wait forever.")
+        self.loop.now += timeout
+        return []
+
+    def get_map(self) -> dict[int, selectors.SelectorKey]:
+        return self.keys
+
+
+class VirtualClockLoop(SelectorEventLoop):
+    """Event loop on a virtual clock, running timers in order at full speed.
+
+    There is no IO, so scheduling depends only on the order of calls.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        super().__init__(VirtualSelector(self))
+
+    def time(self) -> float:
+        return self.now
+
+
+class OpStats(BaseModel):
+    count: int = 0
+    # Virtual seconds spent in operations
+    latency: float = 0
+
+
+class ReplayStats(BaseModel):
+    ops: dict[str, OpStats] = Field(default_factory=dict)
+    received: int = 0
+    virtual_time: float = 0
+    wall_time: float = 0
+
+
+class ReplayConnection(BaseUserConnection):
+    def __init__(self, stats: ReplayStats):
+        self.stats = stats
+
+    async def send(self, data: Event):
+        self.stats.received += 1
+
+
+async def replay(
+    commands: Iterable[Command], controller: ChannelController, stats: ReplayStats
+):
+    """Apply commands at their recorded times, concurrently like live users."""
+    loop = get_running_loop()
+    started = loop.time()
+    members: dict[str, tuple[Channel, User]] = {}
+
+    async def apply(command: Command):
+        applied = loop.time()
+        match command.op:
+            case "join":
+                channel = controller.assign_channel(command.channel_id)
+                user = User(
+                    id=command.user.id,
+                    nickname=command.user.nickname,
+                    connection=ReplayConnection(stats),
+                )
+                members[user.id] = channel, user
+                await channel.join(user)
+            case "push-object" if command.user.id in members:
+                channel, user = members[command.user.id]
+                await channel.push_object(command.objects[0], user)
+            case "push-objects" if command.user.id in members:
+                channel, user = members[command.user.id]
+                await channel.push_objects(command.objects, user)
+            case "move-object" | "edit-comment" | "delete-object" if (
+                command.user.id in members
+            ):
+                channel, user = members[command.user.id]
+                # Stamped again, like edits from clients.
+                edit = command.edit.copy(update={"stamp": None})
+                await channel.edit_object(edit, user)
+            case "leave" if command.user.id in members:
+                channel, user = members.pop(command.user.id)
+                await channel.leave(user)
+        op = stats.ops.setdefault(command.op, OpStats())
+        op.count += 1
+        op.latency += loop.time() - applied
+
+    async with TaskGroup() as tg:
+        for command in commands:
+            await sleep(max(started + command.at - loop.time(), 0))
+            tg.create_task(apply(command))
+    stats.virtual_time = loop.time() - started
+
+
+def run_replay(
+    commands: Iterable[Command], controller: ChannelController | None = None
+) -> ReplayStats:
+    """Replay commands on a virtual clock, as fast as possible."""
+    stats = ReplayStats()
+    started = time.perf_counter()
+    with Runner(loop_factory=VirtualClockLoop) as runner:
+        runner.run(replay(commands, controller or ChannelController(), stats))
+    stats.wall_time = time.perf_counter() - started
+    return stats
@@ -0,0 +1,157 @@
+"""Background task supervisor."""
+from __future__ import annotations
+
+from asyncio import CancelledError, Semaphore, Task, current_task, get_running_loop
+from collections.abc import Coroutine
+from typing import Any
+
+from server.base import BaseModel
+
+
+class TaskInfo(BaseModel):
+    name: str
+    owner: str | None
+    key: str | None
+    created: float
+    coro: Coroutine | None = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+class TaskStats(BaseModel):
+    """Counts and durations of tasks with the same name."""
+
+    running: int = 0
+    finished: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    total_duration: float = 0
+    max_duration: float = 0
+
+    @property
+    def mean_duration(self) -> float:
+        done = self.finished + self.failed + self.cancelled
+        return self.total_duration / done if done else 0
+
+
+class TaskSupervisor:
+    """Names, tracks and limits background tasks.
+
+    Tasks may belong to an owner, e.g. a session or a channel, to cancel
+    them together when the owner goes away. A task with a key is unique
+    for its owner.
+
+    Concurrency is limited per task name, so a burst of one kind of task
+    doesn't hold back the others.
+    """
+
+    def __init__(self, limit: int = 256):
+        self.limit = limit
+        self.tasks: dict[Task, TaskInfo] = {}
+        self.keys: dict[tuple[str | None, str], Task] = {}
+        self.stats: dict[str, TaskStats] = {}
+        self._semaphores: dict[str, Semaphore] = {}
+
+    @property
+    def running(self) -> int:
+        return len(self.tasks)
+
+    def spawn(
+        self,
+        coro: Coroutine,
+        name: str,
+        owner: str | None = None,
+        key: str | None = None,
+        replace: bool = False,
+    ) -> Task:
+        """Run coroutine in background, at most `limit` of the name at once.
+
+        If a task with the key is running for the owner, it is cancelled
+        when `replace`, or returned instead of running the coroutine.
+        """
+        if key is not None and (running := self.keys.get((owner, key))):
+            if not replace:
+                coro.close()
+                return running
+            running.cancel()
+        if (semaphore := self._semaphores.get(name)) is None:
+            semaphore = self._semaphores[name] = Semaphore(self.limit)
+        task = get_running_loop().create_task(self._run(coro, semaphore), name=name)
+        self._track(task, name, owner, key, coro)
+        return task
+
+    def adopt(self, name: str, owner: str | None = None) -> Task:
+        """Track current task, e.g. a handler run by the framework."""
+        task = current_task()
+        self._track(task, name, owner, None, None)
+        return task
+
+    def owned(self, owner: str) -> list[Task]:
+        return [task for task, info in self.tasks.items() if info.owner == owner]
+
+    def cancel_owner(self, owner: str) -> int:
+        """Cancel tasks of the owner, returns the number of cancelled tasks."""
+        tasks = [
+            task
+            for task in self.owned(owner)
+            if not task.done() and task is not current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    async def _run(self, coro: Coroutine, semaphore: Semaphore) -> Any:
+        async with semaphore:
+            return await coro
+
+    def _track(
+        self,
+        task: Task,
+        name: str,
+        owner: str | None,
+        key: str | None,
+        coro: Coroutine | None,
+    ):
+        self.tasks[task] = TaskInfo.construct(
+            name=name,
+            owner=owner,
+            key=key,
+            created=get_running_loop().time(),
+            coro=coro,
+        )
+        if key is not None:
+            self.keys[owner, key] = task
+        self.stats.setdefault(name, TaskStats()).running += 1
+        task.add_done_callback(self._done)
+
+    def _done(self, task: Task):
+        info = self.tasks.pop(task)
+        if info.coro is not None:
+            # Never started if cancelled while waiting for the limit.
+            info.coro.close()
+        if info.key is not None and self.keys.get((info.owner, info.key)) is task:
+            del self.keys[info.owner, info.key]
+
+        stats = self.stats[info.name]
+        stats.running -= 1
+        try:
+            exc = task.exception()
+        except CancelledError:
+            stats.cancelled += 1
+        else:
+            if exc is None:
+                stats.finished += 1
+            else:
+                stats.failed += 1
+                # Retrieved here, so report it like an unretrieved one.
+                task.get_loop().call_exception_handler(
+                    {
+                        "message": f"Background task {info.name!r} failed",
+                        "exception": exc,
+                        "task": task,
+                    }
+                )
+        duration = task.get_loop().time() - info.created
+        stats.total_duration += duration
+        stats.max_duration = max(stats.max_duration, duration)
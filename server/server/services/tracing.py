@@ -0,0 +1,149 @@
+"""Sampled tracing of events through channels."""
+from __future__ import annotations
+
+import json
+import os
+import random
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from server.base import BaseModel, Field
+
+
+class Span(BaseModel):
+    """Timed stage of an event, times are nanoseconds since epoch."""
+
+    trace_id: str
+    span_id: str
+    name: str
+    start: int
+    end: int
+    attributes: dict[str, str | int | float] = Field(default_factory=dict)
+
+    def encode(self) -> dict:
+        """Span in OTLP JSON."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": key, "value": attribute_value(value)}
+                for key, value in self.attributes.items()
+            ],
+        }
+
+
+def attribute_value(value: str | int | float) -> dict:
+    match value:
+        case bool():
+            return {"boolValue": value}
+        case int():
+            # OTLP JSON encodes 64 bit integers as strings.
+            return {"intValue": str(value)}
+        case float():
+            return {"doubleValue": value}
+        case _:
+            return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Records spans of sampled events in a ring buffer.
+
+    `start` samples a new trace at `sample_rate`, and spans of unsampled
+    traces, with `None` trace id, cost nothing but the check. Only the last
+    `capacity` spans are kept, export them with `export` for analysis.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        capacity: int = 4096,
+        service: str = "ourtree",
+        clock: Callable[[], int] = time.time_ns,
+    ):
+        self.sample_rate = sample_rate
+        self.service = service
+        self.clock = clock
+        self.spans: deque[Span] = deque(maxlen=capacity)
+
+    def start(self) -> str | None:
+        """New trace id, or `None` if the trace isn't sampled."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return os.urandom(16).hex()
+
+    def add(
+        self,
+        trace_id: str | None,
+        name: str,
+        start: int,
+        end: int | None = None,
+        **attributes: str | int | float,
+    ):
+        if trace_id is None:
+            return
+        self.spans.append(
+            Span.construct(
+                trace_id=trace_id,
+                span_id=os.urandom(8).hex(),
+                name=name,
+                start=start,
+                end=self.clock() if end is None else end,
+                attributes=attributes,
+            )
+        )
+
+    @contextmanager
+    def span(
+        self, trace_id: str | None, name: str, **attributes: str | int | float
+    ) -> Iterator[None]:
+        if trace_id is None:
+            yield
+            return
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(trace_id, name, start, **attributes)
+
+    def trace(self, trace_id: str) -> list[Span]:
+        return sorted(
+            (span for span in self.spans if span.trace_id == trace_id),
+            key=lambda span: span.start,
+        )
+
+    def encode(self) -> dict:
+        """Buffered spans as OTLP JSON trace data."""
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": attribute_value(self.service),
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.encode() for span in self.spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, path: str | Path) -> int:
+        """Write buffered spans to an OTLP JSON file, returns span count."""
+        count = len(self.spans)
+        Path(path).write_text(json.dumps(self.encode()), encoding="utf-8")
+        return count
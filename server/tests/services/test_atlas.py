@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import base64
+import struct
+from pathlib import Path
+
+from server.services.atlas import SpriteAtlas
+from server.services.catalog import DecoCatalog
+
+
+def write_png(path: Path, width: int, height: int):
+    header = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR"
+    path.write_bytes(header + struct.pack(">II", width, height))
+
+
+def test_build_atlas(tmp_path: Path):
+    write_png(tmp_path / "bauble.png", 30, 40)
+    write_png(tmp_path / "bell.png", 80, 40)
+    write_png(tmp_path / "wreath.png", 40, 40)
+    catalog = DecoCatalog.load(tmp_path)
+
+    atlas = SpriteAtlas.build(catalog, tmp_path, sprite_height=100, max_width=300)
+
+    frames = atlas.frames
+    assert frames["/decos/bauble.png"].encode() == [0, 0, 75, 100]
+    assert frames["/decos/bell.png"].encode() == [75, 0, 200, 100]
+    # Doesn't fit in the first row.
+    assert frames["/decos/wreath.png"].encode() == [0, 100, 100, 100]
+    assert (atlas.width, atlas.height) == (275, 200)
+
+    data = base64.b64encode((tmp_path / "bell.png").read_bytes()).decode()
+    assert 'x="75" y="0" width="200" height="100"' in atlas.svg
+    assert f"data:image/png;base64,{data}" in atlas.svg
+    assert atlas.hash == SpriteAtlas.build(catalog, tmp_path, 100, 300).hash
+
+    encoded = atlas.encode("/atlas.svg")
+    assert encoded["url"] == "/atlas.svg"
+    assert encoded["frames"]["/decos/bauble.png"] == [0, 0, 75, 100]
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import struct
+from pathlib import Path
+
+import pytest
+
+from server.services.catalog import DecoCatalog
+
+
+@pytest.fixture
+def deco_dir(tmp_path: Path):
+    png = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR" + struct.pack(">II", 30, 40)
+    (tmp_path / "bauble.png").write_bytes(png)
+    (tmp_path / "christmas-bell.svg").write_text(
+        '<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"'
+        ' viewBox="0 0 95.34 126.59"></svg>'
+    )
+    (tmp_path / "readme.txt").write_text("not a deco")
+    return tmp_path
+
+
+def test_load_catalog(deco_dir: Path):
+    catalog = DecoCatalog.load(deco_dir)
+
+    assert list(catalog.decos.keys()) == ["bauble", "christmas-bell"]
+    bauble, bell = catalog.get("bauble"), catalog.get("christmas-bell")
+    assert bauble.url == "/decos/bauble.png"
+    assert (bauble.width, bauble.height) == (30, 40)
+    assert (bell.width, bell.height) == (95, 127)
+    assert bell.category == "bell"
+    assert len(bell.hash) == 16
+
+
+def test_page_catalog(deco_dir: Path):
+    catalog = DecoCatalog.load(deco_dir)
+
+    first, last = catalog.page(0, size=1), catalog.page(5, size=1)
+
+    assert first.pages == 2
+    assert [deco.id for deco in first.items] == ["bauble"]
+    assert last.page == 1
+    assert [deco.id for deco in last.items] == ["christmas-bell"]
+    assert catalog.page(0, category="bell").total == 1
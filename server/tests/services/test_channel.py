@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio as aio
 import gc
 
 import pytest
@@ -9,13 +10,20 @@ from server.services.channel import (
     Channel,
     ChannelController,
     ChannelPolicy,
+    DeleteObjectEvent,
+    EditCommentEvent,
     ErrorEvent,
     Event,
+    JoinEvent,
+    MoveObjectEvent,
     Object,
     Position,
     PushObjectEvent,
+    PushObjectsEvent,
     User,
+    WaitEvent,
 )
+from server.services.clock import HybridClock, Stamp
 
 
 @pytest.fixture
@@ -114,6 +122,38 @@ async def test_push_object_success(channel: Channel, user: User):
     assert ev.object.id == "obj"
 
 
+async def test_push_object_refuses_non_members_and_known_ids(
+    channel: Channel, user: User
+):
+    errors: list[Event] = []
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            errors.append(data)
+
+    channel.policy.max_objects = 3
+    member = User(id="2", nickname="two", session="ss", connection=TempConn())
+    channel.users[member.id] = member
+    await channel.push_object(
+        Object(id="obj", url="url", comment="hello", position=Position(x=1, y=1)),
+        member,
+    )
+
+    stranger = User(id="3", nickname="three", session="s3", connection=TempConn())
+    await channel.push_object(
+        Object(id="new", url="url", comment="hello", position=Position(x=1, y=1)),
+        stranger,
+    )
+    await channel.push_object(
+        Object(id="obj", url="EVIL", comment="hello", position=Position(x=1, y=1)),
+        member,
+    )
+
+    assert list(channel.objects) == ["obj"]
+    assert channel.objects["obj"].url == "url"
+    assert [error.code for error in errors] == ["invalid", "invalid"]
+
+
 async def test_push_object_success_when_full(channel: Channel, user: User):
     ev = None
     channel.users[user.id] = user
@@ -221,3 +261,472 @@ def test_close_channel(channel_controller: ChannelController):
 
     assert channel_controller.channels not in gc.get_referrers(channel)
     assert channel not in gc.get_referrers(channel_controller)
+
+
+async def test_join_channel_fail_when_full_without_lock(
+    channel: Channel, user: User, monkeypatch: pytest.MonkeyPatch
+):
+    error = None
+    channel.users[user.id] = user
+
+    async def fail():
+        raise TimeoutError
+
+    monkeypatch.setattr(channel.event_lock, "acquire", fail)
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            nonlocal error
+            error = data
+
+    await channel.join(
+        user=User(id="2", nickname="two", session="ss", connection=TempConn())
+    )
+
+    assert isinstance(error, ErrorEvent)
+    assert error.code == "full"
+    assert channel.reserved_seats == 0
+
+
+async def test_join_channel_fail_when_overloaded(channel: Channel, user: User):
+    error = None
+    channel.pending = channel.policy.max_pending
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            nonlocal error
+            error = data
+
+    await channel.join(
+        user=User(id="2", nickname="two", session="ss", connection=TempConn())
+    )
+
+    assert isinstance(error, ErrorEvent)
+    assert error.code == "overloaded"
+    assert "2" not in channel.users.keys()
+
+
+async def test_waiting_room_admits_on_leave(channel: Channel, user: User):
+    events: list[Event] = []
+    channel.policy.waiting_room = 1
+    await channel.join(user=user)
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    waiter = User(id="2", nickname="two", session="ss", connection=TempConn())
+    await channel.join(user=waiter)
+
+    assert isinstance(events[-1], WaitEvent)
+    assert events[-1].position == 1
+    assert waiter.id in channel.waiting.keys()
+
+    await channel.leave(user)
+
+    assert waiter.id in channel.users.keys()
+    assert len(channel.waiting) == 0
+    assert channel.id in channel.channel_controller.channels.keys()
+
+
+async def test_waiting_room_keeps_waiting_for_reserved_seat(
+    channel: Channel, user: User
+):
+    channel.policy.waiting_room = 2
+    await channel.join(user=user)
+
+    class BrokenConn(BaseUserConnection):
+        async def send(self, data: Event):
+            raise ConnectionResetError
+
+    class StuckConn(BaseUserConnection):
+        async def send(self, data: Event):
+            await aio.sleep(10)
+
+    waiter = User(id="2", nickname="two", connection=BrokenConn())
+    channel.waiting[waiter.id] = waiter
+    channel.waiting["3"] = User(id="3", nickname="three", connection=StuckConn())
+    channel.policy.send_timeout = 0.01
+    # A concurrent joiner holds the freed seat.
+    channel.reserved_seats = 1
+
+    await aio.wait_for(channel.leave(user), 1)
+
+    # Still first in line.
+    assert list(channel.waiting) == ["2", "3"]
+    assert not channel.users
+
+
+async def test_newcomer_does_not_take_seat_of_waiting_user(
+    channel: Channel, user: User
+):
+    channel.policy.waiting_room = 2
+    # Waiting while the seat was taken by a concurrent joiner.
+    channel.waiting[user.id] = user
+
+    newcomer = User(id="2", nickname="two", connection=BaseUserConnection())
+    await channel.join(user=newcomer)
+
+    assert list(channel.users) == ["1"]
+    assert list(channel.waiting) == ["2"]
+
+
+async def test_assign_channel_spills_over(channel_controller: ChannelController):
+    received: list[Event] = []
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            received.append(data)
+
+    first = channel_controller.assign_channel("tree")
+    first.policy = ChannelPolicy(max_ccu=1, overflow=True)
+    sender = User(id="1", nickname="one", session="ss", connection=TempConn())
+    await first.join(sender)
+
+    second = channel_controller.assign_channel("tree")
+    second.policy = first.policy
+    receiver = User(id="2", nickname="two", session="ss", connection=TempConn())
+    await second.join(receiver)
+
+    assert first is not second
+    assert second.group is first.group
+    assert channel_controller.groups["tree"].user_count == 2
+
+    await first.push_object(
+        Object(id="obj", url="url", comment="hello", position=Position(x=1, y=1)),
+        sender,
+    )
+
+    assert "obj" in second.objects.keys()
+    assert isinstance(received[-1], PushObjectEvent)
+
+
+def test_close_subchannel_removes_group(channel_controller: ChannelController):
+    channel = channel_controller.assign_channel("tree")
+
+    channel_controller.close_channel(channel.id)
+
+    assert "tree" not in channel_controller.groups.keys()
+    assert channel.group is None
+
+
+async def test_spectate_receives_pushes_only(channel: Channel, user: User):
+    channel.users[user.id] = user
+    stream = channel.spectate()
+
+    snapshot = await anext(stream)
+    await channel.join(
+        User(id="2", nickname="two", session="ss", connection=BaseUserConnection())
+    )
+    await channel.push_object(
+        Object(id="obj", url="url", comment="hello", position=Position(x=1, y=1)),
+        user,
+    )
+    message = await anext(stream)
+
+    assert Event.parse_raw(snapshot).__root__.type == "snapshot"
+    assert Event.parse_raw(message).__root__.type == "push-object"
+    assert channel.stats.spectators == 1
+    assert channel.stats.users == 1
+
+    await stream.aclose()
+
+    assert channel.stats.spectators == 0
+
+
+async def test_spectator_keeps_channel_open(
+    channel_controller: ChannelController, channel: Channel, user: User
+):
+    channel.users[user.id] = user
+    stream = channel.spectate()
+    await anext(stream)
+
+    await channel.leave(user)
+
+    assert channel.id in channel_controller.channels.keys()
+
+    await stream.aclose()
+
+    assert channel.id not in channel_controller.channels.keys()
+
+
+async def test_push_objects_evicts_in_one_pass(channel: Channel, user: User):
+    events: list[Event] = []
+    channel.policy.max_objects = 3
+    channel.users[user.id] = user
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    channel.users["2"] = User(
+        id="2", nickname="two", session="ss", connection=TempConn()
+    )
+    for n in range(2):
+        channel.objects[f"old{n}"] = Object(
+            id=f"old{n}", url="url", comment="hello", position=Position(x=1, y=1)
+        )
+
+    await channel.push_objects(
+        [
+            Object(id=f"new{n}", url="url", comment="hi", position=Position(x=n, y=n))
+            for n in range(2)
+        ],
+        user,
+    )
+
+    assert list(channel.objects.keys()) == ["old1", "new0", "new1"]
+    assert len(events) == 1
+    assert isinstance(events[0], PushObjectsEvent)
+    assert events[0].pops == ["old0"]
+    assert [obj.id for obj in events[0].objects] == ["new0", "new1"]
+
+
+async def test_push_objects_refuses_large_and_known_batches(
+    channel: Channel, user: User
+):
+    events: list[Event] = []
+    channel.policy.max_objects = 3
+    channel.policy.max_batch = 2
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    user.connection = TempConn()
+    channel.users[user.id] = user
+    channel.users["2"] = User(id="2", nickname="two", connection=TempConn())
+
+    def make(n: int) -> Object:
+        return Object(id=str(n), url="url", comment="hi", position=Position(x=n, y=n))
+
+    await channel.push_objects([make(n) for n in range(3)], user)
+    assert not channel.objects
+    assert events == [ErrorEvent(code="too-large", message="Too many objects")]
+
+    await channel.push_objects([make(0)], user)
+    version = channel.version
+    await channel.push_objects([make(0), make(0)], user)
+    # Nothing new, nothing published.
+    assert channel.version == version
+    assert len(events) == 2
+
+
+async def test_object_snapshot_shared_until_push(channel: Channel, user: User):
+    channel.policy.max_objects = 3
+    channel.users[user.id] = user
+    await channel.push_object(
+        Object(id="a", url="url", comment="hi", position=Position(x=1, y=1)), user
+    )
+
+    def build(objects):
+        return [obj.id for obj in objects]
+
+    version = channel.version
+    view = channel.view(build)
+    assert view == ["a"]
+    assert channel.view(build) is view
+    assert channel.object_list() is channel.object_list()
+
+    await channel.push_object(
+        Object(id="b", url="url", comment="hi", position=Position(x=1, y=1)), user
+    )
+
+    assert channel.version == version + 1
+    assert channel.view(build) == ["a", "b"]
+    assert view == ["a"]
+
+
+async def test_publish_detaches_failing_recipients(channel: Channel, user: User):
+    events: list[Event] = []
+    channel.policy.max_ccu = 3
+    channel.policy.send_timeout = 0.05
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    class BrokenConn(BaseUserConnection):
+        async def send(self, data: Event):
+            raise ConnectionResetError
+
+    class SlowConn(BaseUserConnection):
+        async def send(self, data: Event):
+            await aio.sleep(1)
+
+    channel.users["2"] = User(id="2", nickname="two", connection=TempConn())
+    channel.users["3"] = User(id="3", nickname="three", connection=BrokenConn())
+    channel.users["4"] = User(id="4", nickname="four", connection=SlowConn())
+
+    result = await channel._publish_event(JoinEvent.construct(user=user.info()), None)
+
+    assert result.sent == 1
+    assert sorted(result.failed) == ["3", "4"]
+    assert channel.stats.failed_sends == 2
+    await aio.gather(*channel.channel_controller.tasks.owned(channel.id))
+    assert list(channel.users) == ["2"]
+
+
+async def test_publish_drops_sends_out_of_budget(channel: Channel, user: User):
+    channel.policy.max_ccu = 2
+    channel.policy.budget = 0.05
+    channel.policy.send_timeout = 1
+
+    class SlowConn(BaseUserConnection):
+        async def send(self, data: Event):
+            await aio.sleep(1)
+
+    channel.users["2"] = User(id="2", nickname="two", connection=SlowConn())
+    channel.users[user.id] = user
+
+    result = await channel._publish_event(
+        JoinEvent.construct(user=user.info()), user.id
+    )
+
+    assert result.dropped == ["2"]
+    assert not channel.channel_controller.tasks.owned(channel.id)
+    assert "2" in channel.users
+
+
+def test_hybrid_clock_never_goes_backwards():
+    now = 100.0
+    clock = HybridClock("a", clock=lambda: now)
+
+    first = clock.now()
+    now = 99.0
+    second = clock.now()
+    remote = clock.update(Stamp(200_000, 5, "b"))
+
+    assert first < second < remote
+    assert remote == Stamp(200_000, 6, "a")
+    assert clock.now() > remote
+
+
+async def test_edits_merge_in_any_order(channel: Channel, user: User):
+    channel.policy.max_objects = 3
+    channel.users[user.id] = user
+    await channel.push_object(
+        Object(id="a", url="url", comment="hi", position=Position(x=1, y=1)), user
+    )
+    original = channel.objects["a"]
+    info = user.info()
+    edits = [
+        MoveObjectEvent(
+            id="a", position=Position(x=2, y=2), editor=info, stamp=Stamp(2, 0, "x")
+        ),
+        MoveObjectEvent(
+            id="a", position=Position(x=3, y=3), editor=info, stamp=Stamp(2, 0, "y")
+        ),
+        EditCommentEvent(id="a", comment="bye", editor=info, stamp=Stamp(1, 0, "x")),
+    ]
+
+    assert [channel.merge(edit) for edit in edits] == [True, True, True]
+    assert not channel.merge(edits[0])
+    merged = channel.objects["a"]
+    assert (merged.position.x, merged.comment) == (3, "bye")
+    # Snapshots may share the object, it isn't changed in place.
+    assert original.position.x == 1
+
+    channel.objects["a"] = original
+    assert [channel.merge(edit) for edit in reversed(edits)] == [True, True, False]
+    assert channel.objects["a"] == merged
+
+
+async def test_delete_wins_over_later_edits(channel: Channel, user: User):
+    events: list[Event] = []
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    channel.policy.max_ccu = 2
+    channel.users[user.id] = user
+    channel.users["2"] = User(id="2", nickname="two", connection=TempConn())
+    await channel.push_object(
+        Object(id="a", url="url", comment="hi", position=Position(x=1, y=1)), user
+    )
+
+    await channel.edit_object(DeleteObjectEvent(id="a", editor=user.info()), user)
+    await channel.edit_object(
+        MoveObjectEvent(id="a", position=Position(x=2, y=2), editor=user.info()), user
+    )
+
+    assert "a" not in channel.objects
+    assert "a" in channel.tombstones
+    assert [event.type for event in events] == ["push-object", "delete-object"]
+    assert events[-1].stamp is not None
+
+    # Deleted before its push arrived, the push is refused.
+    channel.policy.max_objects = 2
+    await channel.edit_object(DeleteObjectEvent(id="b", editor=user.info()), user)
+    assert list(channel.tombstones) == ["a", "b"]
+    await channel.push_object(
+        Object(id="b", url="url", comment="hi", position=Position(x=1, y=1)), user
+    )
+    assert "b" not in channel.objects
+    assert events[-1].type == "delete-object"
+
+
+async def test_presence_sends_one_frame_per_tick(channel: Channel, user: User):
+    events: list[Event] = []
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            events.append(data)
+
+    channel.policy.max_ccu = 2
+    channel.policy.presence_rate = 100
+    other = User(id="2", nickname="two", connection=TempConn())
+    channel.users[user.id] = user
+    channel.users[other.id] = other
+
+    for x in range(50):
+        channel.report_cursor(user, x, 0)
+    channel.report_cursor(other, 5, 5)
+    await aio.sleep(0.05)
+
+    assert len(events) == 1
+    assert [(c.id, c.x) for c in events[0].cursors] == [("1", 49), ("2", 5)]
+    assert not channel.presence.ticking
+
+    await channel.leave(other)
+    channel.report_cursor(other, 6, 6)
+    await aio.sleep(0.05)
+
+    assert len(events) == 1
+    assert list(channel.presence.cursors) == ["1"]
+
+
+async def test_failed_presence_frame_is_a_drop(channel: Channel, user: User):
+    class FailingConn(BaseUserConnection):
+        async def send(self, data: Event):
+            raise ConnectionError
+
+    channel.policy.max_ccu = 2
+    channel.policy.presence_rate = 100
+    other = User(id="2", nickname="two", connection=FailingConn())
+    channel.users[user.id] = user
+    channel.users[other.id] = other
+
+    channel.report_cursor(user, 1, 1)
+    await aio.sleep(0.05)
+
+    assert "2" in channel.users
+    assert (channel.dropped_sends, channel.failed_sends) == (1, 0)
+
+
+async def test_presence_restarts_after_cancel_before_start(
+    channel: Channel, user: User
+):
+    channel.policy.presence_rate = 100
+    channel.users[user.id] = user
+    channel.channel_controller.tasks.limit = 1
+    blocker = channel.channel_controller.tasks.spawn(aio.sleep(1), name="presence")
+
+    channel.report_cursor(user, 1, 1)
+    assert channel.presence.ticking
+    channel.channel_controller.tasks.cancel_owner(channel.id)
+    await aio.sleep(0.01)
+
+    assert not channel.presence.ticking
+    blocker.cancel()
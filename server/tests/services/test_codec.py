@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from server.services.channel import (
+    BaseEvent,
+    Channel,
+    Cursor,
+    CursorEvent,
+    DeleteObjectEvent,
+    EditCommentEvent,
+    ErrorEvent,
+    Event,
+    JoinEvent,
+    LeaveEvent,
+    MoveObjectEvent,
+    Object,
+    Position,
+    PresenceEvent,
+    PushObjectEvent,
+    PushObjectsEvent,
+    SnapshotEvent,
+    UserInfo,
+    WaitEvent,
+)
+from server.services.clock import Stamp
+from server.services.codec import (
+    BINARY_TAGS,
+    EVENT_TYPES,
+    SnapshotDecoder,
+    SnapshotEncoder,
+    decode_binary,
+    decode_event,
+    encode_binary,
+    loads_event,
+    parse_binary,
+    parse_event,
+)
+
+USER = UserInfo(id="1", nickname="활발한 INFP 고양이")
+OBJECT = Object(
+    id="obj",
+    url="/decos/bauble.png",
+    comment="메리 크리스마스",
+    created_at=datetime(2023, 12, 25, 9, 30, 15, 123456),
+    position=Position(x=10, y=-20),
+)
+STAMP = Stamp(1703464215123, 2, "node")
+
+EVENTS = [
+    JoinEvent(user=USER),
+    PushObjectEvent(object=OBJECT, appender=USER, pop=None),
+    PushObjectEvent(object=OBJECT, appender=USER, pop="old"),
+    PushObjectsEvent(objects=[OBJECT, OBJECT], appender=USER, pops=["old"]),
+    MoveObjectEvent(id="obj", position=Position(x=-5, y=7), editor=USER, stamp=STAMP),
+    EditCommentEvent(id="obj", comment="새해 복 많이", editor=USER, stamp=STAMP),
+    DeleteObjectEvent(id="obj", editor=USER, stamp=STAMP),
+    LeaveEvent(user=USER),
+    CursorEvent(x=120, y=-3),
+    PresenceEvent(cursors=[Cursor(id="1", nickname="하나", x=1, y=2)] * 2),
+    WaitEvent(position=3),
+    SnapshotEvent(objects=[OBJECT]),
+    ErrorEvent(code="full", message="Full users"),
+]
+
+
+def test_every_event_type_has_codec():
+    assert set(EVENT_TYPES) == {
+        field.type_.__fields__["type"].default
+        for field in Event.__fields__["__root__"].sub_fields
+    }
+    assert set(BINARY_TAGS) == set(EVENT_TYPES)
+
+
+@pytest.mark.parametrize("event", EVENTS, ids=lambda e: e.type)
+def test_encode_matches_pydantic(event: BaseEvent):
+    assert event.encode() == json.loads(event.json())
+    assert json.loads(event.dumps()) == json.loads(event.json())
+
+
+@pytest.mark.parametrize("event", EVENTS, ids=lambda e: e.type)
+def test_round_trip(event: BaseEvent):
+    assert decode_event(event.encode()) == event
+    assert loads_event(event.dumps()) == event
+    assert parse_event(json.loads(event.dumps())) == event
+
+
+@pytest.mark.parametrize("event", EVENTS, ids=lambda e: e.type)
+def test_binary_round_trip(event: BaseEvent):
+    data = encode_binary(event)
+
+    assert decode_binary(data) == event
+    assert parse_binary(data) == event
+    assert len(data) < len(event.dumps().encode())
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\xff",
+        # Truncated push
+        encode_binary(EVENTS[1])[:-3],
+        # Invalid UTF-8 in a string
+        bytes([BINARY_TAGS["delete-object"], 2, 0xFF, 0xFE]),
+        # created_at far beyond datetime range
+        bytes([BINARY_TAGS["snapshot"], 1, 0, 0, 0]) + b"\xff" * 10 + b"\x01",
+    ],
+)
+def test_parse_binary_rejects_malformed(data: bytes):
+    with pytest.raises((ValueError, IndexError, KeyError, OverflowError)):
+        parse_binary(data)
+
+
+def test_aware_created_at_is_naive_local():
+    aware = datetime(2023, 12, 25, 18, 30, tzinfo=timezone(timedelta(hours=9)))
+    obj = OBJECT.copy(update={"created_at": aware})
+    event = parse_event(PushObjectEvent(object=obj, appender=USER).encode())
+
+    assert event.object.created_at == aware.astimezone().replace(tzinfo=None)
+    assert event.object.created_at.timestamp() == aware.timestamp()
+    assert decode_binary(encode_binary(event)) == event
+
+
+def test_compact_snapshot():
+    objects = [
+        Object(
+            id=f"{n:036}",
+            url=f"/decos/deco{n % 3}.png",
+            comment="메리 크리스마스",
+            created_at=datetime(2023, 12, 25, 9, 30) + timedelta(seconds=n),
+            position=Position(x=n, y=n * 2),
+        )
+        for n in range(30)
+    ]
+    encoder = SnapshotEncoder(compress=True)
+    decoder = SnapshotDecoder()
+
+    message = encoder.dumps(objects)
+
+    assert decoder.loads(message) == SnapshotEvent(objects=objects)
+    assert len(message) < len(SnapshotEvent(objects=objects).dumps().encode()) / 2
+
+    # String table is sent once per connection.
+    assert encoder.encode(objects[:1])["urls"] == []
+    assert decoder.loads(encoder.dumps(objects[:1])).objects == objects[:1]
+
+
+async def test_fresh_connections_share_encoded_snapshot():
+    channel = Channel(id="test")
+    for n in range(3):
+        obj = Object(
+            id=str(n),
+            url=f"/decos/deco{n % 2}.png",
+            comment="hi",
+            position=Position(x=n, y=n),
+        )
+        channel.objects[obj.id] = obj
+    first, second = SnapshotEncoder(), SnapshotEncoder()
+
+    message = first.dumps_channel(channel)
+
+    assert second.dumps_channel(channel) is message
+    assert channel.stats.snapshot_hits == 1
+    assert channel.stats.snapshot_misses == 1
+    # Connections keep their own string table afterwards.
+    assert first.urls == second.urls
+    assert first.urls is not second.urls
+    assert first.encode(list(channel.objects.values()))["urls"] == []
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio as aio
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from server.services.channel import (
+    BaseUserConnection,
+    Channel,
+    ChannelController,
+    ChannelPolicy,
+    Object,
+    Position,
+    User,
+)
+from server.services.comments import CommentSanitizer, ProfanityMatcher, sanitize
+
+WORDS = ["he", "she", "his", "hers", "바보"]
+
+
+@pytest.mark.parametrize(
+    "text, masked",
+    [
+        ("ushers", "u*****"),
+        ("SHE said", "*** said"),
+        ("this", "t***"),
+        ("너 바보야", "너 **야"),
+        ("메리 크리스마스", "메리 크리스마스"),
+    ],
+)
+def test_matcher_masks_every_word(text: str, masked: str):
+    assert ProfanityMatcher(WORDS).mask(text) == masked
+
+
+def test_sanitize():
+    matcher = ProfanityMatcher(WORDS)
+    decomposed = "\u1100\u1161\u11ab"
+
+    assert sanitize("<b>메리</b>\n\n크리스마스", 100, matcher) == "메리 크리스마스"
+    assert sanitize("&lt;script&gt;x&lt;/script&gt;", 100, matcher) == "x"
+    assert sanitize(decomposed, 100, matcher) == "\uac04"
+    assert sanitize("abc\x00def", 4, matcher) == "abcd"
+
+
+async def test_comments_are_batched_and_cached():
+    sanitizer = CommentSanitizer(WORDS, timeout=30)
+    try:
+        results = await aio.gather(
+            sanitizer.sanitize("<i>hers</i>"),
+            sanitizer.sanitize("<i>hers</i>"),
+            sanitizer.sanitize("hi"),
+        )
+
+        assert results == ["****", "****", "hi"]
+        assert list(sanitizer.cache) == ["<i>hers</i>", "hi"]
+        assert not sanitizer.pending
+        assert await sanitizer.sanitize("hi") == "hi"
+        # Workers started, the pool wasn't dropped as broken.
+        assert sanitizer._pool is not None
+    finally:
+        sanitizer.close()
+
+
+async def test_broken_pool_is_replaced():
+    sanitizer = CommentSanitizer(WORDS, timeout=30)
+    sanitizer._pool = broken = ProcessPoolExecutor(1)
+    broken.shutdown()
+
+    # Settled inline right away, instead of waiting for the timeout.
+    assert await aio.wait_for(sanitizer.sanitize("hers"), 1) == "****"
+    assert not sanitizer.pending
+    assert sanitizer._pool is None
+
+
+async def test_push_sanitizes_comment_in_time():
+    controller = ChannelController(comments=CommentSanitizer(WORDS, timeout=0))
+    channel = Channel(id="test")
+    controller.channels["test"] = channel
+    channel.initialize(controller, ChannelPolicy())
+    user = User(id="1", nickname="one", connection=BaseUserConnection())
+    channel.users[user.id] = user
+
+    try:
+        await channel.push_object(
+            Object(id="a", url="url", comment="바보<br>", position=Position(x=1, y=1)),
+            user,
+        )
+    finally:
+        controller.comments.close()
+
+    # Pool isn't up in time, so it is sanitized inline.
+    assert channel.objects["a"].comment == "**"
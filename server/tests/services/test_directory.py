@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import pytest
+
+from server.services.channel import BaseUserConnection, ChannelController, User
+from server.services.directory import ChannelDirectory
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_top_by_decayed_pushes(clock: Clock):
+    directory = ChannelDirectory(half_life=60, clock=clock)
+    directory.pushed("/old", 10)
+    clock.now += 120
+    directory.pushed("/new", 4)
+
+    # 10 pushes two half-lives ago weigh as 2.5 now.
+    assert [s.id for s in directory.top(2)] == ["/new", "/old"]
+    old, new = directory.search("/old")[0], directory.search("/new")[0]
+    assert old.push_rate == pytest.approx(new.push_rate * 2.5 / 4)
+
+    directory.pushed("/old", 2)
+    assert [s.id for s in directory.top(1)] == ["/old"]
+    assert [s.id for s in directory.top(5)] == ["/old", "/new"]
+
+
+def test_top_by_users_and_prefix_search(clock: Clock):
+    directory = ChannelDirectory(clock=clock)
+    for tree_id, users in (("/a", 1), ("/b/1", 3), ("/b/2", 2), ("/c", 0)):
+        directory.pushed(tree_id)
+        for _ in range(users):
+            directory.joined(tree_id)
+    directory.left("/b/1")
+    directory.left("/b/1")
+
+    assert [(s.id, s.users) for s in directory.top(2, by="users")] == [
+        ("/b/2", 2),
+        ("/a", 1),
+    ]
+    assert [s.id for s in directory.search("/b/")] == ["/b/1", "/b/2"]
+
+    directory.remove("/b/2")
+    assert [s.id for s in directory.search("/b")] == ["/b/1"]
+    assert "/b/2" not in [s.id for s in directory.top(10, by="users")]
+
+
+def test_recreated_tree_ignores_stale_rankings(clock: Clock):
+    directory = ChannelDirectory(clock=clock)
+    directory.pushed("/a", 100)
+    directory.remove("/a")
+    directory.pushed("/a", 1)
+    directory.pushed("/b", 50)
+
+    assert [tree.id for tree in directory.top(3)] == ["/b", "/a"]
+
+
+def test_rescale_keeps_ranking(clock: Clock):
+    directory = ChannelDirectory(half_life=1, clock=clock)
+    directory.pushed("/a", 2)
+    directory.pushed("/b", 1)
+    clock.now += 1000
+    directory.pushed("/c", 1)
+
+    assert [s.id for s in directory.top(3)] == ["/c", "/a", "/b"]
+    assert directory.entries["/c"].weight == 1
+
+
+async def test_controller_keeps_directory():
+    controller = ChannelController()
+    channel = controller.create_channel("/tree")
+    user = User(id="1", nickname="one", connection=BaseUserConnection())
+
+    await channel.join(user)
+    assert controller.directory.top(1, by="users")[0].users == 1
+
+    await channel.leave(user)
+    assert len(controller.directory) == 0
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from server.services.channel import (
+    BaseUserConnection,
+    ChannelController,
+    ChannelPolicy,
+    DeleteObjectEvent,
+    EditCommentEvent,
+    MoveObjectEvent,
+    Object,
+    Position,
+    User,
+    UserInfo,
+)
+from server.services.clock import Stamp
+from server.services.history import HistoryStore
+
+START = datetime(2023, 12, 25)
+
+
+def make_object(n: int) -> Object:
+    return Object(
+        id=str(n),
+        url="url",
+        comment="hello",
+        created_at=START + timedelta(minutes=n),
+        position=Position(x=n, y=n),
+    )
+
+
+@pytest.fixture
+def history():
+    store = HistoryStore()
+    for n in range(5):
+        store.append("tree", make_object(n))
+    store.append("other", make_object(0))
+    yield store
+    store.close()
+
+
+def test_as_of(history: HistoryStore):
+    objects = history.as_of("tree", START + timedelta(minutes=3), limit=2)
+
+    assert [obj.id for obj in objects] == ["2", "3"]
+    assert objects[0].created_at == START + timedelta(minutes=2)
+
+
+def test_as_of_applies_edits(history: HistoryStore):
+    editor = UserInfo(id="1", nickname="one")
+
+    def stamp(minutes: int) -> Stamp:
+        return Stamp(
+            int((START + timedelta(minutes=minutes)).timestamp() * 1000), 0, "x"
+        )
+
+    history.append_edit(
+        "tree",
+        MoveObjectEvent(
+            id="3", position=Position(x=0, y=0), editor=editor, stamp=stamp(5)
+        ),
+    )
+    history.append_edit(
+        "tree", EditCommentEvent(id="3", comment="bye", editor=editor, stamp=stamp(6))
+    )
+    history.append_edit(
+        "tree", DeleteObjectEvent(id="4", editor=editor, stamp=stamp(7))
+    )
+
+    before = history.as_of("tree", START + timedelta(minutes=5), limit=2)
+    after = history.as_of("tree", START + timedelta(minutes=7), limit=2)
+
+    assert [(obj.id, obj.position.x, obj.comment) for obj in before] == [
+        ("3", 0, "hello"),
+        ("4", 4, "hello"),
+    ]
+    assert [(obj.id, obj.position.x, obj.comment) for obj in after] == [
+        ("2", 2, "hello"),
+        ("3", 0, "bye"),
+    ]
+
+    # Edits go with their objects.
+    history.compact(before=START + timedelta(minutes=4))
+    assert [
+        obj.id for obj in history.as_of("tree", START + timedelta(minutes=6), 2)
+    ] == ["4"]
+    assert not history.as_of("tree", START + timedelta(minutes=7), limit=2)
+
+
+def test_page(history: HistoryStore):
+    first = history.page("tree", limit=3)
+    second = history.page("tree", before=first.next, limit=3)
+
+    assert [obj.id for obj in first.objects] == ["4", "3", "2"]
+    assert [obj.id for obj in second.objects] == ["1", "0"]
+    assert second.next is None
+
+
+def test_iter_history(history: HistoryStore):
+    objects = list(history.iter_history("tree", batch=2))
+
+    assert [obj.id for obj in objects] == ["0", "1", "2", "3", "4"]
+
+
+def test_compact(history: HistoryStore):
+    history.compact(before=START + timedelta(minutes=3))
+
+    assert [obj.id for obj in history.iter_history("tree")] == ["3", "4"]
+
+
+async def test_push_object_records_history():
+    history = HistoryStore()
+    controller = ChannelController(history=history)
+    channel = controller.create_channel("tree", ChannelPolicy(max_objects=1))
+    user = User(id="1", nickname="one", connection=BaseUserConnection())
+    channel.users[user.id] = user
+
+    await channel.push_object(make_object(0), user)
+    await channel.push_object(make_object(1), user)
+
+    assert len(channel.objects) == 1
+    assert [obj.id for obj in history.iter_history("tree")] == ["0", "1"]
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import asyncio as aio
+import json
+from pathlib import Path
+
+import pytest
+
+from server.services.channel import (
+    BaseUserConnection,
+    ChannelController,
+    ChannelPolicy,
+    DeleteObjectEvent,
+    ErrorEvent,
+    Event,
+    Object,
+    Position,
+    User,
+    UserInfo,
+)
+from server.services.clock import Stamp
+from server.services.migration import (
+    ChannelState,
+    HandoffError,
+    drain,
+    serve_handoff,
+)
+
+
+class TempConn(BaseUserConnection):
+    def __init__(self):
+        self.events: list[Event] = []
+        self.closed = False
+
+    async def send(self, data: Event):
+        self.events.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+def make_object(id: str) -> Object:
+    return Object(id=id, url="url", comment="hi", position=Position(x=1, y=1))
+
+
+async def test_drain_hands_channels_over(tmp_path: Path):
+    old, new = ChannelController(), ChannelController()
+    old.policies.default = ChannelPolicy(max_objects=3, max_ccu=2)
+    channel = old.assign_channel("/tree")
+    conn = TempConn()
+    user = User(id="1", nickname="one", connection=conn)
+    await channel.join(user)
+    await channel.push_object(make_object("a"), user)
+    obj = channel.objects["a"].copy(update={"stamps": {"comment": Stamp(5, 0, "x")}})
+    channel.objects["a"] = obj
+    channel.tombstones["b"] = Stamp(6, 0, "x")
+
+    path = tmp_path / "handoff.sock"
+    server = await serve_handoff(new, path)
+    try:
+        assert await drain(old, path) == 1
+    finally:
+        server.close()
+
+    assert conn.closed
+    assert not old.channels
+    await channel.push_object(make_object("c"), user)
+    assert conn.events[-1] == ErrorEvent(code="draining", message="Draining")
+
+    restored = new.get_channel("/tree")
+    assert restored.version == channel.version
+    assert restored.object_list() == (obj,)
+    assert restored.objects["a"].stamps == {"comment": Stamp(5, 0, "x")}
+    assert restored.tombstones == {"b": Stamp(6, 0, "x")}
+    assert new.clock.now() > Stamp(6, 0, "x")
+
+    # The seat is held until the user resumes, without a join event.
+    restored.policy.max_ccu = 1
+    assert not restored.has_seat()
+    # Public user id isn't enough to take it.
+    assert new.resume_channel("/tree", "1") is None
+    assert new.resume_channel("/tree", user.resume_token) is restored
+    resumed = User(id="1", nickname="one", connection=TempConn())
+    assert restored.resume(user.resume_token, resumed)
+    assert list(restored.users) == ["1"]
+    assert not restored.resuming
+    assert resumed.resume_token != user.resume_token
+
+
+async def test_rejoining_without_token_frees_held_seat():
+    controller = ChannelController()
+    controller.policies.default = ChannelPolicy(overflow=True, max_ccu=1)
+    state = ChannelState.construct(
+        id="/tree",
+        group="/tree",
+        version=1,
+        policy=controller.get_policy("/tree"),
+        objects=[],
+        tombstones={},
+        users={"token": UserInfo(id="1", nickname="one")},
+    )
+    held = state.restore(controller, resume_timeout=30)
+
+    # Page sessions come back by id, to the sub-channel holding their seat.
+    channel = controller.assign_channel("/tree", "1")
+    assert channel is held
+    user = User(id="1", nickname="one", connection=TempConn())
+    await channel.join(user)
+    assert list(channel.users) == ["1"]
+    assert not channel.resuming
+
+
+async def test_drain_aborts_unless_every_channel_is_received(tmp_path: Path):
+    old = ChannelController()
+    channel = old.assign_channel("/tree")
+    conn = TempConn()
+    user = User(id="1", nickname="one", connection=conn)
+    await channel.join(user)
+
+    async def refuse(reader: aio.StreamReader, writer: aio.StreamWriter):
+        await reader.readline()
+        writer.write(b"0\n")
+        await writer.drain()
+        writer.close()
+
+    path = tmp_path / "handoff.sock"
+    server = await aio.start_unix_server(refuse, path)
+    try:
+        with pytest.raises(HandoffError):
+            await drain(old, path)
+    finally:
+        server.close()
+
+    assert not old.draining
+    assert not conn.closed
+    assert old.get_channel("/tree") is channel
+
+
+async def test_nothing_is_restored_without_commit(tmp_path: Path):
+    old, new = ChannelController(), ChannelController()
+    old.assign_channel("/tree")
+    state = ChannelState.dump(old.get_channel("/tree"))
+
+    path = tmp_path / "handoff.sock"
+    server = await serve_handoff(new, path)
+    try:
+        reader, writer = await aio.open_unix_connection(path)
+        header = {"clock": old.clock.now().encode(), "channels": 1}
+        writer.write(json.dumps(header).encode() + b"\n")
+        writer.write(json.dumps(state.encode()).encode() + b"\n")
+        assert await reader.readline() == b"1\n"
+        # The previous worker fails before committing.
+        writer.close()
+        await writer.wait_closed()
+        await reader.read()
+    finally:
+        server.close()
+
+    assert not new.channels
+
+
+async def test_handoff_merges_into_channel_opened_meanwhile(tmp_path: Path):
+    old, new = ChannelController(), ChannelController()
+    channel = old.assign_channel("/tree")
+    user = User(id="1", nickname="one", connection=TempConn())
+    await channel.join(user)
+    await channel.push_object(make_object("a"), user)
+    await channel.push_object(make_object("b"), user)
+    channel.tombstones["c"] = Stamp(6, 0, "x")
+    opened = new.assign_channel("/tree")
+    other = User(id="2", nickname="two", connection=TempConn())
+    await opened.join(other)
+    await opened.push_object(make_object("c"), other)
+    await opened.push_object(make_object("d"), other)
+    await opened.edit_object(DeleteObjectEvent.construct(id="d"), other)
+
+    path = tmp_path / "handoff.sock"
+    server = await serve_handoff(new, path)
+    try:
+        assert await drain(old, path) == 1
+    finally:
+        server.close()
+
+    assert new.get_channel("/tree") is opened
+    assert list(opened.objects) == ["a", "b"]
+    assert set(opened.tombstones) == {"c", "d"}
+    assert opened.version > channel.version
+    assert list(opened.users) == ["2"]
+    assert [info.id for info in opened.resuming.values()] == ["1"]
+
+
+async def test_push_waiting_for_lock_is_refused_once_draining():
+    controller = ChannelController()
+    channel = controller.assign_channel("/tree")
+    conn = TempConn()
+    user = User(id="1", nickname="one", connection=conn)
+    await channel.join(user)
+
+    await channel.event_lock.acquire()
+    push = aio.create_task(channel.push_object(make_object("a"), user))
+    await aio.sleep(0)
+    controller.draining = True
+    channel.event_lock.release()
+    await push
+
+    assert not channel.objects
+    assert conn.events[-1] == ErrorEvent(code="draining", message="Draining")
+
+
+def test_channel_state_round_trip():
+    controller = ChannelController()
+    controller.policies.default = ChannelPolicy(overflow=True, max_ccu=1)
+    first = controller.assign_channel("/tree")
+    first.resuming["token"] = UserInfo(id="1", nickname="one")
+    second = controller.assign_channel("/tree")
+    second.objects["a"] = make_object("a")
+
+    states = [
+        ChannelState.decode(ChannelState.dump(channel).encode())
+        for channel in (first, second)
+    ]
+
+    assert [state.id for state in states] == ["/tree", "/tree#1"]
+    assert states[1].group == "/tree"
+    assert [user.id for user in states[0].users.values()] == ["1"]
+    assert list(states[0].users) == ["token"]
+    assert states[0].objects == [second.objects["a"]]
+    assert states[0].policy == first.policy
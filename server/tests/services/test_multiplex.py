@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import asyncio as aio
+import json
+
+from server.services.channel import (
+    BaseUserConnection,
+    ChannelController,
+    Object,
+    Position,
+    User,
+)
+from server.services.multiplex import Multiplexer
+
+
+def drain(mux: Multiplexer) -> list:
+    messages = []
+    while not mux.outbox.empty():
+        messages.append(json.loads(mux.outbox.get_nowait()))
+    return messages
+
+
+async def push(controller: ChannelController, channel_id: str, n: int):
+    channel = controller.assign_channel(channel_id)
+    user = User(id="pusher", nickname="pusher", connection=BaseUserConnection())
+    channel.users[user.id] = user
+    await channel.push_object(
+        Object(id=str(n), url="url", comment="", position=Position(x=n, y=n)), user
+    )
+    # Let subscription callbacks run.
+    await aio.sleep(0)
+
+
+async def test_subscribe_many_channels():
+    controller = ChannelController()
+    mux = Multiplexer(controller)
+
+    mux.handle({"op": "subscribe", "channel": "/a"})
+    mux.handle({"op": "subscribe", "channel": "/b"})
+    await push(controller, "/b", 1)
+
+    messages = drain(mux)
+    assert messages[0] == {"op": "subscribed", "sub": 1, "channel": "/a"}
+    assert messages[1] == [1, 1, {"type": "snapshot", "objects": []}]
+    assert messages[3] == [2, 1, {"type": "snapshot", "objects": []}]
+    sub, seq, event = messages[4]
+    assert (sub, seq, event["type"]) == (2, 2, "push-object")
+
+    mux.handle({"op": "unsubscribe", "sub": 1})
+    assert drain(mux) == [{"op": "unsubscribed", "sub": 1}]
+    assert controller.get_channel("/a") is None
+
+
+async def test_invalid_control_messages_are_refused():
+    mux = Multiplexer(ChannelController())
+
+    for data in [
+        None,
+        {"op": "subscribe", "channel": "/a", "window": "many"},
+        {"op": "subscribe", "channel": "/a", "window": 0},
+        {"op": "ack", "sub": 1, "credit": [1]},
+        {"op": "unsubscribe"},
+        {"op": "close"},
+    ]:
+        mux.handle(data)
+
+    assert drain(mux) == [{"op": "error", "code": "invalid", "message": "invalid"}] * 6
+    assert not mux.subscriptions
+
+
+async def test_flow_control_resyncs_with_snapshot():
+    controller = ChannelController()
+    controller.create_channel("/a").policy.max_objects = 10
+    mux = Multiplexer(controller, window=2, max_pending=2)
+    mux.handle({"op": "subscribe", "channel": "/a"})
+
+    for n in range(2):
+        await push(controller, "/a", n)
+    # Snapshot and one push fit in the window, the other is buffered.
+    assert [m[1] for m in drain(mux)[1:]] == [1, 2]
+
+    mux.handle({"op": "ack", "sub": 1, "credit": 1})
+    assert drain(mux)[0][2]["object"]["id"] == "1"
+
+    for n in range(2, 6):
+        await push(controller, "/a", n)
+    assert drain(mux) == []
+
+    mux.handle({"op": "ack", "sub": 1, "credit": 10})
+    (message,) = drain(mux)
+    assert message[2]["type"] == "snapshot"
+    assert len(message[2]["objects"]) == 6
+
+    mux.close()
+    assert controller.stats.spectators == 0
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from server.services.channel import ChannelController, Object, Position
+from server.services.policy import PolicyRegistry
+
+
+@pytest.fixture
+def policy_file(tmp_path: Path):
+    path = tmp_path / "policies.toml"
+    path.write_text(
+        """
+[default]
+max_ccu = 10
+
+[[overrides]]
+pattern = "/hot/*"
+max_ccu = 100
+"""
+    )
+    return path
+
+
+def touch(path: Path, content: str):
+    stat = path.stat()
+    path.write_text(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_get_policy_with_override(policy_file: Path):
+    registry = PolicyRegistry.from_file(policy_file)
+
+    assert registry.get("/").max_ccu == 10
+    assert registry.get("/hot/tree").max_ccu == 100
+
+
+def test_reload_updates_live_channels(policy_file: Path):
+    controller = ChannelController(policies=PolicyRegistry.from_file(policy_file))
+    channel = controller.create_channel("/hot/tree")
+    policy = channel.policy
+
+    touch(
+        policy_file,
+        """
+[default]
+max_ccu = 10
+
+[[overrides]]
+pattern = "/hot/*"
+max_ccu = 200
+timeout = 3
+""",
+    )
+
+    assert controller.reload_policies()
+    assert channel.policy is policy
+    assert channel.policy.max_ccu == 200
+    assert channel.policy.timeout == 3
+
+
+def test_reload_keeps_policies_when_broken(policy_file: Path):
+    registry = PolicyRegistry.from_file(policy_file)
+
+    touch(policy_file, "[default]\nmax_ccu = 'many'\n")
+
+    with pytest.raises(ValueError):
+        registry.reload()
+    assert registry.get("/hot/tree").max_ccu == 100
+
+
+@pytest.mark.parametrize(
+    "overrides",
+    ["[[overrides]]\nmax_ccu = 5\n", "overrides = [1]\n"],
+    ids=["no-pattern", "not-table"],
+)
+def test_reload_rejects_broken_overrides(policy_file: Path, overrides: str):
+    registry = PolicyRegistry.from_file(policy_file)
+
+    touch(policy_file, overrides)
+
+    with pytest.raises(ValueError):
+        registry.reload()
+    assert registry.get("/hot/tree").max_ccu == 100
+
+
+def test_reload_rejects_unknown_values(policy_file: Path):
+    registry = PolicyRegistry.from_file(policy_file)
+
+    touch(policy_file, "[default]\nmax_cuu = 5\n")
+
+    with pytest.raises(ValueError):
+        registry.reload()
+    assert registry.get("/hot/tree").max_ccu == 100
+
+
+def test_reload_trims_objects_over_lowered_limit(policy_file: Path):
+    controller = ChannelController(policies=PolicyRegistry.from_file(policy_file))
+    channel = controller.create_channel("/tree")
+    for n in range(3):
+        channel.objects[str(n)] = Object(
+            id=str(n), url="url", comment="hi", position=Position(x=n, y=n)
+        )
+    version = channel.version
+
+    touch(policy_file, "[default]\nmax_objects = 1\n")
+
+    assert controller.reload_policies()
+    assert list(channel.objects) == ["2"]
+    assert channel.version > version
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio as aio
+import struct
+from pathlib import Path
+
+import pytest
+
+from server.services.catalog import DecoCatalog
+from server.services.channel import (
+    BaseUserConnection,
+    ChannelController,
+    Object,
+    Position,
+    User,
+)
+from server.services.history import HistoryStore
+from server.services.preview import PreviewRenderer
+
+
+@pytest.fixture
+def renderer(tmp_path: Path):
+    decos = tmp_path / "decos"
+    decos.mkdir()
+    header = b"\x89PNG\r\n\x1a\n" + b"\x00\x00\x00\rIHDR"
+    (decos / "bauble.png").write_bytes(header + struct.pack(">II", 30, 30))
+    (decos / "bell.png").write_bytes(header + struct.pack(">II", 60, 30))
+    tree = tmp_path / "tree.svg"
+    tree.write_text('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    return PreviewRenderer(tree, DecoCatalog.load(decos), decos, delay=0.01)
+
+
+def make_object(n: int, url: str) -> Object:
+    return Object(id=str(n), url=url, comment="", position=Position(x=n, y=n))
+
+
+def test_compose_embeds_each_image_once(renderer: PreviewRenderer):
+    svg = renderer.compose(
+        [
+            make_object(1, "/decos/bauble.png"),
+            make_object(2, "/decos/bell.png"),
+            make_object(3, "/decos/bauble.png"),
+            make_object(4, "/uploads/photo.png"),
+        ]
+    ).decode()
+
+    assert svg.count("<image") == 3
+    assert '<image id="d1" width="100" height="50"' in svg
+    assert svg.count("<use") == 3
+    assert '<use href="#d0" x="3" y="3"/>' in svg
+
+
+async def test_preview_rerendered_after_push(renderer: PreviewRenderer):
+    controller = ChannelController(previews=renderer)
+    channel = controller.create_channel("/tree")
+    user = User(id="1", nickname="one", connection=BaseUserConnection())
+    await channel.join(user)
+
+    preview = await renderer.render("/tree", controller)
+    assert await renderer.render("/tree", controller) is preview
+
+    for n in range(3):
+        await channel.push_object(make_object(n, "/decos/bauble.png"), user)
+    await aio.gather(*controller.tasks.owned("previews"))
+
+    assert controller.tasks.stats["preview"].finished == 1
+    refreshed = await renderer.render("/tree", controller)
+    assert refreshed is renderer.previews["/tree"]
+    assert refreshed.etag != preview.etag
+    assert refreshed.svg.count(b"<use") == 3
+
+
+async def test_preview_of_closed_channel_from_history(renderer: PreviewRenderer):
+    controller = ChannelController(previews=renderer, history=HistoryStore())
+    controller.history.append("/tree", make_object(1, "/decos/bell.png"))
+
+    preview = await renderer.render("/tree", controller)
+
+    assert preview.svg.count(b"<use") == 1
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import asyncio as aio
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from server.services.channel import (
+    BaseUserConnection,
+    ChannelController,
+    DeleteObjectEvent,
+    MoveObjectEvent,
+    Object,
+    Position,
+    User,
+    UserInfo,
+)
+from server.services.replay import (
+    Command,
+    TraceRecorder,
+    VirtualClockLoop,
+    read_trace,
+    run_replay,
+)
+
+
+def make_object(n: int) -> Object:
+    return Object(
+        id=str(n),
+        url="url",
+        comment="hello",
+        created_at=datetime(2023, 12, 25),
+        position=Position(x=n, y=n),
+    )
+
+
+def test_virtual_clock_runs_timers_without_waiting():
+    async def main():
+        loop = aio.get_running_loop()
+        with pytest.raises(TimeoutError):
+            await aio.wait_for(aio.sleep(3600), timeout=60)
+        return loop.time()
+
+    with aio.Runner(loop_factory=VirtualClockLoop) as runner:
+        assert runner.run(main()) == pytest.approx(60)
+
+
+def test_record_and_replay(tmp_path: Path):
+    trace = tmp_path / "trace.jsonl"
+    controller = ChannelController(recorder=TraceRecorder(trace))
+    users = [
+        User(id=str(n), nickname=str(n), connection=BaseUserConnection())
+        for n in range(3)
+    ]
+    channel = controller.assign_channel("tree")
+
+    async def record():
+        for user in users:
+            await channel.join(user)
+        await channel.push_object(make_object(0), users[0])
+        await channel.push_objects([make_object(1), make_object(2)], users[1])
+        await channel.edit_object(
+            MoveObjectEvent(
+                id="0", position=Position(x=5, y=5), editor=users[1].info()
+            ),
+            users[1],
+        )
+        await channel.edit_object(
+            DeleteObjectEvent(id="1", editor=users[0].info()), users[0]
+        )
+        await channel.leave(users[2])
+
+    aio.run(record())
+    controller.recorder.close()
+
+    commands = list(read_trace(trace))
+    replayed = ChannelController()
+    stats = run_replay(commands, replayed)
+
+    assert [command.op for command in commands] == [
+        "join",
+        "join",
+        "join",
+        "push-object",
+        "push-objects",
+        "move-object",
+        "delete-object",
+        "leave",
+    ]
+    assert replayed.channels["tree"].objects["0"].position == Position(x=5, y=5)
+    assert replayed.channels["tree"].objects == channel.objects
+    assert replayed.channels["tree"].users.keys() == channel.users.keys()
+    assert stats.ops["join"].count == 3
+
+
+def test_replay_is_deterministic_on_virtual_time():
+    user = UserInfo(id="1", nickname="one")
+    commands = [
+        Command(at=0, op="join", channel_id="tree", user=user),
+        Command(
+            at=3600,
+            op="push-object",
+            channel_id="tree",
+            user=user,
+            objects=[make_object(0)],
+        ),
+        Command(at=7200, op="leave", channel_id="tree", user=user),
+    ]
+
+    first, second = run_replay(commands), run_replay(commands)
+
+    assert first.virtual_time == pytest.approx(7200)
+    assert first.wall_time < 1
+    assert first.dict(exclude={"wall_time"}) == second.dict(exclude={"wall_time"})
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import asyncio as aio
+
+from server.services.tasks import TaskSupervisor
+
+
+async def test_spawn_limits_concurrency():
+    supervisor = TaskSupervisor(limit=2)
+    running = peak = 0
+
+    async def work():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await aio.sleep(0.01)
+        running -= 1
+
+    await aio.gather(*(supervisor.spawn(work(), name="work") for _ in range(5)))
+
+    assert peak == 2
+    assert supervisor.running == 0
+    assert supervisor.stats["work"].finished == 5
+    assert supervisor.stats["work"].max_duration > 0
+
+
+async def test_limit_is_per_name():
+    supervisor = TaskSupervisor(limit=1)
+    blocker = supervisor.spawn(aio.sleep(1), name="notice")
+    waiting = supervisor.spawn(aio.sleep(0), name="notice")
+    other = supervisor.spawn(aio.sleep(0), name="detach")
+
+    await aio.wait_for(other, 0.5)
+    assert not waiting.done()
+
+    blocker.cancel()
+    await aio.wait_for(waiting, 0.5)
+
+
+async def test_spawn_with_key_is_unique_per_owner():
+    supervisor = TaskSupervisor()
+    first = supervisor.spawn(aio.sleep(1), name="notice", owner="s", key="notice")
+
+    assert (
+        supervisor.spawn(aio.sleep(1), name="notice", owner="s", key="notice") is first
+    )
+    other = supervisor.spawn(aio.sleep(1), name="notice", owner="t", key="notice")
+    assert other is not first
+
+    second = supervisor.spawn(
+        aio.sleep(1), name="notice", owner="s", key="notice", replace=True
+    )
+    await aio.sleep(0)
+    assert first.cancelled()
+    assert second is not first
+
+    assert supervisor.cancel_owner("s") == 1
+    assert supervisor.cancel_owner("t") == 1
+    await aio.wait([second, other])
+    await aio.sleep(0)
+    assert supervisor.running == 0
+    assert supervisor.stats["notice"].cancelled == 3
+
+
+async def test_failed_tasks_are_counted():
+    supervisor = TaskSupervisor()
+    reported = []
+    aio.get_running_loop().set_exception_handler(
+        lambda loop, context: reported.append(context)
+    )
+
+    async def fail():
+        raise ValueError
+
+    task = supervisor.spawn(fail(), name="fail")
+    await aio.wait([task])
+    await aio.sleep(0)
+
+    assert supervisor.stats["fail"].failed == 1
+    assert isinstance(reported[0]["exception"], ValueError)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from server.services.channel import (
+    BaseUserConnection,
+    Channel,
+    ChannelController,
+    ChannelPolicy,
+    Event,
+    Object,
+    Position,
+    User,
+)
+from server.services.tracing import Tracer
+
+
+def test_unsampled_traces_record_nothing():
+    tracer = Tracer(sample_rate=0)
+
+    trace_id = tracer.start()
+    with tracer.span(trace_id, "stage"):
+        pass
+
+    assert trace_id is None
+    assert not tracer.spans
+
+
+def test_ring_buffer_keeps_last_spans():
+    tracer = Tracer(sample_rate=1, capacity=2)
+    trace_id = tracer.start()
+
+    for index in range(3):
+        tracer.add(trace_id, f"span{index}", 0, 1)
+
+    assert [span.name for span in tracer.spans] == ["span1", "span2"]
+
+
+async def test_push_is_traced_through_stages(tmp_path: Path):
+    controller = ChannelController(tracer=Tracer(sample_rate=1))
+    channel = Channel(id="test")
+    controller.channels["test"] = channel
+    channel.initialize(controller, ChannelPolicy(max_objects=3, max_ccu=2))
+    received: list[Event] = []
+
+    class TempConn(BaseUserConnection):
+        async def send(self, data: Event):
+            received.append(data)
+
+    appender = User(id="1", nickname="one", connection=BaseUserConnection())
+    channel.users["1"] = appender
+    channel.users["2"] = User(id="2", nickname="two", connection=TempConn())
+
+    trace_id = controller.tracer.start()
+    await channel.push_object(
+        Object(id="a", url="url", comment="hi", position=Position(x=1, y=1)),
+        appender,
+        trace_id,
+    )
+
+    assert received[0].trace_id == trace_id
+    assert "trace_id" not in received[0].encode()
+    spans = controller.tracer.trace(trace_id)
+    assert {span.name for span in spans} == {"lock-wait", "fan-out", "send"}
+    send = next(span for span in spans if span.name == "send")
+    assert send.attributes == {"user": "2", "outcome": "sent"}
+
+    path = tmp_path / "traces.json"
+    assert controller.tracer.export(path) == 3
+    data = json.loads(path.read_text())
+    exported = data["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {span["traceId"] for span in exported} == {trace_id}
+    assert all(len(span["spanId"]) == 16 for span in exported)